@@ -7,13 +7,23 @@ Key points:
    for the Table 3 replication.
 3) Underscore escaping, skipping repeated lines about "There are significantly fewer..." etc.
 4) No large chunk of code omitted; this is the final complete version.
+5) Each section is written to its own fragment in _output/sections and pulled in with
+   \input, so the full document lays out exactly like a single inline file. Fragments
+   are cached by a hash of their input files (tables and figures), the PDF step is
+   skipped when nothing changed, and main(includeonly="changed") switches to
+   \include/\includeonly to recompile only the sections whose inputs changed
+   (\include starts every section on a new page, so use it for drafts only).
 """
 
+import hashlib
+import json
 import os
 import re
 import subprocess
 from pathlib import Path
 
+from misc_tools import file_hash, write_text_if_changed
+
 ##############################################################################
 # Helper functions for underscore escaping and skipping repeated lines
 ##############################################################################
@@ -136,42 +146,11 @@ def build_figure_env(image_filename: str, custom_title: str = "", descriptive_te
     return lines
 
 ##############################################################################
-# Main logic
+# Sections (each one becomes an \include'd fragment)
 ##############################################################################
 
-def main():
-    # Output directory
-    output_dir = (Path(__file__).resolve().parent.parent / "_output").resolve()
-    output_dir.mkdir(exist_ok=True)
-
-    combined_tex_filename = "combined_document.tex"
-    combined_tex_path = output_dir / combined_tex_filename
-
+def build_introduction_section(output_dir: Path) -> list[str]:
     latex_lines = []
-
-    # Preamble
-    latex_lines.append(r"\documentclass{article}")
-    latex_lines.append(r"\usepackage[utf8]{inputenc}")
-    latex_lines.append(r"\usepackage{graphicx}")
-    latex_lines.append(r"\usepackage{geometry}")
-    latex_lines.append(r"\usepackage{xcolor}")
-    latex_lines.append(r"\usepackage{adjustbox}")
-    latex_lines.append(r"\usepackage{booktabs}")
-    latex_lines.append(r"\usepackage{amsmath}")
-    latex_lines.append(r"\usepackage{amssymb}")
-    latex_lines.append(r"\usepackage{caption}")
-    latex_lines.append(r"\usepackage{float}")
-    latex_lines.append(r"\captionsetup{labelformat=empty}")
-    latex_lines.append(r"\geometry{left=1in, right=1in, top=1in, bottom=1in}")
-    latex_lines.append(r"\begin{document}")
-
-    # Title
-    latex_lines.append(r"\title{Intermediary asset pricing: New evidence from many asset classes}")
-    latex_lines.append(r"\author{Hanlu Ge and Junyuan Liu}")
-    latex_lines.append(r"\date{}")
-    latex_lines.append(r"\maketitle")
-
-    # Introduction
     latex_lines.append(r"\section{Introduction}")
 
     intro_p1 = r"""In this Final Project, our main task is to reproduce Table 2 and Table 3 from the paper "Intermediary asset pricing: New evidence from many asset classes" and to carry out a series of extension works based on this. Our specific work is divided into the following parts:"""
@@ -192,10 +171,10 @@ def main():
     intro_p2 = r"""Through the above work, we have successfully optimized the reproduction based on the reference code, making the reproduced results extremely close to the target results while achieving clear visualization and an automated project workflow."""
     for line in intro_p2.splitlines():
         latex_lines.append(escape_underscores_in_text(line))
+    return latex_lines
 
-    ########################################################
-    # Table 2 Replication
-    ########################################################
+def build_table02_section(output_dir: Path) -> list[str]:
+    latex_lines = []
     latex_lines.append(r"\section{Table 2 Replication}")
 
     # sub-item 1) table02.tex => no shrink
@@ -220,10 +199,10 @@ def main():
         "Table 2 Descriptive Statistics",
         "There are significantly fewer entries for book equity than for other measures as shown in the count rows. There are also some negatives for book equity."
     ))
+    return latex_lines
 
-    ########################################################
-    # Table 2 (Updated)
-    ########################################################
+def build_updated_table02_section(output_dir: Path) -> list[str]:
+    latex_lines = []
     latex_lines.append(r"\section{Table 2 (Updated)}")
     latex_lines.append("Below is the Table 2 result calculated using updated data up to 2025-02-01.")
 
@@ -249,10 +228,10 @@ def main():
         "Table 2 Descriptive Statistics(Updated)",
         "There are significantly fewer entries for book equity than for other measures as shown in the count rows. There are also some negatives for book equity."
     ))
+    return latex_lines
 
-    ########################################################
-    # Table 3 Replication
-    ########################################################
+def build_table03_section(output_dir: Path) -> list[str]:
+    latex_lines = []
     latex_lines.append(r"\section{Table 3 Replication}")
 
     table3_intro = r"""Next, we replicate Table 3. We made many key logic corrections, including important ratio calculation methods, macroeconomic data sources, and computational methods. As a result, we have greatly optimized the reproduction performance, with most correlations being very close to the original table's results."""
@@ -280,10 +259,10 @@ def main():
         output_dir / "table03_sstable.tex",
         "Table 3 Descriptive Statistics"
     ))
+    return latex_lines
 
-    ########################################################
-    # Table 3 (Updated)
-    ########################################################
+def build_updated_table03_section(output_dir: Path) -> list[str]:
+    latex_lines = []
     latex_lines.append(r"\section{Table 3 (Updated)}")
     latex_lines.append("Below is the Table 3 result calculated using updated data up to 2025-02-01.")
 
@@ -307,28 +286,177 @@ def main():
         output_dir / "updated_table03_sstable.tex",
         "Table 3 Descriptive Statistics(Updated)"
     ))
+    return latex_lines
+
+# (fragment name, builder, files in the output directory the fragment depends on)
+SECTIONS = [
+    ("introduction", build_introduction_section, []),
+    ("table02", build_table02_section,
+     ["table02.tex", "table02_figure.png", "table02_corr.tex", "table02_sstable.tex"]),
+    ("updated_table02", build_updated_table02_section,
+     ["updated_table02.tex", "updated_table02_figure.png", "updated_table02_corr.tex", "updated_table02_sstable.tex"]),
+    ("table03", build_table03_section,
+     ["table03.tex", "table03_figure.png", "table03_figure03.png", "table03_sstable.tex"]),
+    ("updated_table03", build_updated_table03_section,
+     ["updated_table03.tex", "updated_table03_figure.png", "updated_table03_figure03.png", "updated_table03_sstable.tex"]),
+]
+
+OUTPUT_DIR = Path(__file__).resolve().parent.parent / "_output"
+SECTIONS_DIRNAME = "sections"
+MANIFEST_FILENAME = "manifest.json"
 
-    latex_lines.append(r"\end{document}")
+##############################################################################
+# Incremental build helpers
+##############################################################################
+
+def section_input_hash(output_dir: Path, name: str, inputs: list[str]) -> str:
+    """
+    Hash of everything a section fragment depends on: the generator source
+    (so edits to titles/text invalidate the cache) and the bytes of each input file.
+    """
+    h = hashlib.sha256()
+    h.update(name.encode("utf-8"))
+    h.update((file_hash(Path(__file__)) or "").encode("utf-8"))
+    for fname in inputs:
+        h.update(fname.encode("utf-8"))
+        h.update((file_hash(output_dir / fname) or "missing").encode("utf-8"))
+    return h.hexdigest()
+
+def load_manifest(manifest_path: Path) -> dict:
+    if not manifest_path.exists():
+        return {"sections": {}, "pdf": None}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest_path: Path, manifest: dict) -> None:
+    write_text_if_changed(manifest_path, json.dumps(manifest, indent=2, sort_keys=True))
+
+def build_sections(output_dir: Path, manifest: dict, force: bool = False) -> list[str]:
+    """
+    Writes one .tex fragment per section to output_dir/sections, rebuilding only
+    the fragments whose inputs changed since the last run.
+    Returns the names of the sections that were rebuilt. This includes sections whose
+    fragment text is unchanged but whose inputs are new (e.g. a replaced figure).
+    """
+    sections_dir = output_dir / SECTIONS_DIRNAME
+    sections_dir.mkdir(exist_ok=True)
+    changed = []
+    for name, builder, inputs in SECTIONS:
+        fragment_path = sections_dir / f"{name}.tex"
+        input_hash = section_input_hash(output_dir, name, inputs)
+        if (not force) and fragment_path.exists() and manifest["sections"].get(name) == input_hash:
+            continue
+        fragment = "\n".join(builder(output_dir)) + "\n"
+        write_text_if_changed(fragment_path, fragment)
+        manifest["sections"][name] = input_hash
+        changed.append(name)
+    return changed
+
+def build_main_document(includeonly: list[str] | None = None) -> str:
+    r"""
+    The top-level document: preamble, title and one \input per section, or, with
+    includeonly, one \include per section plus an \includeonly line (each section
+    then starts on a new page).
+    """
+    latex_lines = []
+
+    # Preamble
+    latex_lines.append(r"\documentclass{article}")
+    latex_lines.append(r"\usepackage[utf8]{inputenc}")
+    latex_lines.append(r"\usepackage{graphicx}")
+    latex_lines.append(r"\usepackage{geometry}")
+    latex_lines.append(r"\usepackage{xcolor}")
+    latex_lines.append(r"\usepackage{adjustbox}")
+    latex_lines.append(r"\usepackage{booktabs}")
+    latex_lines.append(r"\usepackage{amsmath}")
+    latex_lines.append(r"\usepackage{amssymb}")
+    latex_lines.append(r"\usepackage{caption}")
+    latex_lines.append(r"\usepackage{float}")
+    latex_lines.append(r"\captionsetup{labelformat=empty}")
+    latex_lines.append(r"\geometry{left=1in, right=1in, top=1in, bottom=1in}")
+    if includeonly is not None:
+        names = ",".join(f"{SECTIONS_DIRNAME}/{name}" for name in includeonly)
+        latex_lines.append(f"\\includeonly{{{names}}}")
+    latex_lines.append(r"\begin{document}")
+
+    # Title
+    latex_lines.append(r"\title{Intermediary asset pricing: New evidence from many asset classes}")
+    latex_lines.append(r"\author{Hanlu Ge and Junyuan Liu}")
+    latex_lines.append(r"\date{}")
+    latex_lines.append(r"\maketitle")
 
-    final_tex = "\n".join(latex_lines)
-    with open(combined_tex_path, "w", encoding="utf-8") as f:
-        f.write(final_tex)
+    command = "input" if includeonly is None else "include"
+    for name, _, _ in SECTIONS:
+        latex_lines.append(f"\\{command}{{{SECTIONS_DIRNAME}/{name}}}")
 
-    print(f"Merged LaTeX file generated at: {combined_tex_path}")
+    latex_lines.append(r"\end{document}")
+    return "\n".join(latex_lines)
 
+def compile_pdf(output_dir: Path, tex_filename: str) -> bool:
     # xelatex
     try:
         subprocess.run(
-            ["xelatex", "-interaction=nonstopmode", combined_tex_filename],
+            ["xelatex", "-interaction=nonstopmode", tex_filename],
             cwd=output_dir,
             check=True,
             timeout=60
         )
         print("XeLaTeX compilation successful!")
+        return True
     except subprocess.CalledProcessError as e:
         print("XeLaTeX compilation failed (xelatex returned an error):", e)
     except subprocess.TimeoutExpired:
         print("xelatex command timed out.")
+    except FileNotFoundError:
+        print("xelatex not found; skipping PDF compilation.")
+    return False
+
+##############################################################################
+# Main logic
+##############################################################################
+
+def main(includeonly=None, force=False):
+    r"""
+    Assembles combined_document.tex from per-section fragments and compiles it.
+
+    includeonly: None (full document, sections pulled in with \input), "changed" (only
+                 the sections rebuilt in this run, via \include and \includeonly; the
+                 other sections keep their .aux state), or an explicit list of section names.
+    force:       rebuild every fragment and recompile even if nothing changed.
+    """
+    # Output directory
+    output_dir = OUTPUT_DIR.resolve()
+    output_dir.mkdir(exist_ok=True)
+
+    combined_tex_filename = "combined_document.tex"
+    combined_tex_path = output_dir / combined_tex_filename
+    combined_pdf_path = combined_tex_path.with_suffix(".pdf")
+    manifest_path = output_dir / SECTIONS_DIRNAME / MANIFEST_FILENAME
+
+    manifest = load_manifest(manifest_path)
+    changed = build_sections(output_dir, manifest, force=force)
+    print(f"Sections rebuilt: {', '.join(changed) if changed else 'none'}")
+
+    if includeonly == "changed":
+        includeonly = changed or None
+    final_tex = build_main_document(includeonly=includeonly)
+    if write_text_if_changed(combined_tex_path, final_tex):
+        print(f"Merged LaTeX file generated at: {combined_tex_path}")
+    else:
+        print(f"Merged LaTeX file unchanged: {combined_tex_path}")
+
+    # The PDF is up to date if neither the main document nor any fragment changed since the last compile
+    build_state = hashlib.sha256(
+        (file_hash(combined_tex_path) + json.dumps(manifest["sections"], sort_keys=True)).encode("utf-8")
+    ).hexdigest()
+    if (not force) and combined_pdf_path.exists() and manifest.get("pdf") == build_state:
+        print("Nothing changed; skipping PDF compilation.")
+        save_manifest(manifest_path, manifest)
+        return
+
+    if compile_pdf(output_dir, combined_tex_filename):
+        manifest["pdf"] = build_state
+    save_manifest(manifest_path, manifest)
 
 if __name__ == "__main__":
     main()
@@ -4,10 +4,14 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 import pandas as pd
 import wrds
 import config
+from config import get_table02_backend
 from datetime import datetime
 import matplotlib.pyplot as plt
 import numpy as np
+import polars as pl
 from pathlib import Path
+from misc_tools import write_text_if_changed, savefig_if_changed
+from pipeline_profiling import stage
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -22,6 +26,7 @@ Provides analysis utilities for Table 02, including:
 No testing code is included here; see Table02_testing.py for tests.
 """
 
+@stage()
 def create_summary_stat_table_for_data(datasets, UPDATED=False):
     """
     Creates summary statistics (count, mean, std, min, max) for each group's dataset,
@@ -70,11 +75,13 @@ def create_summary_stat_table_for_data(datasets, UPDATED=False):
 
     config.OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    with open(out, 'w', encoding='utf-8') as f:
-        f.write(latex)
-    print(f"Summary stats LaTeX saved to: {out}")
+    if write_text_if_changed(out, latex):
+        print(f"Summary stats LaTeX saved to: {out}")
+    else:
+        print(f"Summary stats LaTeX unchanged: {out}")
 
 
+@stage()
 def create_figure_for_data(ratio_df, UPDATED=False):
     """
     Plots lines for ratio columns, grouped by subplots:
@@ -111,8 +118,8 @@ def create_figure_for_data(ratio_df, UPDATED=False):
         ax.set_xlabel('Date')
         ax.set_ylabel('Value')
 
-    time = datetime.now()
-    cap = f"{time}: Subplots show ratio lines, no rolling average."
+    # No timestamp in the caption, so that an unchanged figure produces an identical file.
+    cap = "Subplots show ratio lines, no rolling average."
     fig.text(0.5, -0.08, cap, ha='center', fontsize=8)
 
     if UPDATED:
@@ -122,22 +129,74 @@ def create_figure_for_data(ratio_df, UPDATED=False):
 
     config.OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    plt.savefig(figpath, bbox_inches='tight')
+    if savefig_if_changed(figpath, fig, bbox_inches='tight'):
+        print(f"Figure saved to: {figpath}")
+    else:
+        print(f"Figure unchanged: {figpath}")
     plt.close(fig)
-    print(f"Figure saved to: {figpath}")
 
 
-def create_corr_matrix_for_data(datasets, UPDATED=False):
+def _corr_to_latex(corr, m):
+    # Escape underscores in the metric name for the caption
+    escaped_m = m.replace("_", r"\_")
+    c_latex = corr.to_latex(
+        float_format="%.3f",
+        caption=f"Correlation of {escaped_m} across PD, BD, Banks, Cmpust.",
+        label=f"tab:{m}",
+        escape=False  # We'll manually replace underscores next
+    )
+    # Now manually escape underscores in the final string
+    return c_latex.replace("_", r"\_")
+
+def _combine_metric_polars(datasets, m, group_order):
+    """
+    One column per group with metric m, indexed by date: the polars equivalent of the
+    outer joins in create_corr_matrix_for_data. The correlations themselves are still
+    computed by pandas, so both backends produce the same table.
+    """
+    frames = []
+    for g in group_order:
+        if g not in datasets or m not in datasets[g].columns:
+            continue
+        sub = datasets[g][['datadate', m]].assign(datadate=pd.to_datetime(datasets[g]['datadate']))
+        frames.append(
+            pl.from_pandas(sub).lazy()
+            .with_columns(pl.col('datadate').cast(pl.Datetime('ns')), pl.col(m).cast(pl.Float64, strict=False))
+            .drop_nulls(m)
+            .unique(subset='datadate', keep='first', maintain_order=True)
+            .rename({m: f"{m}_{g}"})
+        )
+    if not frames:
+        return None
+    combined = frames[0]
+    for frame in frames[1:]:
+        combined = combined.join(frame, on='datadate', how='full', coalesce=True)
+    return combined.sort('datadate').collect().to_pandas().set_index('datadate')
+
+@stage()
+def create_corr_matrix_for_data(datasets, UPDATED=False, backend=None):
     """
     Builds correlation matrices for each metric (total_assets, book_debt, book_equity, market_equity)
     across PD, BD, Banks, Cmpust.
     The result is saved as a LaTeX file in config.OUTPUT_DIR, with underscores escaped.
+    With backend='polars' (or TABLE02_BACKEND=polars) the per-metric frames are built with polars joins.
     """
     group_order = ['PD','BD','Banks','Cmpust.']
     metrics = ['total_assets','book_debt','book_equity','market_equity']
     all_latex = []
+    use_polars = get_table02_backend(backend) == 'polars'
 
     for m in metrics:
+        if use_polars:
+            combined_df = _combine_metric_polars(datasets, m, group_order)
+            if combined_df is None:
+                continue
+            combined_df.dropna(how='all', inplace=True)
+            if len(combined_df.columns) < 2:
+                continue
+            corr = combined_df.corr()
+            all_latex.append(_corr_to_latex(corr, m))
+            continue
         combined_df = pd.DataFrame()
         for g in group_order:
             if g not in datasets:
@@ -162,19 +221,7 @@ def create_corr_matrix_for_data(datasets, UPDATED=False):
             continue
 
         corr = combined_df.corr()
-
-        # Escape underscores in the metric name for the caption
-        escaped_m = m.replace("_", r"\_")
-        c_latex = corr.to_latex(
-            float_format="%.3f",
-            caption=f"Correlation of {escaped_m} across PD, BD, Banks, Cmpust.",
-            label=f"tab:{m}",
-            escape=False  # We'll manually replace underscores next
-        )
-        # Now manually escape underscores in the final string
-        c_latex = c_latex.replace("_", r"\_")
-
-        all_latex.append(c_latex)
+        all_latex.append(_corr_to_latex(corr, m))
 
     final_txt = "\n\n".join(all_latex)
     if UPDATED:
@@ -184,7 +231,7 @@ def create_corr_matrix_for_data(datasets, UPDATED=False):
 
     config.OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    with open(out, 'w', encoding='utf-8') as f:
-        f.write(final_txt)
-
-    print(f"Correlation matrix LaTeX saved to: {out}")
+    if write_text_if_changed(out, final_txt):
+        print(f"Correlation matrix LaTeX saved to: {out}")
+    else:
+        print(f"Correlation matrix LaTeX unchanged: {out}")
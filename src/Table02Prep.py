@@ -12,11 +12,17 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 import pandas as pd
 import wrds
 import config
+from config import get_table02_backend
 from datetime import datetime
 import matplotlib.pyplot as plt
 import numpy as np
+import polars as pl
 import Table02Analysis
 from pathlib import Path
+from misc_tools import write_text_if_changed
+from pipeline_profiling import stage, profiled_run
+from fixture_store import recorded, connect_wrds
+import vintage_store
 
 def clean_primary_dealers_data(fname):
     file_path = config.MANUAL_DATA / fname
@@ -115,6 +121,7 @@ def read_in_manual_datasets():
     linktable = pd.read_csv(link_csv)
     return ticks, linktable
 
+@recorded()
 def pull_CRSP_Comp_Link_Table():
     sql_query = """
         SELECT 
@@ -143,6 +150,8 @@ def create_comparison_group_linktables(link_hist, merged_main):
         "PD": merged_main
     }
 
+@stage(fetch=True)
+@recorded()
 def pull_data_for_all_comparison_groups(db, comparison_group_dict, UPDATED=False):
     datasets = {}
     for key, linktable in comparison_group_dict.items():
@@ -158,9 +167,14 @@ def pull_data_for_all_comparison_groups(db, comparison_group_dict, UPDATED=False
         datasets[key] = ds.drop_duplicates()
     return datasets
 
-def prep_datasets(datasets):
+KEY_COLS = ['total_assets', 'book_debt', 'book_equity', 'market_equity']
+
+@stage()
+def prep_datasets(datasets, backend=None):
+    if get_table02_backend(backend) == 'polars':
+        return _prep_datasets_polars(datasets)
     prepped_datasets = {}
-    key_cols = ['total_assets', 'book_debt', 'book_equity', 'market_equity']
+    key_cols = KEY_COLS
     for group_name, df in datasets.items():
         if 'datadate' in df.columns:
             df['datadate'] = pd.to_datetime(df['datadate'])
@@ -175,19 +189,59 @@ def prep_datasets(datasets):
         prepped_datasets[group_name] = grouped
     return prepped_datasets
 
-def create_ratios_for_table(prepped_datasets, UPDATED=False):
+def _prep_datasets_polars(datasets):
+    """
+    Polars version of prep_datasets. The cleaning (quarter start dates, numeric coercion,
+    mean fill) and the quarterly sums of all groups run as lazy queries collected together
+    on all cores.
+
+    Like the pandas version, the cleaned columns are written back to the input frames,
+    because the summary statistics and correlation stages use the cleaned data.
+    """
+    cleaned = {}
+    for group_name, df in datasets.items():
+        if 'datadate' not in df.columns:
+            raise KeyError(f"'datadate' column not found for group {group_name}")
+        lf = pl.from_pandas(df[['datadate', *KEY_COLS]].assign(datadate=pd.to_datetime(df['datadate']))).lazy()
+        lf = lf.with_columns(
+            pl.col('datadate').dt.truncate('1q').cast(pl.Datetime('ns')),
+            *[pl.col(c).cast(pl.Float64, strict=False) for c in KEY_COLS],
+        ).with_columns(
+            [pl.col(c).fill_null(pl.col(c).mean()) for c in KEY_COLS]
+        )
+        cleaned[group_name] = lf
+
+    names = list(datasets)
+    cleaned = dict(zip(names, pl.collect_all([cleaned[g] for g in names])))
+    grouped = pl.collect_all([
+        cleaned[g].lazy().group_by('datadate').agg(pl.col(KEY_COLS).sum()).sort('datadate') for g in names
+    ])
+    prepped_datasets = {}
+    for group_name, summed in zip(names, grouped):
+        df = datasets[group_name]
+        df['datadate'] = cleaned[group_name]['datadate'].to_numpy()
+        df[KEY_COLS] = cleaned[group_name].select(KEY_COLS).to_numpy()
+        prepped_datasets[group_name] = summed.to_pandas()
+    return prepped_datasets
+
+def get_sample_periods(UPDATED=False):
     if not UPDATED:
-        sample_periods = [
+        return [
             ('1960-01-01', '2012-12-31'),
             ('1960-01-01', '1990-12-31'),
             ('1990-01-01', '2012-12-31')
         ]
-    else:
-        sample_periods = [
-            ('1960-01-01', '2025-01-01'),
-            ('1960-01-01', '1990-12-31'),
-            ('1990-01-01', '2025-01-01')
-        ]
+    return [
+        ('1960-01-01', '2025-01-01'),
+        ('1960-01-01', '1990-12-31'),
+        ('1990-01-01', '2025-01-01')
+    ]
+
+@stage()
+def create_ratios_for_table(prepped_datasets, UPDATED=False, backend=None):
+    if get_table02_backend(backend) == 'polars':
+        return _create_ratios_for_table_polars(prepped_datasets, UPDATED=UPDATED)
+    sample_periods = get_sample_periods(UPDATED)
     pd_df = prepped_datasets['PD']
     pd_df['datadate'] = pd.to_datetime(pd_df['datadate'])
     pd_df.index = pd_df['datadate']
@@ -220,6 +274,42 @@ def create_ratios_for_table(prepped_datasets, UPDATED=False):
         combined = pd.concat([combined, df])
     return combined
 
+def _create_ratios_for_table_polars(prepped_datasets, UPDATED=False):
+    """
+    Polars version of create_ratios_for_table: each group is left-joined to PD on the
+    quarter, so every PD quarter in the sample period gets a ratio PD / (PD + group).
+    """
+    pd_lf = pl.from_pandas(prepped_datasets['PD'][['datadate', *KEY_COLS]]).lazy()
+    groups = {g: pl.from_pandas(df[['datadate', *KEY_COLS]]).lazy()
+              for g, df in prepped_datasets.items() if g != 'PD'}
+
+    queries, periods = [], []
+    for period in get_sample_periods(UPDATED):
+        start_date, end_date = map(lambda d: datetime.strptime(d, '%Y-%m-%d'), period)
+        # Same bounds as the pandas string slicing: the whole end day is included
+        end_exclusive = end_date + pd.Timedelta(days=1)
+        in_period = (pl.col('datadate') >= start_date) & (pl.col('datadate') < end_exclusive)
+        lf = pd_lf.filter(in_period)
+        ratio_cols = []
+        for grp_name, grp_lf in groups.items():
+            sub = grp_lf.filter(in_period).rename({c: f'{c}__{grp_name}' for c in KEY_COLS})
+            lf = lf.join(sub, on='datadate', how='left')
+            for c in KEY_COLS:
+                sum_col = pl.col(c) + pl.col(f'{c}__{grp_name}')
+                ratio_cols.append(
+                    pl.when(sum_col == 0).then(None).otherwise(pl.col(c) / sum_col).alias(f'{c}_{grp_name}')
+                )
+        queries.append(lf.sort('datadate').select('datadate', *ratio_cols))
+        periods.append(f"{start_date.year}-{end_date.year}")
+
+    frames = []
+    for period, result in zip(periods, pl.collect_all(queries)):
+        df = result.to_pandas().set_index('datadate')
+        df['Period'] = period
+        frames.append(df)
+    return pd.concat(frames)
+
+@stage()
 def format_final_table(table, UPDATED=False):
     table = table.groupby('Period').mean()
     all_cols = [
@@ -263,10 +353,12 @@ def format_final_table(table, UPDATED=False):
     final_df = final_df.reindex(new_order)
     return final_df
 
+@stage()
 def convert_and_export_table_to_latex(formatted_table, UPDATED=False):
     """
     Exports the final ratio table as LaTeX, writing to config.OUTPUT_DIR.
     We do a string replacement to escape underscores, preventing LaTeX underscore errors.
+    The file is only rewritten when its content changes.
     """
     # Generate LaTeX from DataFrame
     latex = formatted_table.to_latex(index=True, column_format='lcccccccccccc', float_format="%.3f")
@@ -293,23 +385,29 @@ def convert_and_export_table_to_latex(formatted_table, UPDATED=False):
     \end{{table}}
     """
     outpath = config.OUTPUT_DIR / fname
-    with open(outpath, 'w', encoding='utf-8') as f:
-        f.write(wrapper)
-    print(f"Table 02 LaTeX saved to: {outpath}")
+    if write_text_if_changed(outpath, wrapper):
+        print(f"Table 02 LaTeX saved to: {outpath}")
+    else:
+        print(f"Table 02 LaTeX unchanged: {outpath}")
 
-def main(UPDATED=False):
-    db = wrds.Connection(wrds_username=config.WRDS_USERNAME)
+@profiled_run("table02")
+def main(UPDATED=False, backend=None):
+    db = connect_wrds()
     merged_main = clean_primary_dealers_data(fname='Primary_Dealer_Link_Table3.csv')
     link_hist = load_link_table(fname='updated_linktable.csv')
     group_links = create_comparison_group_linktables(link_hist, merged_main)
 
     ds = pull_data_for_all_comparison_groups(db, group_links, UPDATED=UPDATED)
-    pds = prep_datasets(ds)
+    if config.SAVE_VINTAGES:
+        for group, data in ds.items():
+            name = f"table02_{group.rstrip('.').lower()}" + ("_updated" if UPDATED else "")
+            vintage_store.snapshot_and_report(data, name, key_cols=["gvkey", "datadate"], partition_col="datadate")
+    pds = prep_datasets(ds, backend=backend)
 
     Table02Analysis.create_summary_stat_table_for_data(ds, UPDATED=UPDATED)
-    ratio_df = create_ratios_for_table(pds, UPDATED=UPDATED)
+    ratio_df = create_ratios_for_table(pds, UPDATED=UPDATED, backend=backend)
     Table02Analysis.create_figure_for_data(ratio_df, UPDATED=UPDATED)
-    Table02Analysis.create_corr_matrix_for_data(ds, UPDATED=UPDATED)  # <-- This also produces .tex with underscores
+    Table02Analysis.create_corr_matrix_for_data(ds, UPDATED=UPDATED, backend=backend)  # <-- This also produces .tex with underscores
     formatted = format_final_table(ratio_df, UPDATED=UPDATED)
     convert_and_export_table_to_latex(formatted, UPDATED=UPDATED)
     return formatted
@@ -4,6 +4,9 @@ Table02_testing.py
 All unit tests for the Table 02 pipeline, previously in Table02Prep.py.
 Ensures that the data pipeline, ratio calculations, and final outputs 
 meet expected constraints.
+
+Run with DATA_MODE=record once (needs WRDS and network), then with DATA_MODE=replay
+to run offline from the recorded fixtures (see fixture_store.py).
 """
 
 import warnings
@@ -22,6 +25,7 @@ from pathlib import Path
 import pandas as pd
 import numpy as np
 import Table02Prep
+from fixture_store import connect_wrds
 
 class TestFormattedTable(unittest.TestCase):
     """
@@ -37,7 +41,7 @@ class TestFormattedTable(unittest.TestCase):
         cls.formatted_table = Table02Prep.main()
         
         # For auxiliary checks (gvkeys etc.), use the available functions:
-        cls.db = wrds.Connection(wrds_username=config.WRDS_USERNAME)
+        cls.db = connect_wrds()
         # 通过 clean_primary_dealers_data 和 load_link_table 获取数据
         merged_main = Table02Prep.clean_primary_dealers_data(fname='Primary_Dealer_Link_Table3.csv')
         link_hist = Table02Prep.load_link_table(fname='updated_linktable.csv')
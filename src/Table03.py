@@ -28,7 +28,14 @@ importlib.reload(Table03Load)
 from Table03Load import quarter_to_date, date_to_quarter
 import Table03Analysis
 import Table02Prep
-
+from misc_tools import write_text_if_changed, groupby_weighted_average, groupby_weighted_quantiles
+from pipeline_profiling import stage, profiled_run
+from fixture_store import connect_wrds
+import vintage_store
+import Table03DealerPanel
+import Table03Inference
+
+@stage()
 def combine_bd_financials(UPDATED=False):
     """
     Combine broker-dealer financial data from historical sources and, if UPDATED, from recent FRED data.
@@ -49,16 +56,18 @@ def combine_bd_financials(UPDATED=False):
     
     return bd_financials_combined    
 
-def prep_dataset(dataset, UPDATED=False):
+@stage()
+def prep_dataset(dataset, UPDATED=False, bd_financials=None):
     """
     Prepare the raw financial dataset by removing duplicates, converting quarter strings to dates,
     and aggregating key financial columns by quarter.
-    Input: dataset (DataFrame) with raw financial data and UPDATED flag.
+    Input: dataset (DataFrame) with raw financial data and UPDATED flag. bd_financials optionally
+    supplies the broker-dealer data; by default it is loaded with combine_bd_financials.
     Output: Aggregated DataFrame with summed total_assets, book_debt, book_equity, and market_equity,
     merged with broker-dealer data.
     """
     dataset = dataset.drop_duplicates()
-    dataset['datafqtr'] = dataset['datafqtr'].apply(quarter_to_date)
+    dataset['datafqtr'] = quarter_to_date(dataset['datafqtr'])
     dataset = dataset.dropna()
     aggregated_dataset = dataset.groupby('datafqtr').agg({
         'total_assets': 'sum',
@@ -67,8 +76,9 @@ def prep_dataset(dataset, UPDATED=False):
         'market_equity': 'sum'
     }).reset_index()
     
-    bd_financials_combined = combine_bd_financials(UPDATED=UPDATED)
-    aggregated_dataset = aggregated_dataset.merge(bd_financials_combined, left_on='datafqtr', right_index=True)
+    if bd_financials is None:
+        bd_financials = combine_bd_financials(UPDATED=UPDATED)
+    aggregated_dataset = aggregated_dataset.merge(bd_financials, left_on='datafqtr', right_index=True)
     if not UPDATED:
         aggregated_dataset = aggregated_dataset[
             (aggregated_dataset['datafqtr'] >= "1970-01-01") & 
@@ -139,6 +149,7 @@ def calculate_ratios(data):
 #     return aggregated_dataset
 
 
+@stage()
 def aggregate_ratios(data):
     """
     Aggregates the calculated financial ratios and sets the date as the index.
@@ -153,6 +164,78 @@ def aggregate_ratios(data):
     data = data.set_index('date')
     return data
 
+WEIGHTING_SCHEMES = ['aggregate', 'value', 'equal', 'median']
+
+@stage()
+def calculate_ratio_variants(dataset, UPDATED=False, bd_financials=None, ratios=None):
+    """
+    Capital ratios under several weighting schemes, side by side.
+    Input: dataset (DataFrame) with raw financial data as for prep_dataset; ratios optionally the
+    aggregate_ratios result already computed for dataset (otherwise it is computed here, with
+    bd_financials as for prep_dataset).
+    Output: DataFrame indexed by date (the quarters of aggregate_ratios) with columns
+    market_cap_ratio_<scheme> and book_cap_ratio_<scheme> for each scheme in WEIGHTING_SCHEMES,
+    and aem_leverage:
+      aggregate: ratio of the summed dealer balance sheets (the Table 3 definition),
+      value:     average of the dealer ratios weighted by dealer market equity,
+      equal:     equally weighted average of the dealer ratios,
+      median:    median of the dealer ratios.
+    The dealer ratios are computed once from the dealer rows of dataset, filtered like prep_dataset
+    does before summing (duplicates and rows with missing values dropped); each scheme is one
+    grouped pass over them.
+    """
+    if ratios is None:
+        ratios = aggregate_ratios(prep_dataset(dataset.copy(), UPDATED=UPDATED, bd_financials=bd_financials))
+
+    dealers = dataset.drop_duplicates()
+    dealers['datafqtr'] = quarter_to_date(dealers['datafqtr'])
+    dealers = dealers.dropna()
+    ratio_cols = ['market_cap_ratio', 'book_cap_ratio']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dealers['market_cap_ratio'] = dealers['market_equity'] / (dealers['book_debt'] + dealers['market_equity'])
+        dealers['book_cap_ratio'] = dealers['book_equity'] / (dealers['book_debt'] + dealers['book_equity'])
+    dealers[ratio_cols] = dealers[ratio_cols].replace([np.inf, -np.inf], np.nan)
+
+    variants = {
+        'aggregate': ratios[ratio_cols],
+        'value': groupby_weighted_average(data_col=ratio_cols, weight_col='market_equity', by_col='datafqtr', data=dealers),
+        'equal': dealers.groupby('datafqtr')[ratio_cols].mean(),
+        'median': pd.concat({
+            col: groupby_weighted_quantiles(data_col=col, weight_col=None, by_col='datafqtr', data=dealers, quantiles=[0.5])[0.5]
+            for col in ratio_cols
+        }, axis=1),
+    }
+    result = pd.DataFrame(index=ratios.index)
+    for col in ratio_cols:
+        for scheme in WEIGHTING_SCHEMES:
+            result[f'{col}_{scheme}'] = variants[scheme][col].reindex(ratios.index)
+    result['aem_leverage'] = ratios['aem_leverage']
+    return result
+
+def ratios_for_scheme(variants, scheme):
+    """The columns of one weighting scheme from calculate_ratio_variants, named as in aggregate_ratios."""
+    return pd.DataFrame({
+        'market_cap_ratio': variants[f'market_cap_ratio_{scheme}'],
+        'book_cap_ratio': variants[f'book_cap_ratio_{scheme}'],
+        'aem_leverage': variants['aem_leverage'],
+    })
+
+@stage()
+def calculate_correlation_variants(variants, macro, UPDATED=False):
+    """
+    Table 3 correlations (Panels A and B) for every weighting scheme.
+    Input: variants from calculate_ratio_variants and macro from macro_variables.
+    Output: two DataFrames (Panel A, Panel B) indexed by (scheme, row).
+    """
+    corr_a, corr_b = {}, {}
+    for scheme in WEIGHTING_SCHEMES:
+        ratios = ratios_for_scheme(variants, scheme)
+        factors = convert_ratios_to_factors(ratios)
+        corr_a[scheme] = calculate_correlation_panelA(create_panelA(ratios, macro), UPDATED=UPDATED)
+        corr_b[scheme] = calculate_correlation_panelB(create_panelB(factors, macro), UPDATED=UPDATED)
+    return pd.concat(corr_a, names=['scheme', 'row']), pd.concat(corr_b, names=['scheme', 'row'])
+
+@stage()
 def convert_ratios_to_factors(data):
     """
     Converts financial ratios into analytical factors.
@@ -201,6 +284,7 @@ def calculate_ep(shiller_cape):
     df['e/p'] = 1 / df['cape']
     return df
 
+@stage()
 def macro_variables(db, from_cache=True, UPDATED=False):
     """
     Creates a merged DataFrame of quarterly macroeconomic variables.
@@ -249,6 +333,7 @@ def macro_variables(db, from_cache=True, UPDATED=False):
 
     return macro_merged
 
+@stage()
 def create_panelA(ratios, macro):
     """
     Creates Panel A for Table 03 by merging financial ratios with macroeconomic variables.
@@ -277,6 +362,7 @@ def create_panelA(ratios, macro):
     panelA = panelA.loc['1970-01-01':]
     return panelA
 
+@stage()
 def create_panelB(factors, macro):
     """
     Creates Panel B for Table 03 by merging analytical factors with macroeconomic variable growth rates.
@@ -317,6 +403,7 @@ def format_correlation_matrix(corr_matrix):
     corr_matrix = corr_matrix.where(np.triu(np.ones(corr_matrix.shape), k=0).astype(bool))
     return corr_matrix
 
+@stage()
 def calculate_correlation_panelA(panelA,UPDATED=False):
     """
     Calculates pairwise correlations for Panel A (levels) data.
@@ -334,6 +421,7 @@ def calculate_correlation_panelA(panelA,UPDATED=False):
         correlation_results_panelA[column] = main_cols.corrwith(other_cols[column])
     return pd.concat([correlation_panelA, correlation_results_panelA.T], axis=0)
 
+@stage()
 def calculate_correlation_panelB(panelB,UPDATED=False):
     """
     Calculates pairwise correlations for Panel B (factor growth rates) data.
@@ -368,12 +456,14 @@ def format_final_table(corrA, corrB):
     full_table = pd.concat([panelA_title, corrA, panelB_title, panelB_combined])
     return full_table
 
+@stage()
 def convert_and_export_tables_to_latex(corrA, corrB, UPDATED=False):
     """
     Converts correlation tables to LaTeX format and exports the result as a .tex file.
     Input: corrA and corrB (DataFrames) and an UPDATED flag.
     Output: A LaTeX file saved in the directory specified by config.OUTPUT_DIR.
-    The function rounds values, formats columns, and writes the LaTeX table to disk.
+    The function rounds values, formats columns, and writes the LaTeX table to disk
+    (only when the content differs from the existing file).
     """
     corrA = corrA.round(2).fillna('')
     corrB = corrB.round(2).fillna('')
@@ -407,21 +497,31 @@ def convert_and_export_tables_to_latex(corrA, corrB, UPDATED=False):
     \end{{table}}
     """
     outfile = config.OUTPUT_DIR / ("updated_table03.tex" if UPDATED else "table03.tex")
-    with open(outfile, 'w', encoding='utf-8') as f:
-        f.write(full_latex)
+    write_text_if_changed(outfile, full_latex)
 
-def main(UPDATED=False):
+@profiled_run("table03")
+def main(UPDATED=False, from_panel=False):
     """
     Main function to execute the entire data processing pipeline for Table 03.
-    Input: UPDATED (bool) flag to determine if updated data should be used.
+    Input: UPDATED (bool) flag to determine if updated data should be used; from_panel (bool) to use
+    the dealer panel saved by a previous run (Table03DealerPanel.py) instead of fetching fundq.
     Output: Generates and exports a formatted correlation table in LaTeX format.
-    The function connects to WRDS, processes primary dealer data, calculates ratios and factors,
+    The function connects to WRDS (unless DATA_MODE=replay), processes primary dealer data, calculates ratios and factors,
     merges with macro variables, and exports summary statistics, figures, and correlation matrices.
     """
-    db = wrds.Connection(wrds_username=config.WRDS_USERNAME)
-    prim_dealers = Table02Prep.clean_primary_dealers_data(fname='Primary_Dealer_Link_Table3.csv')
-    dataset, _ = Table03Load.fetch_data_for_tickers(prim_dealers, db)
-    prep_datast = prep_dataset(dataset, UPDATED=UPDATED)
+    db = connect_wrds()
+    if from_panel:
+        # Rebuild from the saved dealer panel instead of fetching fundq again
+        dataset = Table03DealerPanel.to_fundq(Table03DealerPanel.load_dealer_panel(UPDATED=UPDATED))
+    else:
+        prim_dealers = Table02Prep.clean_primary_dealers_data(fname='Primary_Dealer_Link_Table3.csv')
+        dataset, _ = Table03Load.fetch_data_for_tickers(prim_dealers, db, coalesce=True)
+        Table03DealerPanel.save_dealer_panel(Table03DealerPanel.build_dealer_panel(dataset), UPDATED=UPDATED)
+        if config.SAVE_VINTAGES:
+            vintage_store.snapshot_and_report(dataset, "table03_fundq_updated" if UPDATED else "table03_fundq",
+                                              key_cols=["gvkey", "datafqtr"], partition_col="datafqtr")
+    bd_financials = combine_bd_financials(UPDATED=UPDATED)
+    prep_datast = prep_dataset(dataset, UPDATED=UPDATED, bd_financials=bd_financials)
     ratio_dataset = aggregate_ratios(prep_datast)
     factors_dataset = convert_ratios_to_factors(ratio_dataset)
     macro_dataset = macro_variables(db, UPDATED=UPDATED)
@@ -438,6 +538,25 @@ def main(UPDATED=False):
     convert_and_export_tables_to_latex(correlation_panelA, correlation_panelB, UPDATED=UPDATED)
     print(formatted_table.style.format(na_rep=''))
 
+    if config.TABLE03_WEIGHTING_VARIANTS:
+        variants = calculate_ratio_variants(dataset, UPDATED=UPDATED, bd_financials=bd_financials, ratios=ratio_dataset)
+        variants_A, variants_B = calculate_correlation_variants(variants, macro_dataset)
+        outfile = config.OUTPUT_DIR / ("updated_table03_weighting_variants.tex" if UPDATED else "table03_weighting_variants.tex")
+        latex = "\n\n".join(table.to_latex(na_rep='', float_format="%.2f") for table in (variants_A, variants_B))
+        write_text_if_changed(outfile, latex)
+
+    if config.TABLE03_BOOTSTRAP_REPS > 0:
+        options = dict(n_boot=config.TABLE03_BOOTSTRAP_REPS, method=config.TABLE03_BOOTSTRAP_METHOD,
+                       n_jobs=config.TABLE03_BOOTSTRAP_JOBS)
+        # Same samples as correlation_panelA/B above
+        Table03Inference.export_bootstrap_tables(Table03Inference.bootstrap_panelA(panelA, **options),
+                                                 Table03Inference.bootstrap_panelB(panelB, **options),
+                                                 UPDATED=UPDATED)
+
+    if config.TABLE03_HAC:
+        Table03Inference.export_hac_tables(Table03Inference.hac_panelA(panelA), Table03Inference.hac_panelB(panelB),
+                                           Table03Inference.factor_regressions(panelB), UPDATED=UPDATED)
+
 
 if __name__ == "__main__":
     main(UPDATED=False)
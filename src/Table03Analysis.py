@@ -15,7 +15,10 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import config  # Use config to standardize paths
+from misc_tools import write_text_if_changed, savefig_if_changed
+from pipeline_profiling import stage
 
+@stage()
 def create_summary_stat_table_for_data(dataset, UPDATED=False):
     """
     Creates a summary statistics table for the dataset.
@@ -34,8 +37,7 @@ def create_summary_stat_table_for_data(dataset, UPDATED=False):
     latex_table = latex_table.replace(r'\multirow[t]{5}{*}', '')
     
     outfile = config.OUTPUT_DIR / ("updated_table03_sstable.tex" if UPDATED else "table03_sstable.tex")
-    with open(outfile, 'w', encoding='utf-8') as f:
-        f.write(latex_table)
+    write_text_if_changed(outfile, latex_table)
 
 def standardize_ratios_and_factors(data):
     """
@@ -50,6 +52,7 @@ def standardize_ratios_and_factors(data):
         data[standardized_col_name] = (data[col] - data[col].mean()) / data[col].std()
     return data
 
+@stage()
 def plot_figure01(ratios, factors, UPDATED=False):
     """
     Plots the standardized market cap ratio and capital risk factor over time.
@@ -71,7 +74,7 @@ def plot_figure01(ratios, factors, UPDATED=False):
     ax.legend(loc='best')
     
     outfile = config.OUTPUT_DIR / ("updated_table03_figure01.png" if UPDATED else "table03_figure01.png")
-    plt.savefig(outfile)
+    savefig_if_changed(outfile, fig)
     plt.close()
 
 # def plot_figure02(ratios, UPDATED=False):
@@ -104,6 +107,7 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 
+@stage()
 def plot_figure02(ratios, correlation_panelA, UPDATED=False):
     """
     Plots the levels of market cap ratio, book capital ratio, and AEM leverage over time,
@@ -172,10 +176,11 @@ def plot_figure02(ratios, correlation_panelA, UPDATED=False):
     ax.legend(loc='best')
 
     outfile = config.OUTPUT_DIR / ("updated_table03_figure.png" if UPDATED else "table03_figure.png")
-    plt.savefig(outfile, dpi=300)
+    savefig_if_changed(outfile, fig, dpi=300)
     plt.close(fig)  # close the figure to avoid repeated display
 
 
+@stage()
 def plot_figure03(ratios, macro, UPDATED=False):
     """
     Plots the standardized trends of financial ratios and macroeconomic variables over time.
@@ -222,7 +227,7 @@ def plot_figure03(ratios, macro, UPDATED=False):
     
     plt.tight_layout()
     outfile = config.OUTPUT_DIR / ("updated_table03_figure03.png" if UPDATED else "table03_figure03.png")
-    plt.savefig(outfile)
+    savefig_if_changed(outfile, fig)
     plt.close()
 
 if __name__ == "__main__":
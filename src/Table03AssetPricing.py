@@ -0,0 +1,233 @@
+"""
+Table03AssetPricing.py
+
+Two-pass (Fama-MacBeth) cross-sectional asset-pricing tests with the intermediary capital
+factors of Table 3 (Table03.convert_ratios_to_factors), as in He, Kelly and Manela.
+
+1. Time series: for every test asset n, R_nt = a_n + b_n' f_t + e_nt. All assets are
+   estimated in one batched least-squares solve (one lstsq with N right-hand sides, or,
+   when some assets have missing returns, N normal-equation systems solved as one batch).
+2. Cross section: for every period t, R_nt = l_0t + b_n' l_t + u_nt. With a balanced
+   panel every period shares the design matrix and all T regressions are one matrix
+   product; otherwise the per-period systems are again solved as one batch.
+
+The risk premia are the time-series means of l_t. Their standard errors are reported
+as plain Fama-MacBeth (optionally Newey-West over the l_t), and with the Shanken (1992)
+errors-in-variables correction
+    Var(l) = (1 + l_f' S_f^-1 l_f) Var_FM(l) + S_f / T,
+where S_f is the factor covariance (the additive term only for the factor premia).
+
+Everything is vectorized over assets, so the engine scales to thousands of portfolios:
+
+```
+returns = excess_returns(quarterly_returns(Table03Load.fetch_ff_portfolios("19700101", "20121231")), rf)
+result = fama_macbeth(returns, factors[["Market excess return", "Market capital factor"]])
+result["premia"]
+```
+"""
+
+import numpy as np
+import pandas as pd
+
+import config
+import Table03
+import Table03DealerPanel
+import Table03Load
+import Table02Prep
+from Table03Inference import bartlett_long_run, write_parquet_if_changed
+from misc_tools import write_text_if_changed
+from pipeline_profiling import stage, profiled_run
+from fixture_store import connect_wrds
+
+CONST = 'const'
+
+
+def quarterly_returns(monthly):
+    """
+    Compounds monthly returns (DataFrame or Series, PeriodIndex or dates) to quarterly returns
+    indexed by quarter-end date; a quarter with a missing month is missing.
+    """
+    if isinstance(monthly.index, pd.PeriodIndex):
+        monthly = monthly.to_timestamp(freq='M')
+    return (1 + monthly).resample('QE').prod(min_count=3) - 1
+
+
+def excess_returns(returns, rf):
+    """Returns in excess of the risk-free rate rf (Series on the same dates)."""
+    return returns.sub(rf.reindex(returns.index), axis=0)
+
+
+def _design(factors):
+    return np.column_stack([np.ones(len(factors)), factors.to_numpy(dtype=float)])
+
+
+def _batched_solve(lhs, rhs):
+    """Solves a batch of small normal-equation systems, NaN where a system is singular."""
+    out = np.full(rhs.shape, np.nan)
+    ok = np.linalg.matrix_rank(lhs) == lhs.shape[-1]
+    if ok.any():
+        out[ok] = np.linalg.solve(lhs[ok], rhs[ok][..., None])[..., 0]
+    return out
+
+
+@stage()
+def time_series_betas(returns, factors):
+    """
+    First pass: intercept and factor loadings of every test asset.
+    Input: returns (DataFrame, periods x assets) and factors (DataFrame, periods x factors) on
+    the same index; periods with a missing factor are dropped, missing returns only for their asset.
+    Output: (betas, nobs) with betas a DataFrame of assets x (const + factors).
+    """
+    factors = factors.dropna()
+    R = returns.reindex(factors.index).to_numpy(dtype=float)
+    X = _design(factors)
+    observed = np.isfinite(R)
+    if observed.all():
+        coef = np.linalg.lstsq(X, R, rcond=None)[0].T
+    else:
+        m = observed.astype(float)
+        Y = np.where(observed, R, 0.0)
+        coef = _batched_solve(np.einsum('tn,tp,tq->npq', m, X, X), np.einsum('tp,tn->np', X, Y))
+    columns = [CONST, *factors.columns]
+    betas = pd.DataFrame(coef, index=returns.columns, columns=columns)
+    return betas, pd.Series(observed.sum(axis=0), index=returns.columns, name='nobs')
+
+
+@stage()
+def cross_sectional_premia(returns, betas):
+    """
+    Second pass: the cross-sectional regression of each period's returns on the betas.
+    Input: returns (DataFrame, periods x assets); betas from time_series_betas (const is replaced
+    by the cross-sectional intercept). Assets with missing returns or betas are dropped per period.
+    Output: (premia, r2) with premia a DataFrame of periods x (const + factors) and r2 the
+    cross-sectional R^2 of each period.
+    """
+    B = np.column_stack([np.ones(len(betas)), betas.drop(columns=CONST).to_numpy(dtype=float)])
+    R = returns[betas.index].to_numpy(dtype=float)
+    observed = np.isfinite(R) & np.isfinite(B).all(axis=1)
+    if observed.all():
+        coef = np.linalg.lstsq(B, R.T, rcond=None)[0].T
+    else:
+        m = observed.astype(float)
+        Y = np.where(observed, R, 0.0)
+        coef = _batched_solve(np.einsum('tn,np,nq->tpq', m, np.nan_to_num(B), np.nan_to_num(B)),
+                              np.einsum('np,tn->tp', np.nan_to_num(B), Y))
+    fitted = coef @ np.nan_to_num(B).T
+    n = observed.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(observed, R, 0.0).sum(axis=1, keepdims=True) / n[:, None]
+        ss_res = np.where(observed, (R - fitted) ** 2, 0.0).sum(axis=1)
+        ss_tot = np.where(observed, (R - mean) ** 2, 0.0).sum(axis=1)
+        r2 = 1 - ss_res / ss_tot
+    premia = pd.DataFrame(coef, index=returns.index, columns=betas.columns)
+    return premia, pd.Series(r2, index=returns.index, name='r2')
+
+
+def premia_summary(premia, factors, lags=0):
+    """
+    Fama-MacBeth risk premia with plain (or Newey-West with lags > 0) and Shanken-corrected
+    standard errors.
+    Input: premia (DataFrame, periods x (const + factors)) from cross_sectional_premia; factors
+    (DataFrame) the factor series used in the first pass.
+    Output: DataFrame indexed by const and the factors with premium, se_fm, t_fm, se_shanken, t_shanken.
+    """
+    lam = premia.dropna()
+    T = len(lam)
+    mean = lam.mean().to_numpy()
+    demeaned = lam.to_numpy() - mean
+    var_fm = bartlett_long_run(demeaned, lags) / T ** 2
+    sigma_f = np.cov(factors.dropna().to_numpy(dtype=float), rowvar=False, ddof=1).reshape(len(factors.columns), -1)
+    lam_f = mean[1:]
+    c = float(lam_f @ np.linalg.solve(sigma_f, lam_f))
+    sigma_full = np.zeros_like(var_fm)
+    sigma_full[1:, 1:] = sigma_f
+    var_shanken = (1 + c) * var_fm + sigma_full / T
+    summary = pd.DataFrame({
+        'premium': mean,
+        'se_fm': np.sqrt(np.diag(var_fm)),
+        'se_shanken': np.sqrt(np.diag(var_shanken)),
+    }, index=premia.columns)
+    summary['t_fm'] = summary['premium'] / summary['se_fm']
+    summary['t_shanken'] = summary['premium'] / summary['se_shanken']
+    return summary[['premium', 'se_fm', 't_fm', 'se_shanken', 't_shanken']]
+
+
+def fama_macbeth(returns, factors, lags=0):
+    """
+    Two-pass test of the factors on the test assets.
+    Input: returns (DataFrame, periods x assets, excess returns) and factors (DataFrame, periods
+    x factors); the sample is the periods with all factors. lags for Newey-West over the premia.
+    Output: dict with 'betas', 'nobs' (first pass), 'premia' (per-period), 'r2', 'summary' and
+    'pricing_errors' (mean return minus fitted mean return of each asset).
+    """
+    factors = factors.dropna()
+    returns = returns.reindex(factors.index)
+    betas, nobs = time_series_betas(returns, factors)
+    premia, r2 = cross_sectional_premia(returns, betas)
+    summary = premia_summary(premia, factors, lags=lags)
+    fitted = summary.loc[CONST, 'premium'] + betas.drop(columns=CONST) @ summary['premium'].drop(CONST)
+    return {
+        'betas': betas,
+        'nobs': nobs,
+        'premia': premia,
+        'r2': r2,
+        'summary': summary,
+        'pricing_errors': (returns.mean() - fitted).rename('pricing_error'),
+    }
+
+
+@stage()
+def intermediary_factors(fundq, UPDATED=False):
+    """
+    Quarterly factors of the intermediary asset pricing model: the market excess return
+    (compounded from the monthly Fama-French data) and the Table 3 market capital factor.
+    Output: (factors, rf) with factors a DataFrame indexed by quarter end and rf the quarterly risk-free rate.
+    """
+    ratios = Table03.aggregate_ratios(Table03.prep_dataset(fundq, UPDATED=UPDATED))
+    capital = Table03.convert_ratios_to_factors(ratios)['market_capital_factor']
+    end_date = config.UPDATED_END_DATE if UPDATED else config.END_DATE
+    ff = Table03Load.fetch_ff_factors(start_date=config.START_DATE.replace("-", ""), end_date=end_date.replace("-", ""))
+    rf = quarterly_returns(ff['RF'])
+    market = quarterly_returns(ff['mkt_ret'] + ff['RF']) - rf
+    factors = pd.DataFrame({'Market excess return': market}).join(capital.rename('Market capital factor'), how='inner')
+    return factors, rf
+
+
+def export_asset_pricing_table(result, UPDATED=False):
+    """Writes the risk premia with Fama-MacBeth and Shanken t-statistics to OUTPUT_DIR as LaTeX, and the betas as Parquet."""
+    prefix = "updated_table03_asset_pricing" if UPDATED else "table03_asset_pricing"
+    table = result['summary'][['premium', 't_fm', 't_shanken']].rename(index={CONST: 'Intercept'})
+    table.loc['Mean cross-sectional R2'] = [result['r2'].mean(), np.nan, np.nan]
+    write_text_if_changed(config.OUTPUT_DIR / f"{prefix}.tex", table.to_latex(na_rep='', float_format="%.3f"))
+    betas = result['betas'].join(result['pricing_errors']).rename_axis('asset').reset_index()
+    write_parquet_if_changed(betas, config.OUTPUT_DIR / f"{prefix}_betas.parquet")
+
+
+@profiled_run("table03_asset_pricing")
+def main(UPDATED=False, dataset='25_Portfolios_5x5', csv_path=None, from_panel=False, lags=0):
+    """
+    Prices quarterly test-asset excess returns (Fama-French portfolios `dataset`, or a local CSV
+    of monthly returns in percent) with the market excess return and the market capital factor.
+    from_panel uses the dealer panel saved by Table03.main instead of fetching fundq.
+    """
+    if from_panel:
+        fundq = Table03DealerPanel.to_fundq(Table03DealerPanel.load_dealer_panel(UPDATED=UPDATED))
+    else:
+        db = connect_wrds()
+        prim_dealers = Table02Prep.clean_primary_dealers_data(fname='Primary_Dealer_Link_Table3.csv')
+        fundq, _ = Table03Load.fetch_data_for_tickers(prim_dealers, db, coalesce=True)
+    factors, rf = intermediary_factors(fundq, UPDATED=UPDATED)
+    if csv_path is not None:
+        monthly = Table03Load.load_test_portfolios_csv(csv_path)
+    else:
+        end_date = config.UPDATED_END_DATE if UPDATED else config.END_DATE
+        monthly = Table03Load.fetch_ff_portfolios(config.START_DATE.replace("-", ""), end_date.replace("-", ""), dataset=dataset)
+    returns = excess_returns(quarterly_returns(monthly), rf)
+    result = fama_macbeth(returns, factors, lags=lags)
+    export_asset_pricing_table(result, UPDATED=UPDATED)
+    return result
+
+
+if __name__ == "__main__":
+    result = main()
+    print(result['summary'])
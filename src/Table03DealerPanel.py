@@ -0,0 +1,88 @@
+"""
+Table03DealerPanel.py
+
+Dealer x quarter panel store for Table 3.
+
+Table03.prep_dataset collapses the fundq pull to quarterly sums right away, so dealer-level
+data would otherwise have to be fetched again from WRDS. Table03.main saves the pull here
+as a dealer-level panel: the raw fundamentals plus each dealer's market_cap_ratio and
+book_cap_ratio, one row per dealer-quarter.
+
+The panel is a Parquet file sorted by gvkey and quarter, written in small row groups, so
+the min/max statistics of each row group let readers skip row groups when slicing by
+dealers or dates:
+
+```
+panel = load_dealer_panel(gvkeys=["002968", "003243"], start="1990-01-01", end="1999-12-31")
+prep = Table03.prep_dataset(to_fundq(load_dealer_panel()))   # the aggregate pipeline, no refetch
+```
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+from Table03Load import quarter_to_date
+
+PANEL_FILE = config.DATA_DIR / "pulled" / "table03_dealer_panel.parquet"
+UPDATED_PANEL_FILE = config.DATA_DIR / "pulled" / "updated_table03_dealer_panel.parquet"
+ROW_GROUP_SIZE = 2_000
+
+FUNDQ_COLS = ['datafqtr', 'total_assets', 'book_debt', 'book_equity', 'market_equity', 'gvkey', 'conm']
+
+
+def panel_path(UPDATED=False):
+    return UPDATED_PANEL_FILE if UPDATED else PANEL_FILE
+
+
+def build_dealer_panel(dataset):
+    """
+    Dealer-level panel from a fundq pull (Table03Load.fetch_data_for_tickers).
+    Input: dataset (DataFrame) with the columns of FUNDQ_COLS.
+    Output: DataFrame with gvkey, date (quarter end), the fundq columns and the dealer's
+    market_cap_ratio and book_cap_ratio, without duplicate rows, sorted by gvkey and date.
+    """
+    panel = dataset[FUNDQ_COLS].drop_duplicates()
+    panel = panel.assign(
+        gvkey=panel['gvkey'].astype(str).str.zfill(6),
+        date=quarter_to_date(panel['datafqtr']),
+    )
+    with np.errstate(invalid='ignore', divide='ignore'):
+        panel['market_cap_ratio'] = panel['market_equity'] / (panel['book_debt'] + panel['market_equity'])
+        panel['book_cap_ratio'] = panel['book_equity'] / (panel['book_debt'] + panel['book_equity'])
+    columns = ['gvkey', 'date', *[c for c in FUNDQ_COLS if c != 'gvkey'], 'market_cap_ratio', 'book_cap_ratio']
+    return panel[columns].sort_values(['gvkey', 'date'], kind='stable').reset_index(drop=True)
+
+
+def save_dealer_panel(panel, path=None, UPDATED=False, row_group_size=ROW_GROUP_SIZE):
+    """Write the panel to Parquet (zstd), sorted by gvkey and date, in row groups of row_group_size rows."""
+    path = Path(path or panel_path(UPDATED))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    panel = panel.sort_values(['gvkey', 'date'], kind='stable')
+    panel.to_parquet(path, index=False, compression='zstd', row_group_size=row_group_size)
+    print(f"Saved dealer panel ({len(panel)} dealer-quarters) to {path}")
+    return path
+
+
+def load_dealer_panel(gvkeys=None, start=None, end=None, columns=None, path=None, UPDATED=False):
+    """
+    Load the dealer panel, optionally only some dealers (gvkeys), a date range (inclusive
+    quarter-end dates) or some columns. The filters are applied by the Parquet reader, so
+    row groups outside the selection are not read.
+    """
+    filters = []
+    if gvkeys is not None:
+        filters.append(('gvkey', 'in', [str(g).zfill(6) for g in gvkeys]))
+    if start is not None:
+        filters.append(('date', '>=', pd.Timestamp(start)))
+    if end is not None:
+        filters.append(('date', '<=', pd.Timestamp(end)))
+    panel = pd.read_parquet(path or panel_path(UPDATED), columns=columns, filters=filters or None)
+    return panel.reset_index(drop=True)
+
+
+def to_fundq(panel):
+    """The panel in the layout of the fundq pull, ready for Table03.prep_dataset."""
+    return panel[FUNDQ_COLS].reset_index(drop=True)
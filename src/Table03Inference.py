@@ -0,0 +1,366 @@
+"""
+Table03Inference.py
+
+Confidence intervals and standard errors for the Table 3 correlations.
+
+Block bootstrap:
+Table03.calculate_correlation_panelA/B report point correlations only. Quarterly ratios,
+factors and macro series are autocorrelated, so the observations are resampled in blocks,
+either with a moving-block bootstrap (fixed block length) or with the stationary bootstrap
+of Politis and Romano (geometric block lengths with the given mean).
+
+All replicates are computed at once. A chunk of B resample index vectors (B x T) gathers
+the panel into a B x T x k array, and the pairwise-complete correlations of every replicate
+come from batched matrix products (einsum, B x k x k), with the missing values handled like
+pandas' pairwise corr. Chunks bound the memory; with n_jobs > 1 they are spread over a process
+pool. Each chunk draws from its own child seed, so the result does not depend on n_jobs.
+
+```
+ci = bootstrap_panelA(panelA, n_boot=2000, method="stationary", n_jobs=4)
+ci["lower"].loc["E/P", "Market capital"], ci["upper"].loc["E/P", "Market capital"]
+```
+
+Newey-West (HAC):
+The standard error of each correlation comes from the delta method: with x and y
+standardized, r - rho is approximately the mean of psi_t = x_t y_t - r (x_t^2 + y_t^2) / 2,
+and Var(r) is the Bartlett-weighted long-run variance of psi over n^2. psi is built for all
+pairs at once (T x k x k) and its autocovariances for lags 0..L are one array, so there is no
+per-pair fit. Regressions of the macro growth series on the capital factors are solved as a
+batch of OLS problems with HAC covariances from the autocovariances of the scores, matching
+statsmodels' OLS(...).fit(cov_type='HAC') (Bartlett kernel). Missing values contribute zero
+scores, so leading and trailing gaps (e.g. NFCI before 1971) drop out exactly; interior gaps
+are not closed up.
+
+```
+hac = hac_panelB(panelB)                       # 'corr', 'se', 'tstat' in the Table 3 layout
+reg = factor_regressions(panelB)               # each macro growth series on each factor
+```
+"""
+
+import io
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import config
+from misc_tools import write_bytes_if_changed, write_text_if_changed
+
+PANEL_A_MAIN = ['Market capital', 'Book capital', 'AEM leverage']
+PANEL_A_OTHER = ['E/P', 'Unemployment', 'GDP', 'Financial conditions', 'Market volatility']
+PANEL_B_MAIN = ['Market capital factor', 'Book capital factor', 'AEM leverage factor']
+PANEL_B_OTHER = ['Market excess return', 'E/P growth', 'Unemployment growth', 'GDP growth',
+                 'Financial conditions growth', 'Market volatility growth']
+
+
+def default_block_length(n_obs):
+    """Rule-of-thumb block length T^(1/3)."""
+    return max(1, int(np.ceil(n_obs ** (1 / 3))))
+
+
+def moving_block_indices(n_obs, block_length, n_boot, rng):
+    """
+    Moving-block bootstrap resamples: blocks of block_length consecutive observations with
+    uniformly drawn starts, concatenated and cut to n_obs.
+    Output: (n_boot, n_obs) array of row positions.
+    """
+    block_length = min(block_length, n_obs)
+    n_blocks = -(-n_obs // block_length)
+    starts = rng.integers(0, n_obs - block_length + 1, size=(n_boot, n_blocks))
+    idx = starts[:, :, None] + np.arange(block_length)
+    return idx.reshape(n_boot, -1)[:, :n_obs]
+
+
+def stationary_indices(n_obs, mean_block_length, n_boot, rng):
+    """
+    Stationary bootstrap resamples: each position starts a new block with probability
+    1/mean_block_length, otherwise continues the previous block (wrapping around the end).
+    Output: (n_boot, n_obs) array of row positions.
+    """
+    new_block = rng.random((n_boot, n_obs)) < 1 / mean_block_length
+    new_block[:, 0] = True
+    starts = rng.integers(0, n_obs, size=(n_boot, n_obs))
+    positions = np.arange(n_obs)
+    block_begin = np.maximum.accumulate(np.where(new_block, positions, 0), axis=1)
+    block_start = np.take_along_axis(starts, block_begin, axis=1)
+    return (block_start + positions - block_begin) % n_obs
+
+
+RESAMPLERS = {'moving': moving_block_indices, 'stationary': stationary_indices}
+
+
+def batched_corr(values):
+    """
+    Pairwise-complete Pearson correlations of a batch of samples.
+    Input: values (B x T x k array, NaN for missing).
+    Output: B x k x k array; a pair needs at least 2 common observations (as in pandas).
+    """
+    mask = np.isfinite(values)
+    x = np.where(mask, values, 0.0)
+    m = mask.astype(float)
+    n = np.einsum('btk,btl->bkl', m, m)
+    sx = np.einsum('btk,btl->bkl', x, m)           # sum of x_k over the rows where l is observed
+    sxx = np.einsum('btk,btl->bkl', x * x, m)
+    sxy = np.einsum('btk,btl->bkl', x, x)
+    sy = sx.transpose(0, 2, 1)
+    syy = sxx.transpose(0, 2, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sxy - sx * sy / n
+        var_x = sxx - sx ** 2 / n
+        var_y = syy - sy ** 2 / n
+        corr = cov / np.sqrt(var_x * var_y)
+    return np.where(n >= 2, np.clip(corr, -1, 1), np.nan)
+
+
+def _bootstrap_chunk(values, method, block_length, n_boot, seed):
+    rng = np.random.default_rng(seed)
+    idx = RESAMPLERS[method](values.shape[0], block_length, n_boot, rng)
+    return batched_corr(values[idx])
+
+
+def bootstrap_correlations(values, n_boot=2000, method='stationary', block_length=None,
+                           chunk_size=250, n_jobs=1, seed=0):
+    """
+    Bootstrap distribution of the correlation matrix of values (T x k array).
+    Output: n_boot x k x k array of replicate correlations.
+    """
+    if method not in RESAMPLERS:
+        raise ValueError(f"Unknown bootstrap method '{method}', expected one of {sorted(RESAMPLERS)}")
+    values = np.asarray(values, dtype=float)
+    block_length = block_length or default_block_length(values.shape[0])
+    sizes = [min(chunk_size, n_boot - start) for start in range(0, n_boot, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(values, method, block_length, size, s) for size, s in zip(sizes, seeds)]
+    if n_jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            chunks = list(pool.map(_bootstrap_chunk, *zip(*tasks)))
+    else:
+        chunks = [_bootstrap_chunk(*task) for task in tasks]
+    return np.concatenate(chunks, axis=0)
+
+
+def _table_layout(matrix, columns, main_cols, other_cols):
+    """A k x k matrix in the layout of calculate_correlation_panelA/B (upper triangle of the main columns, then the others)."""
+    full = pd.DataFrame(matrix, index=columns, columns=columns)
+    within = full.loc[main_cols, main_cols].where(np.triu(np.ones((len(main_cols),) * 2, dtype=bool)))
+    return pd.concat([within, full.loc[other_cols, main_cols]], axis=0)
+
+
+def bootstrap_panel(panel, main_cols, other_cols, n_boot=2000, method='stationary', block_length=None,
+                    alpha=0.05, chunk_size=250, n_jobs=1, seed=0):
+    """
+    Point correlations and percentile bootstrap confidence intervals for a Table 3 panel.
+    Input: panel (DataFrame) with main_cols and other_cols; alpha for (1 - alpha) intervals.
+    Output: dict of DataFrames in the layout of calculate_correlation_panelA/B:
+    'corr' (point estimates), 'lower', 'upper' (interval bounds) and 'se' (bootstrap std).
+    """
+    columns = list(main_cols) + list(other_cols)
+    values = panel[columns].to_numpy(dtype=float)
+    point = batched_corr(values[None])[0]
+    reps = bootstrap_correlations(values, n_boot=n_boot, method=method, block_length=block_length,
+                                  chunk_size=chunk_size, n_jobs=n_jobs, seed=seed)
+    with np.errstate(invalid='ignore'):
+        lower, upper = np.nanquantile(reps, [alpha / 2, 1 - alpha / 2], axis=0)
+        se = np.nanstd(reps, axis=0, ddof=1)
+    return {name: _table_layout(matrix, columns, main_cols, other_cols)
+            for name, matrix in [('corr', point), ('lower', lower), ('upper', upper), ('se', se)]}
+
+
+def bootstrap_panelA(panelA, UPDATED=False, **kwargs):
+    """bootstrap_panel for Panel A (levels), over the same sample as calculate_correlation_panelA."""
+    if not UPDATED:
+        panelA = panelA[:config.END_DATE]
+    return bootstrap_panel(panelA, PANEL_A_MAIN, PANEL_A_OTHER, **kwargs)
+
+
+def bootstrap_panelB(panelB, UPDATED=False, **kwargs):
+    """bootstrap_panel for Panel B (factors), over the same sample as calculate_correlation_panelB."""
+    if not UPDATED:
+        panelB = panelB[:config.END_DATE]
+    return bootstrap_panel(panelB, PANEL_B_MAIN, PANEL_B_OTHER, **kwargs)
+
+
+def long_table(result):
+    """The bootstrap result as one row per (row, column) correlation with corr, lower, upper and se."""
+    parts = {name: table.stack().rename(name) for name, table in result.items()}
+    long = pd.concat(parts.values(), axis=1)
+    long.index.names = ['row', 'column']
+    return long.reset_index()
+
+
+def format_interval_table(result, digits=2):
+    """Cells 'corr [lower, upper]' in the table layout, empty where there is no correlation."""
+    fmt = f"{{:.{digits}f}}"
+    corr, lower, upper = result['corr'], result['lower'], result['upper']
+    cells = pd.DataFrame('', index=corr.index, columns=corr.columns)
+    filled = corr.notna()
+    for col in corr.columns:
+        rows = filled[col]
+        cells.loc[rows, col] = [f"{fmt.format(c)} [{fmt.format(lo)}, {fmt.format(hi)}]"
+                                for c, lo, hi in zip(corr.loc[rows, col], lower.loc[rows, col], upper.loc[rows, col])]
+    return cells
+
+
+def write_parquet_if_changed(df, path):
+    """Writes df as Parquet through write_bytes_if_changed (atomic, skipped when unchanged)."""
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return write_bytes_if_changed(path, buffer.getvalue())
+
+
+def export_bootstrap_tables(resultA, resultB, UPDATED=False):
+    """
+    Writes the intervals of both panels to OUTPUT_DIR as LaTeX (table03_bootstrap.tex) and as a
+    long Parquet table (table03_bootstrap.parquet, with a panel column).
+    """
+    prefix = "updated_table03_bootstrap" if UPDATED else "table03_bootstrap"
+    latex = "\n\n".join(format_interval_table(result).to_latex() for result in (resultA, resultB))
+    write_text_if_changed(config.OUTPUT_DIR / f"{prefix}.tex", latex)
+    long = pd.concat([long_table(resultA).assign(panel='A'), long_table(resultB).assign(panel='B')], ignore_index=True)
+    write_parquet_if_changed(long, config.OUTPUT_DIR / f"{prefix}.parquet")
+    return long
+
+
+def newey_west_lags(n_obs):
+    """Newey-West (1994) rule of thumb floor(4 (T/100)^(2/9)), as in statsmodels."""
+    return int(np.floor(4 * (n_obs / 100) ** (2 / 9)))
+
+
+def bartlett_long_run(scores, lags):
+    """
+    Bartlett-weighted long-run (co)variance sum_t sum_s w_|t-s| s_t s_s' from the
+    autocovariance array of the scores.
+    Input: scores (T x ... x p array, 0 where not observed); lags the highest lag.
+    Output: ... x p x p array (not divided by T).
+    """
+    autocov = np.stack([np.einsum('t...p,t...q->...pq', scores[lag:], scores[:scores.shape[0] - lag])
+                        for lag in range(lags + 1)])
+    weights = 1 - np.arange(lags + 1) / (lags + 1)
+    weighted = np.tensordot(weights[1:], autocov[1:], axes=1) if lags else np.zeros_like(autocov[0])
+    return autocov[0] + weighted + np.swapaxes(weighted, -1, -2)
+
+
+def hac_correlations(values, lags=None):
+    """
+    Pairwise-complete correlations of values (T x k array) and their Newey-West standard errors.
+    Output: (corr, se), k x k arrays.
+    """
+    values = np.asarray(values, dtype=float)
+    lags = newey_west_lags(values.shape[0]) if lags is None else lags
+    mask = np.isfinite(values[:, :, None]) & np.isfinite(values[:, None, :])
+    n = mask.sum(axis=0)
+    x = np.where(mask, values[:, :, None], 0.0)
+    y = np.where(mask, values[:, None, :], 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = np.where(mask, x - x.sum(axis=0) / n, 0.0)
+        y = np.where(mask, y - y.sum(axis=0) / n, 0.0)
+        x = x / np.sqrt((x ** 2).sum(axis=0) / n)
+        y = y / np.sqrt((y ** 2).sum(axis=0) / n)
+        corr = (x * y).sum(axis=0) / n
+        psi = x * y - corr * (x ** 2 + y ** 2) / 2
+        se = np.sqrt(bartlett_long_run(psi[..., None], lags)[..., 0, 0]) / n
+    valid = n >= 2
+    return np.where(valid, np.clip(corr, -1, 1), np.nan), np.where(valid, se, np.nan)
+
+
+def hac_panel(panel, main_cols, other_cols, lags=None):
+    """
+    Point correlations, Newey-West standard errors and t-statistics for a Table 3 panel.
+    Output: dict of DataFrames 'corr', 'se' and 'tstat' in the layout of calculate_correlation_panelA/B.
+    """
+    columns = list(main_cols) + list(other_cols)
+    corr, se = hac_correlations(panel[columns].to_numpy(dtype=float), lags=lags)
+    se = np.where(np.eye(len(columns), dtype=bool), np.nan, se)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tstat = corr / se
+    return {name: _table_layout(matrix, columns, main_cols, other_cols)
+            for name, matrix in [('corr', corr), ('se', se), ('tstat', tstat)]}
+
+
+def hac_panelA(panelA, UPDATED=False, lags=None):
+    """hac_panel for Panel A (levels), over the same sample as calculate_correlation_panelA."""
+    if not UPDATED:
+        panelA = panelA[:config.END_DATE]
+    return hac_panel(panelA, PANEL_A_MAIN, PANEL_A_OTHER, lags=lags)
+
+
+def hac_panelB(panelB, UPDATED=False, lags=None):
+    """hac_panel for Panel B (factors), over the same sample as calculate_correlation_panelB."""
+    if not UPDATED:
+        panelB = panelB[:config.END_DATE]
+    return hac_panel(panelB, PANEL_B_MAIN, PANEL_B_OTHER, lags=lags)
+
+
+def batched_hac_ols(X, y, lags=None):
+    """
+    A batch of OLS regressions with Newey-West covariances.
+    Input: X (B x T x p regressors, include the constant), y (B x T); a row with a missing
+    value is dropped from its regression only.
+    Output: (coef, se, nobs) with coef and se B x p arrays and nobs of length B.
+    """
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    mask = np.isfinite(y) & np.isfinite(X).all(axis=-1)
+    X = np.where(mask[..., None], X, 0.0)
+    y = np.where(mask, y, 0.0)
+    nobs = mask.sum(axis=1)
+    lags = newey_west_lags(X.shape[1]) if lags is None else lags
+    XtX_inv = np.linalg.pinv(np.einsum('btp,btq->bpq', X, X))
+    coef = np.einsum('bpq,btq,bt->bp', XtX_inv, X, y)
+    resid = y - np.einsum('btp,bp->bt', X, coef)
+    scores = np.swapaxes(X * resid[..., None], 0, 1)          # T x B x p
+    S = bartlett_long_run(scores, lags)
+    cov = XtX_inv @ S @ XtX_inv
+    return coef, np.sqrt(np.diagonal(cov, axis1=1, axis2=2)), nobs
+
+
+def factor_regressions(panelB, UPDATED=False, lags=None, factors=PANEL_B_MAIN, targets=PANEL_B_OTHER, joint=False):
+    """
+    Regressions of the macro growth series on the capital factors with Newey-West standard errors.
+    Input: panelB (DataFrame) from create_panelB; joint=False regresses each target on each
+    factor separately (with a constant), joint=True on all factors together.
+    Output: DataFrame with target, regressor, coef, se, tstat and nobs (constants not reported).
+    """
+    if not UPDATED:
+        panelB = panelB[:config.END_DATE]
+    T = len(panelB)
+    Y = panelB[list(targets)].to_numpy(dtype=float).T                    # targets x T
+    F = panelB[list(factors)].to_numpy(dtype=float).T                    # factors x T
+    if joint:
+        X = np.concatenate([np.ones((1, T)), F]).T[None].repeat(len(targets), axis=0)
+        y, labels = Y, [(t, list(factors)) for t in targets]
+    else:
+        pairs = [(t, f) for t in range(len(targets)) for f in range(len(factors))]
+        X = np.stack([np.column_stack([np.ones(T), F[f]]) for _, f in pairs])
+        y, labels = Y[[t for t, _ in pairs]], [(targets[t], [factors[f]]) for t, f in pairs]
+    coef, se, nobs = batched_hac_ols(X, y, lags=lags)
+    rows = [{'target': target, 'regressor': regressor, 'coef': coef[b, j + 1], 'se': se[b, j + 1], 'nobs': nobs[b]}
+            for b, (target, regressors) in enumerate(labels) for j, regressor in enumerate(regressors)]
+    table = pd.DataFrame(rows)
+    table['tstat'] = table['coef'] / table['se']
+    return table[['target', 'regressor', 'coef', 'se', 'tstat', 'nobs']]
+
+
+def format_se_table(result, digits=2):
+    """Cells 'corr (se)' in the table layout, empty where there is no correlation."""
+    fmt = f"{{:.{digits}f}}"
+    corr, se = result['corr'], result['se']
+    cells = pd.DataFrame('', index=corr.index, columns=corr.columns)
+    for col in corr.columns:
+        rows = corr[col].notna()
+        cells.loc[rows, col] = [fmt.format(c) if np.isnan(e) else f"{fmt.format(c)} ({fmt.format(e)})"
+                                for c, e in zip(corr.loc[rows, col], se.loc[rows, col])]
+    return cells
+
+
+def export_hac_tables(resultA, resultB, regressions, UPDATED=False):
+    """
+    Writes the Newey-West results to OUTPUT_DIR: both panels with standard errors as LaTeX
+    (table03_hac.tex) and the factor regressions as LaTeX and Parquet (table03_hac_regressions).
+    """
+    prefix = "updated_table03_hac" if UPDATED else "table03_hac"
+    latex = "\n\n".join(format_se_table(result).to_latex() for result in (resultA, resultB))
+    write_text_if_changed(config.OUTPUT_DIR / f"{prefix}.tex", latex)
+    write_text_if_changed(config.OUTPUT_DIR / f"{prefix}_regressions.tex",
+                          regressions.to_latex(index=False, float_format="%.3f"))
+    write_parquet_if_changed(regressions, config.OUTPUT_DIR / f"{prefix}_regressions.parquet")
@@ -1,5 +1,6 @@
 import warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
+import numpy as np
 import pandas as pd
 import config
 from datetime import datetime
@@ -9,6 +10,9 @@ import pandas_datareader.data as web
 from zipfile import ZipFile
 from io import BytesIO, StringIO
 from pathlib import Path
+from pipeline_profiling import stage, record_bytes
+from fixture_store import recorded
+import fetch_planner
 
 import load_fred
 import importlib
@@ -25,10 +29,25 @@ DATA_DIR = Path(config.DATA_DIR)
 URL_FRED_2013 = "https://www.federalreserve.gov/releases/z1/20130307/Disk/ltabs.zip"
 URL_SHILLER = "https://img1.wsimg.com/blobby/go/e5e77e0b-59d1-44d9-ab25-4763ac982e53/downloads/ie_data.xls"
 
+def _like_input(d, values):
+    """Wrap an array of results in the container type of d (Series, Index or ndarray)."""
+    if isinstance(d, pd.Series):
+        return pd.Series(values, index=d.index, name=d.name)
+    if isinstance(d, pd.Index):
+        return pd.Index(values, name=d.name)
+    return values
+
 def date_to_quarter(date):
     """
     Convert a date to a fiscal quarter in the format 'YYYYQ#'.
+    Also accepts a Series/DatetimeIndex/array of dates; each distinct month is formatted once.
     """
+    if np.ndim(date) > 0:
+        months = pd.DatetimeIndex(date).to_numpy(dtype="datetime64[ns]").astype("datetime64[M]")
+        codes, uniques = pd.factorize(months)
+        uniques = uniques.astype(np.int64)
+        labels = np.array([f"{m // 12 + 1970}Q{m % 12 // 3 + 1}" for m in uniques] + [None], dtype=object)
+        return _like_input(date, labels[codes])
     year = date.year
     quarter = (date.month - 1) // 3 + 1
     return f"{year}Q{quarter}"
@@ -37,7 +56,21 @@ def quarter_to_date(quarter):
     """
     Convert a fiscal quarter in the format 'YYYYQ#' to a date in the format 'YYYY-MM-DD'.
     Returns the last day of that quarter.
+    Also accepts a Series/Index/array of quarters, converted with integer month arithmetic
+    on the distinct quarters (missing quarters give NaT).
     """
+    if np.ndim(quarter) > 0:
+        codes, uniques = pd.factorize(np.asarray(quarter, dtype=object))
+        uniques = pd.Index(uniques, dtype=object)
+        years = uniques.str[:4].astype(int).to_numpy()
+        quarter_nums = uniques.str[-1].astype(int).to_numpy()
+        next_month = ((years - 1970) * 12 + quarter_nums * 3).astype("datetime64[M]")
+        ends = (next_month.astype("datetime64[D]") - np.timedelta64(1, "D")).astype("datetime64[ns]")
+        ends = np.append(ends, np.datetime64("NaT", "ns"))
+        values = ends[codes]
+        if isinstance(quarter, pd.Index):
+            return pd.DatetimeIndex(values, name=quarter.name)
+        return _like_input(quarter, values)
     year = int(quarter[:4])
     quarter_num = int(quarter[-1])
     month = quarter_num * 3 
@@ -81,33 +114,43 @@ def fetch_financial_data_quarterly(gvkey, start_date, end_date, db):
     #   AND consol='C'
     # """cshoq*
     
-    query = f"""
+    query = fundq_query(f"cst.gvkey = '{str(gvkey).zfill(6)}'\n      AND cst.datafqtr BETWEEN '{start_qtr}' AND '{end_qtr}'")
+    data = db.raw_sql(query)
+    return data
+
+def fundq_query(condition):
+    """Quarterly fundamentals query of fetch_financial_data_quarterly for the rows matching `condition`."""
+    return f"""
     SELECT datafqtr, atq AS total_assets, (atq - ceqq) AS book_debt, 
            ceqq AS book_equity, 
            cshoq*prccq AS market_equity, gvkey, conm
     FROM comp.fundq as cst
-    WHERE cst.gvkey = '{str(gvkey).zfill(6)}'
-      AND cst.datafqtr BETWEEN '{start_qtr}' AND '{end_qtr}'
+    WHERE ({condition})
       AND indfmt='INDL'
       AND datafmt='STD'
       AND popsrc='D'
       AND consol='C'
     """
-    data = db.raw_sql(query)
-    return data
 
-def fetch_data_for_tickers(ticks, db):
+@stage(fetch=True)
+@recorded()
+def fetch_data_for_tickers(ticks, db, coalesce=False, batch_size=50):
     """
     Function to fetch financial data for a list of tickers.
     
     Parameters:
       ticks (DataFrame): Contains ticker information including 'gvkey', 'Start Date', 'End Date', and optionally 'Ticker'.
       db: WRDS connection object.
+      coalesce (bool): Merge the overlapping windows of rows sharing a gvkey and fetch each
+        firm-quarter once, batch_size intervals per query (see fetch_planner.py). The result
+        has no duplicate rows; otherwise it equals the row-by-row fetch after drop_duplicates.
     
     Returns:
       prim_dealers (DataFrame): Fetched financial data.
       empty_tickers (list): List of tickers for which no data was fetched.
     """
+    if coalesce:
+        return _fetch_coalesced(ticks, db, batch_size=batch_size)
     empty_tickers = []
     prim_dealers = pd.DataFrame()
 
@@ -125,6 +168,36 @@ def fetch_data_for_tickers(ticks, db):
     
     return prim_dealers, empty_tickers
 
+def _fetch_coalesced(ticks, db, batch_size=50):
+    intervals, membership = fetch_planner.plan_fetches(ticks)
+    frames = []
+    for batch in fetch_planner.batches(intervals, batch_size):
+        condition = "\n       OR ".join(
+            f"(cst.gvkey = '{row.gvkey}' AND cst.datafqtr BETWEEN '{row.start_qtr}' AND '{row.end_qtr}')"
+            for row in batch.itertuples()
+        )
+        frames.append(db.raw_sql(fundq_query(condition)))
+    prim_dealers = pd.concat(frames, axis=0) if frames else pd.DataFrame()
+
+    # Dealer rows (including rows without a gvkey) with no data in their own window
+    attributed = fetch_planner.attribute_to_dealers(prim_dealers, membership) if len(prim_dealers) else None
+    found = set() if attributed is None else set(attributed['dealer_row'])
+    empty_tickers = []
+    for index, row in ticks.iterrows():
+        if index not in found:
+            ticker = row['Ticker'] if 'Ticker' in row else str(row['gvkey'])
+            empty_tickers.append({ticker: row['gvkey']})
+
+    summary = fetch_planner.plan_summary(intervals, membership, batch_size)
+    savings = fetch_planner.fetch_savings(prim_dealers, membership) if len(prim_dealers) else None
+    print(f"Fetch plan: {summary['dealer_rows']} dealer rows -> {summary['intervals']} intervals in "
+          f"{summary['queries_planned']} queries (instead of {summary['queries_per_row']}), "
+          f"{summary['firm_quarters_planned']} firm-quarters requested instead of {summary['firm_quarters_per_row']}")
+    if savings:
+        print(f"Fetched {savings['rows_fetched']} rows instead of {savings['rows_per_row']} "
+              f"(~{savings['bytes_saved'] / 1024:.1f} KiB saved)")
+    return prim_dealers, empty_tickers
+
 def load_macro_data(from_cache):
     """
     Function to load macro data from FRED.
@@ -139,6 +212,8 @@ def load_macro_data(from_cache):
                                               })
     return macro_data
 
+@stage(fetch=True)
+@recorded()
 def load_bd_financials():
     """
     Function to load broker-dealer financial data from FRED.
@@ -154,6 +229,8 @@ def load_bd_financials():
     bd_financials.index.name = 'datafqtr'
     return bd_financials
 
+@stage()
+@recorded()
 def load_fred_past(url=URL_FRED_2013, data_dir=DATA_DIR, prn_file_name='ltab127d.prn', csv_file_name='fred_bd_aem.csv'):
     """
     Download a ZIP file from a URL, extract a specific .prn file,
@@ -171,6 +248,7 @@ def load_fred_past(url=URL_FRED_2013, data_dir=DATA_DIR, prn_file_name='ltab127d
     try:
         response = requests.get(url)
         response.raise_for_status()
+        record_bytes(len(response.content))
 
         pulled_dir = Path(data_dir) / "pulled"
         pulled_dir.mkdir(parents=True, exist_ok=True)
@@ -191,7 +269,7 @@ def load_fred_past(url=URL_FRED_2013, data_dir=DATA_DIR, prn_file_name='ltab127d
         df.index = df.index.astype(str)
         df.index = df.index.str[:4] + 'Q' + df.index.str[5]
         df = df.loc['1968Q4':'2012Q4']
-        df.index = df.index.to_series().apply(quarter_to_date)
+        df.index = quarter_to_date(df.index)
         df.index.name = 'datafqtr'
 
         bd_financials = pd.DataFrame()
@@ -206,6 +284,8 @@ def load_fred_past(url=URL_FRED_2013, data_dir=DATA_DIR, prn_file_name='ltab127d
     except Exception as e:
         print(f"Failed to download or process file: {e}")
 
+@stage(fetch=True)
+@recorded()
 def fetch_ff_factors(start_date, end_date):
     """
     Fetches Fama-French research data factors, adjusts dates to end of the month,
@@ -223,6 +303,44 @@ def fetch_ff_factors(start_date, end_date):
     ff_facs.rename(columns={'Mkt-RF': 'mkt_ret'}, inplace=True)
     return ff_facs
 
+@stage(fetch=True)
+@recorded()
+def fetch_ff_portfolios(start_date, end_date, dataset='25_Portfolios_5x5'):
+    """
+    Fetches monthly value-weighted returns of Fama-French test portfolios (e.g. '25_Portfolios_5x5',
+    '100_Portfolios_10x10', '49_Industry_Portfolios') for Table03AssetPricing.py.
+
+    Parameters:
+      start_date (str): Start date in YYYYMMDD format.
+      end_date (str): End date in YYYYMMDD format.
+      dataset (str): Name of the portfolio file in Ken French's data library.
+
+    Returns:
+      returns (DataFrame): Monthly returns divided by 100, one column per portfolio, with the
+      library's missing-value code (-99.99) set to NaN.
+    """
+    rawdata = web.DataReader(dataset, data_source='famafrench', start=start_date, end=end_date)
+    returns = rawdata[0].replace([-99.99, -999], np.nan) / 100
+    return returns
+
+def load_test_portfolios_csv(path, date_col='date', percent=True):
+    """
+    Loads test-asset returns from a local CSV with a date column (dates or YYYYMM) and one
+    column per portfolio, e.g. a Ken French portfolio file or a larger in-house universe.
+
+    Returns:
+      returns (DataFrame): Returns (divided by 100 if percent) indexed by month-end date.
+    """
+    df = pd.read_csv(path)
+    dates = df.pop(date_col)
+    if pd.api.types.is_integer_dtype(dates):
+        dates = pd.to_datetime(dates.astype(str), format='%Y%m')
+    df.index = pd.to_datetime(dates) + pd.offsets.MonthEnd(0)
+    df.index.name = 'date'
+    df = df.apply(pd.to_numeric, errors='coerce').replace([-99.99, -999], np.nan)
+    return df / 100 if percent else df
+
+@stage()
 def pull_shiller_pe(url=URL_SHILLER, data_dir=DATA_DIR):
     """
     Download Shiller's S&P 500 P/E list from the website and save it to a cache.
@@ -237,6 +355,7 @@ def pull_shiller_pe(url=URL_SHILLER, data_dir=DATA_DIR):
     print(f"Downloading and caching from {url}")
     try:
         response = requests.get(url)
+        record_bytes(len(response.content))
         if response.status_code == 200:
             file_path = data_dir / "pulled" / "shiller_pe.xlsx"
             file_path.parent.mkdir(parents=True, exist_ok=True)
@@ -249,6 +368,8 @@ def pull_shiller_pe(url=URL_SHILLER, data_dir=DATA_DIR):
         print(f"Error downloading or saving the Shiller PE data: {e}")
         raise
 
+@stage()
+@recorded()
 def load_shiller_pe(url=URL_SHILLER, data_dir=DATA_DIR, from_cache=True):
     """
     Load Shiller P/E data from cache or pull it if cache is not available.
@@ -271,6 +392,8 @@ def load_shiller_pe(url=URL_SHILLER, data_dir=DATA_DIR, from_cache=True):
         df = pd.read_excel(file_path, sheet_name='Data', skiprows=7, usecols="A,M")
     return df
 
+@stage(fetch=True)
+@recorded()
 def pull_CRSP_Value_Weighted_Index(db, data_dir=DATA_DIR, from_cache=True, start_date=config.START_DATE, end_date=None):
     """
     Pulls a value-weighted stock index from the CRSP database.
@@ -313,3 +436,44 @@ def pull_CRSP_Value_Weighted_Index(db, data_dir=DATA_DIR, from_cache=True, start
       print(f"Downloaded CRSP data and saved to {cache_path}")
 
     return df
+
+@stage(fetch=True)
+@recorded()
+def pull_CCM_link_table(db):
+    """
+    Pulls the CRSP-Compustat link table (permno level) for link_resolution.py.
+
+    Returns:
+      DataFrame with columns gvkey, permno, linktype, linkprim, linkdt, linkenddt.
+    """
+    sql_query = """
+        SELECT gvkey, lpermno AS permno, linktype, linkprim, linkdt, linkenddt
+        FROM crsp.ccmxpf_linktable
+        WHERE substr(linktype,1,1)='L'
+          AND (linkprim ='C' OR linkprim='P')
+    """
+    return db.raw_sql(sql_query, date_cols=["linkdt", "linkenddt"])
+
+@stage(fetch=True)
+@recorded()
+def pull_CRSP_daily_market_equity(db, permnos, start_date, end_date=None):
+    """
+    Pulls daily market equity (in $ millions, like Compustat cshoq*prccq) of the given
+    permnos from the CRSP daily stock file.
+
+    Returns:
+      DataFrame with columns permno, date, market_equity.
+    """
+    if end_date is None:
+        end_date = datetime.today().strftime('%Y-%m-%d')
+    permno_str = ','.join(str(int(p)) for p in sorted(set(permnos)))
+    if not permno_str:
+        return pd.DataFrame(columns=['permno', 'date', 'market_equity'])
+    sql_query = f"""
+        SELECT permno, date, ABS(prc) * shrout / 1000 AS market_equity
+        FROM crsp.dsf
+        WHERE permno IN ({permno_str})
+          AND date BETWEEN '{start_date}' AND '{end_date}'
+          AND prc IS NOT NULL AND shrout IS NOT NULL
+    """
+    return db.raw_sql(sql_query, date_cols=["date"])
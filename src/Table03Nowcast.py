@@ -0,0 +1,219 @@
+"""
+Table03Nowcast.py
+
+Daily nowcast of the primary dealers' market capital ratio for risk monitoring.
+
+Table03.calculate_ratios gives quarterly ratios only, because market equity comes from
+Compustat (cshoq*prccq). Here the market equity is taken daily from CRSP (dealer permnos
+mapped to gvkeys with link_resolution.py), and each dealer's last reported quarterly
+book_debt is carried forward to every day until the next report:
+
+    market_cap_ratio(t) = sum_i ME_i(t) / (sum_i ME_i(t) + sum_i BD_i(last quarter <= t))
+
+summed over the dealers with both values on day t. Everything is computed for all dealers
+at once (merge_asof by gvkey, then one groupby by date).
+
+The engine takes market equity at any frequency. Given the Compustat quarterly market
+equity at quarter ends, its quarter-end sample reproduces the Table 3 market_cap_ratio
+(for dealer-quarters without missing values, which prep_dataset drops).
+
+With report_lag_days=0 (the default, as in Table 3) a quarter's book debt is used from
+the quarter end, i.e. before the 10-Q is actually filed. That is look-ahead: for real-time
+risk monitoring, set report_lag_days to the filing lag (e.g. 45) so that each day only uses
+book debt that was public on that day.
+
+The daily panel is kept in DATA_DIR/pulled/dealer_nowcast.parquet, with the book debt
+schedule it was built from next to it, and extended incrementally by main() with the days
+since the last run. A newly reported (or restated) quarter applies from its available_from
+date, which can lie before the last run, so the saved days from there on are recomputed too.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+import dealer_membership
+import link_resolution
+import Table02Prep
+import Table03Load
+from Table03Load import quarter_to_date
+from fixture_store import connect_wrds
+from pipeline_profiling import stage, profiled_run
+
+NOWCAST_FILE = config.DATA_DIR / "pulled" / "dealer_nowcast.parquet"
+BOOK_DEBT_FILE = config.DATA_DIR / "pulled" / "dealer_nowcast_book_debt.parquet"
+
+
+def _gvkey_int(gvkeys):
+    return pd.to_numeric(gvkeys, errors="coerce").astype("Int64")
+
+
+def book_debt_schedule(fundq, report_lag_days=0):
+    """
+    Quarterly book debt of each dealer and the date from which it is used.
+    Input: fundq (DataFrame) as returned by Table03Load.fetch_data_for_tickers; report_lag_days
+    shifts the availability after the quarter end (0 reproduces the Table 3 quarter alignment,
+    but uses each quarter's book debt before it is reported).
+    Output: DataFrame with gvkey (int), available_from and book_debt, sorted by available_from.
+    """
+    df = fundq[['gvkey', 'datafqtr', 'book_debt']].dropna()
+    df = df.drop_duplicates(subset=['gvkey', 'datafqtr'], keep='last')
+    schedule = pd.DataFrame({
+        'gvkey': _gvkey_int(df['gvkey']).to_numpy(dtype=float),
+        'available_from': quarter_to_date(df['datafqtr']).to_numpy() + np.timedelta64(report_lag_days, 'D'),
+        'book_debt': df['book_debt'].to_numpy(dtype=float),
+    })
+    schedule = schedule.dropna().astype({'gvkey': 'int64'})
+    return schedule.sort_values('available_from', kind='stable').reset_index(drop=True)
+
+
+def dealer_market_equity(crsp_daily, links):
+    """
+    Daily market equity per dealer gvkey from CRSP.
+    Input: crsp_daily (DataFrame) with permno, date, market_equity (Table03Load.pull_CRSP_daily_market_equity);
+    links (DataFrame) the CCM link table (Table03Load.pull_CCM_link_table).
+    Output: DataFrame with gvkey (int), date, market_equity summed over the gvkey's linked permnos.
+    """
+    linked = link_resolution.permno_to_gvkey(crsp_daily, links, date_col='date')
+    linked = linked.dropna(subset=['gvkey', 'market_equity'])
+    linked['gvkey'] = _gvkey_int(linked['gvkey'])
+    linked = linked.dropna(subset=['gvkey']).astype({'gvkey': 'int64'})
+    return linked.groupby(['gvkey', 'date'], as_index=False)['market_equity'].sum()
+
+
+@stage()
+def dealer_panel(market_equity, book_debt, dealers=None):
+    """
+    Dealer-day panel with the book debt carried forward.
+    Input: market_equity (DataFrame) with gvkey, date, market_equity; book_debt from
+    book_debt_schedule; dealers optionally the dealer table (clean_primary_dealers_data), in
+    which case only days on which the gvkey was a primary dealer are kept.
+    Output: DataFrame with gvkey, date, market_equity, book_debt (NaN before the first report).
+    """
+    me = market_equity.assign(gvkey=_gvkey_int(market_equity['gvkey']),
+                              date=pd.to_datetime(market_equity['date']))
+    me = me.dropna(subset=['gvkey', 'date']).astype({'gvkey': 'int64'}).sort_values('date', kind='stable')
+    if dealers is not None:
+        index = dealer_membership.build_membership_index(dealers)
+        me = me[dealer_membership.is_member(index, me['gvkey'], me['date'])]
+    panel = pd.merge_asof(
+        me[['gvkey', 'date', 'market_equity']], book_debt[['gvkey', 'available_from', 'book_debt']],
+        left_on='date', right_on='available_from', by='gvkey', direction='backward',
+    )
+    return panel.drop(columns='available_from').sort_values(['date', 'gvkey']).reset_index(drop=True)
+
+
+def aggregate_nowcast(panel):
+    """
+    Aggregate market capital ratio per day.
+    Input: panel (DataFrame) from dealer_panel.
+    Output: DataFrame indexed by date with market_equity, book_debt (sums over the dealers
+    with both values), n_dealers and market_cap_ratio.
+    """
+    complete = panel.dropna(subset=['market_equity', 'book_debt'])
+    daily = complete.groupby('date').agg(
+        market_equity=('market_equity', 'sum'),
+        book_debt=('book_debt', 'sum'),
+        n_dealers=('gvkey', 'nunique'),
+    )
+    daily['market_cap_ratio'] = daily['market_equity'] / (daily['book_debt'] + daily['market_equity'])
+    return daily
+
+
+def quarter_end_sample(nowcast):
+    """
+    The nowcast on the last available day of each quarter, indexed by the quarter-end
+    date like Table03.aggregate_ratios.
+    """
+    quarter = nowcast.index.to_period('Q')
+    sample = nowcast.groupby(quarter).tail(1)
+    sample.index = sample.index.to_period('Q').to_timestamp(how='end').normalize()
+    sample.index.name = 'date'
+    return sample
+
+
+def restatement_start(book_debt, previous_book_debt):
+    """
+    First date from which book_debt differs from previous_book_debt (new or restated quarters),
+    NaT if they are the same. Without a previous schedule everything may differ.
+    """
+    if previous_book_debt is None:
+        return book_debt['available_from'].min() if len(book_debt) else pd.NaT
+    cols = ['gvkey', 'available_from', 'book_debt']
+    diff = book_debt[cols].merge(previous_book_debt[cols], how='outer', indicator=True)
+    return diff.loc[diff['_merge'] != 'both', 'available_from'].min()
+
+
+def append_nowcast(panel, new_market_equity, book_debt, dealers=None, previous_book_debt=None):
+    """
+    Incremental daily update. Rows from the first new day onwards are replaced with the new
+    data, and saved rows from the first date at which book_debt differs from previous_book_debt
+    (the schedule the panel was built with; None = unknown, recompute all) are rejoined with the
+    current schedule, so the result equals a full rebuild.
+    Output: the updated panel and the aggregate for the recomputed days.
+    """
+    new_rows = dealer_panel(new_market_equity, book_debt, dealers=dealers)
+    if panel is None or panel.empty:
+        return new_rows, aggregate_nowcast(new_rows)
+    restart = restatement_start(book_debt, previous_book_debt)
+    first_new = new_rows['date'].min() if len(new_rows) else pd.NaT
+    kept = panel[panel['date'] < first_new] if len(new_rows) else panel
+    if pd.notna(restart) and restart <= kept['date'].max():
+        stale = kept['date'] >= restart
+        rejoined = dealer_panel(kept.loc[stale, ['gvkey', 'date', 'market_equity']], book_debt)
+        kept = pd.concat([kept[~stale], rejoined], ignore_index=True)
+        recomputed = pd.concat([rejoined, new_rows], ignore_index=True)
+    else:
+        recomputed = new_rows
+    updated = pd.concat([kept, new_rows], ignore_index=True).sort_values(['date', 'gvkey']).reset_index(drop=True)
+    return updated, aggregate_nowcast(recomputed)
+
+
+def _read_if_exists(path):
+    path = Path(path)
+    if not path.exists():
+        return None
+    return pd.read_parquet(path)
+
+
+def load_nowcast_panel(path=NOWCAST_FILE):
+    return _read_if_exists(path)
+
+
+def load_book_debt_schedule(path=BOOK_DEBT_FILE):
+    """The book debt schedule the saved panel was built with (None before the first run)."""
+    return _read_if_exists(path)
+
+
+@profiled_run("table03_nowcast")
+def main(start_date=config.START_DATE, path=NOWCAST_FILE, book_debt_path=BOOK_DEBT_FILE):
+    """
+    Extends the saved daily dealer panel with the days since the last run (or builds it from
+    start_date) and returns the daily aggregate nowcast.
+    """
+    db = connect_wrds()
+    dealers = Table02Prep.clean_primary_dealers_data(fname='Primary_Dealer_Link_Table3.csv')
+    fundq, _ = Table03Load.fetch_data_for_tickers(dealers, db, coalesce=True)
+    book_debt = book_debt_schedule(fundq)
+    links = Table03Load.pull_CCM_link_table(db)
+
+    panel = load_nowcast_panel(path)
+    previous_book_debt = load_book_debt_schedule(book_debt_path)
+    if panel is not None and not panel.empty:
+        start_date = (panel['date'].max() + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+    permnos = links.loc[_gvkey_int(links['gvkey']).isin(_gvkey_int(dealers['gvkey'])), 'permno'].dropna()
+    crsp_daily = Table03Load.pull_CRSP_daily_market_equity(db, permnos.tolist(), start_date)
+    panel, _ = append_nowcast(panel, dealer_market_equity(crsp_daily, links), book_debt, dealers=dealers,
+                              previous_book_debt=previous_book_debt)
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    panel.to_parquet(path, index=False)
+    book_debt.to_parquet(book_debt_path, index=False)
+    return aggregate_nowcast(panel)
+
+
+if __name__ == "__main__":
+    nowcast = main()
+    print(nowcast.tail())
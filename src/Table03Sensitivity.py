@@ -0,0 +1,253 @@
+"""
+Table03Sensitivity.py
+
+How much does each dealer drive the Table 3 capital ratios, factors and correlations?
+
+Instead of rerunning the Table 3 pipeline once per excluded dealer, the cleaned fundq
+pull is turned once into dealer x quarter matrices of market equity, book equity and
+book debt. A set of variants, each excluding some dealers, is a 0/1 mask matrix W
+(variants x dealers), and every variant's quarterly aggregates are W @ M: the totals
+minus the rows of the excluded dealers (sum-minus-self for leave-one-out), in one product.
+
+From the aggregates, all variants are carried through the rest of Table 3 at once:
+  - market_cap_ratio and book_cap_ratio (Table03.calculate_ratios),
+  - the AR(1) capital factors (Table03.convert_ratios_to_factors) as a batched OLS,
+  - the Panel A / Panel B correlations with the macro variables, using correlations
+    masked to the pairwise-complete observations like pandas' corr / corrwith.
+AEM leverage and its factor do not depend on the dealers and are computed once.
+
+A variant that excludes every dealer of some quarter has no ratio there; a rerun of
+Table03.main would drop the quarter from the series (prep_dataset has no row for it). For
+such variants the quarter is masked out of all columns, and the factors (including the AEM
+leverage factor, whose seasonal adjustment sees the shorter series) are recomputed with
+Table03.convert_ratios_to_factors on the reduced series, so they still match the rerun.
+
+```
+result = run_sensitivity(dataset, macro_dataset)                       # all leave-one-out variants
+result = run_sensitivity(dataset, macro_dataset, subsets=[["002968", "003243"]])
+result["panelA"].xs("-002968")     # Panel A correlations without dealer 002968
+```
+"""
+
+import numpy as np
+import pandas as pd
+
+import config
+import Table03
+from Table03Load import quarter_to_date
+from pipeline_profiling import stage
+
+BASELINE = 'all'
+
+
+@stage()
+def contribution_matrices(dataset, bd_financials, UPDATED=False):
+    """
+    Dealer x quarter matrices of the columns summed in Table03.prep_dataset.
+    Input: dataset (DataFrame) the raw fundq pull; bd_financials as for prep_dataset.
+    Output: dict with 'gvkeys' (dealers), 'dates' (the quarters kept by prep_dataset),
+    'market_equity', 'book_equity', 'book_debt', 'counts' (dealers x quarters arrays; counts
+    is the number of rows kept by prep_dataset) and 'base', the prep_dataset result for all dealers.
+    """
+    rows = dataset.drop_duplicates()
+    rows = rows.assign(datafqtr=quarter_to_date(rows['datafqtr'])).dropna()
+    base = Table03.prep_dataset(dataset.copy(), UPDATED=UPDATED, bd_financials=bd_financials)
+    dates = pd.DatetimeIndex(base['datafqtr'])
+
+    dealer_codes, gvkeys = pd.factorize(rows['gvkey'], sort=True)
+    date_codes = dates.get_indexer(rows['datafqtr'])
+    keep = date_codes >= 0
+    flat = dealer_codes[keep] * len(dates) + date_codes[keep]
+    matrices = {'gvkeys': pd.Index(gvkeys, name='gvkey'), 'dates': dates, 'base': base}
+    for col in ['market_equity', 'book_equity', 'book_debt']:
+        sums = np.bincount(flat, weights=rows[col].to_numpy(dtype=float)[keep], minlength=len(gvkeys) * len(dates))
+        matrices[col] = sums.reshape(len(gvkeys), len(dates))
+    matrices['counts'] = np.bincount(flat, minlength=len(gvkeys) * len(dates)).reshape(len(gvkeys), len(dates))
+    return matrices
+
+
+def variant_masks(gvkeys, subsets=None, leave_one_out=True):
+    """
+    Inclusion masks of the variants: the baseline with all dealers, one variant per
+    dealer left out (if leave_one_out) and one per excluded subset of gvkeys.
+    Output: (labels, W) with W a variants x dealers array of 0/1.
+    """
+    gvkeys = pd.Index(gvkeys)
+    labels = [BASELINE]
+    masks = [np.ones(len(gvkeys))]
+    if leave_one_out:
+        labels += [f"-{g}" for g in gvkeys]
+        masks += list(1 - np.eye(len(gvkeys)))
+    for subset in subsets or []:
+        positions = gvkeys.get_indexer(list(subset))
+        if (positions < 0).any():
+            raise KeyError(f"Unknown gvkeys in subset {subset}")
+        mask = np.ones(len(gvkeys))
+        mask[positions] = 0
+        labels.append("-" + "-".join(str(g) for g in subset))
+        masks.append(mask)
+    return labels, np.vstack(masks)
+
+
+def variant_ratios(matrices, W):
+    """market_cap_ratio and book_cap_ratio of every variant (variants x quarters arrays)."""
+    me = W @ matrices['market_equity']
+    be = W @ matrices['book_equity']
+    bd = W @ matrices['book_debt']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'market_cap_ratio': me / (bd + me),
+            'book_cap_ratio': be / (bd + be),
+        }
+
+
+def batched_ar1_factors(ratios):
+    """
+    The capital factor of Table03.convert_ratios_to_factors for many series at once:
+    residuals of an AR(1) with constant (OLS, as AutoReg(lags=1, trend='c')) fit to the
+    ratio with NaNs set to 0, divided by the lagged ratio. Rows are series; the first
+    quarter has no factor.
+    """
+    y = np.nan_to_num(ratios, nan=0.0)
+    x, z = y[:, :-1], y[:, 1:]
+    x_mean = x.mean(axis=1, keepdims=True)
+    z_mean = z.mean(axis=1, keepdims=True)
+    slope = ((x - x_mean) * (z - z_mean)).sum(axis=1, keepdims=True) / ((x - x_mean) ** 2).sum(axis=1, keepdims=True)
+    resid = z - (z_mean - slope * x_mean) - slope * x
+    factors = np.full(ratios.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        factors[:, 1:] = resid / ratios[:, :-1]
+    return factors
+
+
+def masked_corr(a, b):
+    """
+    Pearson correlation of a and b along the last axis (broadcast over the leading axes),
+    using only the observations where both are finite, like pandas' pairwise corr.
+    """
+    mask = np.isfinite(a) & np.isfinite(b)
+    n = mask.sum(axis=-1)
+    a = np.where(mask, a, 0.0)
+    b = np.where(mask, b, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a_mean = a.sum(axis=-1, keepdims=True) / n[..., None]
+        b_mean = b.sum(axis=-1, keepdims=True) / n[..., None]
+        da = np.where(mask, a - a_mean, 0.0)
+        db = np.where(mask, b - b_mean, 0.0)
+        corr = (da * db).sum(axis=-1) / np.sqrt((da ** 2).sum(axis=-1) * (db ** 2).sum(axis=-1))
+    return np.where(n >= 2, np.clip(corr, -1, 1), np.nan)
+
+
+def _correlation_tables(labels, main, main_cols, others, other_cols):
+    """
+    Correlation tables in the layout of Table03.calculate_correlation_panelA/B for all
+    variants: main is variants x main columns x T, others is other columns x T.
+    Output: DataFrame indexed by (variant, row).
+    """
+    within = masked_corr(main[:, :, None, :], main[:, None, :, :])
+    upper = np.triu(np.ones((len(main_cols), len(main_cols)), dtype=bool))
+    within = np.where(upper, within, np.nan)
+    against = masked_corr(main[:, :, None, :], others[None, None, :, :])
+    values = np.concatenate([within, against.transpose(0, 2, 1)], axis=1)
+    index = pd.MultiIndex.from_product([labels, list(main_cols) + list(other_cols)], names=['variant', 'row'])
+    return pd.DataFrame(values.reshape(-1, len(main_cols)), index=index, columns=list(main_cols))
+
+
+@stage()
+def run_sensitivity(dataset, macro, bd_financials=None, subsets=None, leave_one_out=True, UPDATED=False):
+    """
+    Ratios, factors and Panel A/B correlations of Table 3 for the baseline and for every
+    variant that excludes some dealers.
+    Input: dataset (DataFrame) the raw fundq pull (Table03Load.fetch_data_for_tickers); macro
+    from Table03.macro_variables; bd_financials as for prep_dataset; subsets a list of lists
+    of gvkeys to exclude together (leave-k-out).
+    Output: dict with
+      'variants': DataFrame of the variant labels, their excluded gvkeys and the number of
+        quarters left without dealers (dropped from that variant's series),
+      'market_cap_ratio', 'book_cap_ratio', 'market_capital_factor', 'book_capital_factor':
+        DataFrames indexed by quarter with one column per variant,
+      'panelA', 'panelB': correlation tables indexed by (variant, row).
+    """
+    if bd_financials is None:
+        bd_financials = Table03.combine_bd_financials(UPDATED=UPDATED)
+    matrices = contribution_matrices(dataset, bd_financials, UPDATED=UPDATED)
+    labels, W = variant_masks(matrices['gvkeys'], subsets=subsets, leave_one_out=leave_one_out)
+    dates = matrices['dates']
+
+    ratios = variant_ratios(matrices, W)
+    factors = {
+        'market_capital_factor': batched_ar1_factors(ratios['market_cap_ratio']),
+        'book_capital_factor': batched_ar1_factors(ratios['book_cap_ratio']),
+    }
+
+    # The dealer-independent parts (AEM leverage and macro columns) come from the baseline pipeline
+    base_ratios = Table03.aggregate_ratios(matrices['base'])
+    base_factors = Table03.convert_ratios_to_factors(base_ratios)
+    aem_leverage = np.tile(base_ratios['aem_leverage'].to_numpy(dtype=float), (len(labels), 1))
+    aem_factor = np.tile(base_factors['aem_leverage_factor'].to_numpy(dtype=float), (len(labels), 1))
+
+    # Variants without any dealer in some quarters: drop those quarters as a rerun would
+    empty = (W @ matrices['counts']) == 0
+    for v in np.flatnonzero(empty.any(axis=1)):
+        keep = ~empty[v]
+        reduced = base_ratios[keep].assign(market_cap_ratio=ratios['market_cap_ratio'][v, keep],
+                                           book_cap_ratio=ratios['book_cap_ratio'][v, keep])
+        reduced_factors = Table03.convert_ratios_to_factors(reduced)
+        for values, column in [(factors['market_capital_factor'], 'market_capital_factor'),
+                               (factors['book_capital_factor'], 'book_capital_factor'),
+                               (aem_factor, 'aem_leverage_factor')]:
+            values[v] = np.nan
+            values[v, keep] = reduced_factors[column].to_numpy(dtype=float)
+        for values in (ratios['market_cap_ratio'], ratios['book_cap_ratio'], aem_leverage):
+            values[v, ~keep] = np.nan
+    panelA = Table03.create_panelA(base_ratios, macro)
+    panelB = Table03.create_panelB(base_factors, macro)
+    if not UPDATED:
+        panelA = panelA[:config.END_DATE]
+        panelB = panelB[:config.END_DATE]
+
+    def _aligned(values, index):
+        return values[:, dates.get_indexer(index)]
+
+    main_a = np.stack([
+        _aligned(ratios['market_cap_ratio'], panelA.index),
+        _aligned(ratios['book_cap_ratio'], panelA.index),
+        _aligned(aem_leverage, panelA.index),
+    ], axis=1)
+    other_a = ['E/P', 'Unemployment', 'GDP', 'Financial conditions', 'Market volatility']
+    corr_a = _correlation_tables(labels, main_a, ['Market capital', 'Book capital', 'AEM leverage'],
+                                 panelA[other_a].to_numpy(dtype=float).T, other_a)
+
+    main_b = np.stack([
+        _aligned(factors['market_capital_factor'], panelB.index),
+        _aligned(factors['book_capital_factor'], panelB.index),
+        _aligned(aem_factor, panelB.index),
+    ], axis=1)
+    other_b = ['Market excess return', 'E/P growth', 'Unemployment growth', 'GDP growth',
+               'Financial conditions growth', 'Market volatility growth']
+    corr_b = _correlation_tables(labels, main_b, ['Market capital factor', 'Book capital factor', 'AEM leverage factor'],
+                                 panelB[other_b].to_numpy(dtype=float).T, other_b)
+
+    gvkeys = matrices['gvkeys']
+    result = {
+        'variants': pd.DataFrame({
+            'variant': labels,
+            'excluded': [list(gvkeys[w == 0]) for w in W],
+            'dropped_quarters': empty.sum(axis=1),
+        }),
+        'panelA': corr_a,
+        'panelB': corr_b,
+    }
+    for name, values in {**ratios, **factors}.items():
+        result[name] = pd.DataFrame(values.T, index=dates.rename('date'), columns=labels)
+    return result
+
+
+def dealer_influence(result, panel='panelA'):
+    """
+    Change of each correlation when a dealer (or subset) is excluded, relative to the
+    baseline with all dealers. Output: DataFrame indexed by (variant, row).
+    """
+    table = result[panel].drop(index=BASELINE, level='variant')
+    baseline = result[panel].xs(BASELINE, level='variant')
+    return table - baseline.reindex(table.index.get_level_values('row')).to_numpy()
@@ -8,6 +8,9 @@ It verifies that:
 - (Optionally, additional tests such as checking file existence can be added.)
 
 The tests are modeled after the Table02_testing.py tests.
+
+Run with DATA_MODE=record once (needs WRDS and network), then with DATA_MODE=replay
+to run offline from the recorded fixtures (see fixture_store.py).
 """
 
 import warnings
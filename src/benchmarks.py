@@ -0,0 +1,211 @@
+"""
+benchmarks.py
+
+Offline benchmark suite for the hot functions of the Table 2 / Table 3 pipelines.
+Inputs come from synthetic_data.py, so no WRDS credentials or network access are needed.
+
+Each benchmark case has a setup step (not timed) that builds fresh inputs for every
+repetition, since several pipeline functions modify their inputs in place. Results are
+appended to OUTPUT_DIR/benchmarks/results.jsonl together with the current git commit,
+which lets us track regressions across commits (asv style):
+
+```
+python src/benchmarks.py --scale small
+python src/benchmarks.py --scale medium --cases Table03.prep_dataset --repeat 5
+python src/benchmarks.py --scale small --fail-on-regression   # non-zero exit if >20% slower
+```
+
+Scales are (number of firms, number of years of quarters). The "xlarge" scale has
+about 10^8 firm-quarter rows and needs tens of GB of memory.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+import misc_tools
+import synthetic_data
+import Table02Prep
+import Table03
+
+SCALES = {
+    "tiny": (100, 50),
+    "small": (1_000, 50),
+    "medium": (10_000, 75),
+    "large": (100_000, 100),
+    "xlarge": (1_000_000, 100),
+}
+
+RESULTS_FILE = config.OUTPUT_DIR / "benchmarks" / "results.jsonl"
+
+
+def _table03_prep_dataset(n_firms, n_years):
+    panel = synthetic_data.make_fundq_panel(n_firms=n_firms, n_years=n_years).drop(columns=["datadate"])
+    bd = synthetic_data.make_bd_financials(n_years=n_years)
+    return lambda: ((panel.copy(),), {"bd_financials": bd})
+
+
+def _table02_prep_datasets(n_firms, n_years):
+    datasets = synthetic_data.make_comparison_group_datasets(n_firms=n_firms, n_years=n_years)
+    return lambda: (({k: v.copy() for k, v in datasets.items()},), {})
+
+
+def _table02_create_ratios_for_table(n_firms, n_years):
+    datasets = synthetic_data.make_comparison_group_datasets(n_firms=n_firms, n_years=n_years)
+    prepped = Table02Prep.prep_datasets(datasets)
+    return lambda: (({k: v.copy() for k, v in prepped.items()},), {})
+
+
+def _table03_convert_ratios_to_factors(n_firms, n_years):
+    ratios = synthetic_data.make_ratio_panel(n_quarters=4 * n_years)
+    return lambda: ((ratios.copy(),), {})
+
+
+def _misc_with_lagged_columns(n_firms, n_years):
+    panel = synthetic_data.make_long_panel(n_ids=n_firms, n_periods=4 * n_years, freq="QS")
+    return lambda: ((), {"df": panel.copy(), "column_to_lag": "value", "id_column": "id",
+                         "lags": 1, "freq": "QS", "resample": True})
+
+
+# name -> (function to time, setup(n_firms, n_years) returning a callable that makes fresh (args, kwargs))
+CASES = {
+    "Table03.prep_dataset": (Table03.prep_dataset, _table03_prep_dataset),
+    "Table02Prep.prep_datasets": (Table02Prep.prep_datasets, _table02_prep_datasets),
+    "Table02Prep.create_ratios_for_table": (Table02Prep.create_ratios_for_table, _table02_create_ratios_for_table),
+    "Table03.convert_ratios_to_factors": (Table03.convert_ratios_to_factors, _table03_convert_ratios_to_factors),
+    "misc_tools.with_lagged_columns": (misc_tools.with_lagged_columns, _misc_with_lagged_columns),
+}
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=config.BASE_DIR,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+def time_case(name, scale="small", repeat=3):
+    """Run one benchmark case `repeat` times and return a result record (times in seconds)."""
+    func, setup = CASES[name]
+    n_firms, n_years = SCALES[scale]
+    make_inputs = setup(n_firms, n_years)
+    times = []
+    for _ in range(repeat):
+        args, kwargs = make_inputs()
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return {
+        "case": name,
+        "scale": scale,
+        "n_firms": n_firms,
+        "n_years": n_years,
+        "repeat": repeat,
+        "best_s": min(times),
+        "median_s": statistics.median(times),
+    }
+
+
+def run_benchmarks(scale="small", repeat=3, cases=None):
+    cases = list(CASES) if cases is None else cases
+    commit = git_commit()
+    stamp = datetime.now().isoformat(timespec="seconds")
+    results = []
+    for name in cases:
+        record = time_case(name, scale=scale, repeat=repeat)
+        record.update({
+            "commit": commit,
+            "timestamp": stamp,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+        })
+        print(f"{name:<40} {scale:<7} best {record['best_s']:.4f}s  median {record['median_s']:.4f}s")
+        results.append(record)
+    return results
+
+
+def save_results(results, results_file=RESULTS_FILE):
+    results_file = Path(results_file)
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_file, "a", encoding="utf-8") as f:
+        for record in results:
+            f.write(json.dumps(record) + "\n")
+
+
+def load_results(results_file=RESULTS_FILE):
+    results_file = Path(results_file)
+    if not results_file.exists():
+        return pd.DataFrame()
+    with open(results_file, "r", encoding="utf-8") as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def compare_to_previous(results, history, threshold=1.2):
+    """
+    Compare each new result with the most recent result for the same case and scale
+    from a different commit. Returns a DataFrame with the ratio new/old of the best
+    times and a `regression` flag when the ratio exceeds `threshold`.
+    """
+    rows = []
+    for record in results:
+        if history.empty:
+            break
+        prev = history[
+            (history["case"] == record["case"])
+            & (history["scale"] == record["scale"])
+            & (history["commit"] != record["commit"])
+        ]
+        if prev.empty:
+            continue
+        prev = prev.iloc[-1]
+        ratio = record["best_s"] / prev["best_s"]
+        rows.append({
+            "case": record["case"],
+            "scale": record["scale"],
+            "previous_commit": prev["commit"],
+            "previous_best_s": prev["best_s"],
+            "best_s": record["best_s"],
+            "ratio": ratio,
+            "regression": ratio > threshold,
+        })
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[3])
+    parser.add_argument("--scale", default="small", choices=list(SCALES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cases", nargs="*", choices=list(CASES), default=None)
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="flag a regression when new/old best time exceeds this ratio")
+    parser.add_argument("--no-save", action="store_true", help="do not append results to the history file")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    history = load_results()
+    results = run_benchmarks(scale=args.scale, repeat=args.repeat, cases=args.cases)
+    comparison = compare_to_previous(results, history, threshold=args.threshold)
+    if not comparison.empty:
+        print(comparison.to_string(index=False))
+    if not args.no_save:
+        save_results(results)
+    if args.fail_on_regression and not comparison.empty and comparison["regression"].any():
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,6 +21,25 @@ OUTPUT_DIR = config('OUTPUT_DIR', default=(BASE_DIR / 'my_output'), cast=Path)
 START_DATE = config('START_DATE', default='1960-01-01')
 END_DATE = config('END_DATE', default='2012-12-31')
 UPDATED_END_DATE = config('UPDATED_END_DATE', default='2025-01-01')
+# Stage timing / memory instrumentation (see pipeline_profiling.py)
+PROFILE_PIPELINE = config('PROFILE_PIPELINE', default=False, cast=bool)
+PROFILE_DUMP = config('PROFILE_DUMP', default='')  # '', 'cprofile' or 'pyinstrument'
+# Record/replay of WRDS and network loaders (see fixture_store.py)
+DATA_MODE = config('DATA_MODE', default='live')  # 'live', 'record' or 'replay'
+FIXTURE_DIR = config('FIXTURE_DIR', default=(DATA_DIR / 'fixtures'), cast=Path)
+# Immutable snapshots of pulled datasets for revision tracking (see vintage_store.py)
+SAVE_VINTAGES = config('SAVE_VINTAGES', default=False, cast=bool)
+VINTAGE_DIR = config('VINTAGE_DIR', default=(DATA_DIR / 'vintages'), cast=Path)
+# Execution backend for the Table 2 aggregation stages: 'pandas' or 'polars'
+TABLE02_BACKEND = config('TABLE02_BACKEND', default='pandas')
+# Also export Table 3 correlations for value-, equal- and median-weighted capital ratios
+TABLE03_WEIGHTING_VARIANTS = config('TABLE03_WEIGHTING_VARIANTS', default=False, cast=bool)
+# Block-bootstrap confidence intervals for the Table 3 correlations (see Table03Inference.py); 0 replicates = off
+TABLE03_BOOTSTRAP_REPS = config('TABLE03_BOOTSTRAP_REPS', default=0, cast=int)
+TABLE03_BOOTSTRAP_METHOD = config('TABLE03_BOOTSTRAP_METHOD', default='stationary')  # 'stationary' or 'moving'
+TABLE03_BOOTSTRAP_JOBS = config('TABLE03_BOOTSTRAP_JOBS', default=1, cast=int)
+# Newey-West standard errors for the Table 3 correlations and factor regressions (see Table03Inference.py)
+TABLE03_HAC = config('TABLE03_HAC', default=False, cast=bool)
 
 def ensure_directories():
     """
@@ -35,6 +54,13 @@ def ensure_directories():
     (DATA_DIR / 'manual').mkdir(parents=True, exist_ok=True)
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+def get_table02_backend(backend=None):
+    """Execution backend for the Table 2 aggregation stages: 'pandas' (default) or 'polars'."""
+    backend = (backend or TABLE02_BACKEND).lower()
+    if backend not in ('pandas', 'polars'):
+        raise ValueError(f"Unknown backend {backend!r}; expected 'pandas' or 'polars'")
+    return backend
+
 if __name__ == "__main__":
     """
     Running this file directly will call ensure_directories() and print out 
@@ -0,0 +1,116 @@
+"""
+dealer_membership.py
+
+Point-in-time primary-dealer membership, built once from the dealer table
+(Primary_Dealer_Link_Table3.csv / ticks.csv as returned by clean_primary_dealers_data).
+
+The index stores each gvkey's membership as disjoint day intervals (integer days since
+1970-01-01; 'Current' is open-ended), so queries are binary searches instead of
+re-filtering the dealer DataFrame with date strings:
+
+```
+index = build_membership_index(prim_dealers)
+members_at(index, ["1998-09-30"])                          # gvkeys that were dealers that day
+panel["is_pd"] = is_member(index, panel["gvkey"], panel["datadate"])
+```
+
+For n queries against m intervals both queries cost O(n log m).
+"""
+
+import numpy as np
+import pandas as pd
+
+import fetch_planner
+
+# Day number used for the end of open-ended ('Current') memberships
+OPEN_END = np.iinfo(np.int32).max
+
+
+def to_days(dates):
+    """Integer days since 1970-01-01 of a scalar or array of dates (strings, datetimes, ...)."""
+    days = pd.to_datetime(pd.Series(np.atleast_1d(dates))).to_numpy().astype("datetime64[D]")
+    return days.astype("int64")
+
+
+def _key(gvkeys, days):
+    # (gvkey, day) packed into one sortable int64; days are offset to be non-negative
+    return (np.asarray(gvkeys, dtype="int64") << 32) | (np.asarray(days, dtype="int64") + 2**31)
+
+
+def build_membership_index(dealers):
+    """
+    Membership index of a dealer table with 'gvkey', 'Start Date' and 'End Date'
+    ('Current' for dealers that are still active). Rows without a gvkey are dropped.
+
+    Returns a dict of numpy arrays:
+      gvkey, start, end: the disjoint membership intervals (inclusive days), sorted by
+        gvkey and start,
+      key: the packed (gvkey, start) of each interval, for is_member,
+      bounds, segment_ptr, segment_gvkeys: the dates at which the membership changes and,
+        for each segment between them, the sorted gvkeys that are members (CSR layout),
+        for members_at.
+    """
+    dealers = dealers[pd.to_numeric(dealers["gvkey"], errors="coerce").fillna(0) != 0]
+    current = dealers["End Date"].astype(str) == "Current"
+    windows = pd.DataFrame({
+        "gvkey": dealers["gvkey"].astype("int64").to_numpy(),
+        "start_ord": to_days(dealers["Start Date"]),
+        "end_ord": np.where(current, OPEN_END, to_days(dealers["End Date"].where(~current))),
+    })
+    windows = windows[windows["start_ord"] <= windows["end_ord"]]
+    _, intervals = fetch_planner.coalesce_intervals(windows)
+    gvkey = intervals["gvkey"].to_numpy(dtype="int64")
+    start = intervals["start_ord"].to_numpy(dtype="int64")
+    end = intervals["end_ord"].to_numpy(dtype="int64")
+
+    # Membership is constant between consecutive change points (a start, or the day after an end)
+    bounds = np.unique(np.concatenate([start, end[end < OPEN_END] + 1]))
+    first = np.searchsorted(bounds, start)
+    last = np.searchsorted(bounds, end, side="right") - 1
+    counts = last - first + 1
+    owner = np.repeat(np.arange(len(gvkey)), counts)
+    seg_of = np.repeat(first, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    order = np.lexsort((gvkey[owner], seg_of))
+    segment_ptr = np.concatenate([[0], np.cumsum(np.bincount(seg_of, minlength=len(bounds)))])
+    return {
+        "gvkey": gvkey,
+        "start": start,
+        "end": end,
+        "key": _key(gvkey, start),
+        "bounds": bounds,
+        "segment_ptr": segment_ptr,
+        "segment_gvkeys": gvkey[owner][order],
+    }
+
+
+def is_member(index, gvkeys, dates):
+    """Boolean array: was gvkeys[i] a primary dealer on dates[i]? (Scalars are broadcast.)"""
+    gvkeys = pd.to_numeric(pd.Series(np.atleast_1d(gvkeys)), errors="coerce").fillna(0).to_numpy(dtype="int64")
+    days = to_days(dates)
+    gvkeys, days = np.broadcast_arrays(gvkeys, days)
+    if len(index["key"]) == 0:
+        return np.zeros(len(days), dtype=bool)
+    # The candidate is the last interval starting at or before (gvkey, day)
+    pos = np.searchsorted(index["key"], _key(gvkeys, days), side="right") - 1
+    valid = pos >= 0
+    pos = np.where(valid, pos, 0)
+    return valid & (index["gvkey"][pos] == gvkeys) & (days <= index["end"][pos])
+
+
+def members_at(index, dates):
+    """
+    Long DataFrame (date, gvkey) of the primary dealers on each of the dates, in the
+    order of the dates and then by gvkey.
+    """
+    dates = pd.to_datetime(pd.Series(np.atleast_1d(dates)))
+    # Dates before the first change point fall in segment -1, which has no members
+    seg = np.searchsorted(index["bounds"], to_days(dates), side="right") - 1
+    ptr = np.concatenate([[0], index["segment_ptr"]])
+    seg_start, seg_end = ptr[seg + 1], ptr[seg + 2]
+    counts = seg_end - seg_start
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    rows = np.repeat(np.arange(len(dates)), counts)
+    return pd.DataFrame({
+        "date": dates.to_numpy()[rows],
+        "gvkey": index["segment_gvkeys"][np.repeat(seg_start, counts) + offsets],
+    })
@@ -0,0 +1,172 @@
+"""
+fetch_planner.py
+
+Plans the Compustat fundq pulls for a dealer table (ticks.csv, Primary_Dealer_Link_Table3.csv).
+
+Several dealer rows often map to the same gvkey with overlapping or adjacent membership
+windows (a dealer renamed or moved inside the same holding company, e.g. gvkeys 2943,
+2968 or 3243). Fetching every row separately pulls the shared firm-quarters more than once,
+and the duplicates are only dropped again in Table03.prep_dataset.
+
+The planner works at quarter granularity, like the fundq query (datafqtr BETWEEN start AND
+end). It merges each gvkey's windows into a minimal set of disjoint quarter intervals, so
+every firm-quarter is fetched once. The intervals can then be fetched a batch at a time.
+The returned membership table maps each dealer row to the interval that covers it, so the
+fetched data can still be attributed to individual dealers:
+
+```
+intervals, membership = plan_fetches(prim_dealers)
+data = ...  # fetch each interval (see Table03Load.fetch_data_for_tickers(coalesce=True))
+per_dealer = attribute_to_dealers(data, membership)
+print(fetch_savings(data, membership))
+```
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+def quarter_ordinal(dates):
+    """Quarter number year * 4 + (quarter - 1) of each date (a Series of Timestamps)."""
+    return dates.dt.year * 4 + (dates.dt.month - 1) // 3
+
+
+def ordinal_to_quarter(ordinals):
+    """Inverse of quarter_ordinal as Compustat datafqtr strings, e.g. '1990Q1'."""
+    ordinals = pd.Series(ordinals, dtype="int64")
+    return (ordinals // 4).astype(str) + "Q" + (ordinals % 4 + 1).astype(str)
+
+
+def _gvkey_str(gvkeys):
+    return pd.Series(gvkeys).astype("int64").astype(str).str.zfill(6)
+
+
+def _dealer_windows(ticks, today=None):
+    """Quarter window (start and end ordinal) of each dealer row with a gvkey."""
+    today = pd.Timestamp(today or datetime.today().strftime("%Y-%m-%d"))
+    current = ticks["End Date"] == "Current"
+    end_dates = pd.to_datetime(ticks["End Date"].where(~current)).where(~current, today)
+    windows = pd.DataFrame({
+        "gvkey": pd.to_numeric(ticks["gvkey"], errors="coerce"),
+        "start_ord": quarter_ordinal(pd.to_datetime(ticks["Start Date"])),
+        "end_ord": quarter_ordinal(end_dates),
+    }, index=ticks.index)
+    # Rows without a gvkey are not fetched (as in fetch_financial_data_quarterly)
+    windows = windows[windows["gvkey"].fillna(0) != 0].dropna()
+    return windows.astype("int64")
+
+
+def coalesce_intervals(windows):
+    """
+    Merge overlapping or adjacent quarter windows of the same gvkey.
+
+    `windows` has columns gvkey, start_ord and end_ord (inclusive quarter ordinals).
+    Returns the interval number of each window (aligned with `windows`) and the intervals
+    (gvkey, start_ord, end_ord), which are disjoint and sorted by gvkey and start.
+    """
+    order = np.lexsort((windows["start_ord"].to_numpy(), windows["gvkey"].to_numpy()))
+    gvkey = windows["gvkey"].to_numpy()[order]
+    start = windows["start_ord"].to_numpy()[order]
+    end = windows["end_ord"].to_numpy()[order]
+
+    # Running max of the end quarter within each gvkey: a window starts a new interval
+    # when it begins after everything before it (of the same gvkey) has ended
+    new_gvkey = np.ones(len(order), dtype=bool)
+    new_gvkey[1:] = gvkey[1:] != gvkey[:-1]
+    gvkey_id = np.cumsum(new_gvkey) - 1
+    running_end = pd.Series(end).groupby(gvkey_id).cummax().to_numpy()
+    starts_interval = new_gvkey.copy()
+    starts_interval[1:] |= start[1:] > running_end[:-1] + 1
+    interval_sorted = np.cumsum(starts_interval) - 1
+
+    interval_id = np.empty(len(order), dtype="int64")
+    interval_id[order] = interval_sorted
+    intervals = pd.DataFrame({"gvkey": gvkey, "start_ord": start, "end_ord": end}).groupby(
+        interval_sorted).agg(gvkey=("gvkey", "first"), start_ord=("start_ord", "min"), end_ord=("end_ord", "max"))
+    intervals.index.name = "interval_id"
+    return interval_id, intervals
+
+
+def plan_fetches(ticks, today=None):
+    """
+    Fetch plan for a dealer table with 'gvkey', 'Start Date' and 'End Date' ('Current'
+    for dealers that are still active).
+
+    Returns
+      intervals: one row per interval to fetch, with gvkey (zero-padded str) and the
+        first and last quarter (start_qtr, end_qtr).
+      membership: one row per dealer row (indexed like ticks), with its gvkey, its own
+        quarter window and the interval_id of the interval that covers it.
+    """
+    windows = _dealer_windows(ticks, today=today)
+    interval_id, intervals = coalesce_intervals(windows)
+
+    intervals = pd.DataFrame({
+        "gvkey": _gvkey_str(intervals["gvkey"]).to_numpy(),
+        "start_qtr": ordinal_to_quarter(intervals["start_ord"]).to_numpy(),
+        "end_qtr": ordinal_to_quarter(intervals["end_ord"]).to_numpy(),
+        "n_quarters": (intervals["end_ord"] - intervals["start_ord"] + 1).to_numpy(),
+    }, index=intervals.index)
+    membership = pd.DataFrame({
+        "gvkey": _gvkey_str(windows["gvkey"]).to_numpy(),
+        "start_qtr": ordinal_to_quarter(windows["start_ord"]).to_numpy(),
+        "end_qtr": ordinal_to_quarter(windows["end_ord"]).to_numpy(),
+        "n_quarters": (windows["end_ord"] - windows["start_ord"] + 1).to_numpy(),
+        "interval_id": interval_id,
+    }, index=windows.index)
+    return intervals, membership
+
+
+def batches(intervals, batch_size=50):
+    """Split the intervals into consecutive batches of at most batch_size, one query each."""
+    return [intervals.iloc[i:i + batch_size] for i in range(0, len(intervals), batch_size)]
+
+
+def plan_summary(intervals, membership, batch_size=50):
+    """Quarters and queries of the plan compared with fetching every dealer row separately."""
+    return {
+        "dealer_rows": len(membership),
+        "intervals": len(intervals),
+        "queries_per_row": len(membership),
+        "queries_planned": -(-len(intervals) // batch_size),
+        "firm_quarters_per_row": int(membership["n_quarters"].sum()),
+        "firm_quarters_planned": int(intervals["n_quarters"].sum()),
+    }
+
+
+def attribute_to_dealers(data, membership):
+    """
+    Rows of the fetched data that fall in each dealer row's own window, with the dealer
+    row's index in a 'dealer_row' column. This is what fetching each dealer row
+    separately would have returned (concatenated).
+    """
+    data = data.reset_index(drop=True)
+    members = membership.rename_axis("dealer_row").reset_index()[["dealer_row", "gvkey", "start_qtr", "end_qtr"]]
+    gvkeys = _gvkey_str(data["gvkey"]).to_numpy()
+    merged = pd.DataFrame({"_row": np.arange(len(data)), "gvkey": gvkeys}).merge(members, on="gvkey")
+    quarters = data["datafqtr"].to_numpy()[merged["_row"].to_numpy()]
+    # datafqtr strings 'YYYYQn' sort in time order
+    inside = (quarters >= merged["start_qtr"].to_numpy()) & (quarters <= merged["end_qtr"].to_numpy())
+    merged = merged[inside]
+    attributed = data.iloc[merged["_row"].to_numpy()].reset_index(drop=True)
+    attributed["dealer_row"] = merged["dealer_row"].to_numpy()
+    return attributed
+
+
+def fetch_savings(data, membership):
+    """
+    Rows and bytes fetched with the plan compared with fetching every dealer row
+    separately (bytes estimated from the average in-memory size of a fetched row).
+    """
+    rows_planned = len(data)
+    rows_per_row = len(attribute_to_dealers(data, membership)) if rows_planned else 0
+    bytes_fetched = int(data.memory_usage(index=False, deep=True).sum()) if rows_planned else 0
+    bytes_per_row = bytes_fetched / rows_planned if rows_planned else 0
+    return {
+        "rows_fetched": rows_planned,
+        "rows_per_row": rows_per_row,
+        "bytes_fetched": bytes_fetched,
+        "bytes_saved": int(round((rows_per_row - rows_planned) * bytes_per_row)),
+    }
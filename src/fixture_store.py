@@ -0,0 +1,126 @@
+"""
+fixture_store.py
+
+Record/replay layer for the data loaders, so that the Table 02 / Table 03 pipelines and
+their tests can run offline and in seconds.
+
+Loaders that hit WRDS or the network are wrapped with the `recorded` decorator. Its
+behaviour is controlled by DATA_MODE (in .env or the environment):
+
+  - live   (default): call the loader as usual.
+  - record: call the loader and save what it returns to FIXTURE_DIR.
+  - replay: return the saved result without calling the loader (no WRDS, no network).
+
+Fixtures are keyed by the loader name and a hash of its arguments (DataFrames are hashed
+by content; WRDS connections and data_dir paths are ignored so fixtures recorded on one
+machine replay on another), so e.g. fetch_data_for_tickers called with a
+different dealer table will not silently replay stale data.
+
+Typical use:
+```
+DATA_MODE=record ipython -m unittest Table03_testing.py   # once, with WRDS access
+DATA_MODE=replay ipython -m unittest Table03_testing.py   # afterwards, offline
+```
+"""
+
+import functools
+import hashlib
+import inspect
+from datetime import date, datetime
+from pathlib import Path
+
+import pandas as pd
+
+import config
+
+MODES = ("live", "record", "replay")
+
+
+def get_mode():
+    mode = str(config.DATA_MODE).lower()
+    if mode not in MODES:
+        raise ValueError(f"Unknown DATA_MODE {config.DATA_MODE!r}; expected one of {MODES}")
+    return mode
+
+
+def connect_wrds():
+    """
+    Open a WRDS connection, except in replay mode where no connection is needed
+    (recorded loaders ignore the connection argument) and None is returned.
+    """
+    if get_mode() == "replay":
+        return None
+    import wrds
+    return wrds.Connection(wrds_username=config.WRDS_USERNAME)
+
+
+def _update_hash(h, value):
+    """
+    Feed a loader argument into the hash. Objects that aren't data and Paths (cache
+    locations, which differ between machines) are skipped.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        h.update(b"frame")
+        columns = value.columns if isinstance(value, pd.DataFrame) else [value.name]
+        h.update(repr(list(columns)).encode("utf-8"))
+        h.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    elif isinstance(value, dict):
+        h.update(b"dict")
+        for k in sorted(value, key=repr):
+            h.update(repr(k).encode("utf-8"))
+            _update_hash(h, value[k])
+    elif isinstance(value, (list, tuple)):
+        h.update(b"seq")
+        for v in value:
+            _update_hash(h, v)
+    elif value is None or isinstance(value, (str, int, float, bool, date, datetime)):
+        h.update(repr(value).encode("utf-8"))
+
+
+def fixture_key(func, args, kwargs, ignore=("db",)):
+    """Hash of the bound arguments of a loader call (defaults applied), skipping those named in `ignore`."""
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    h = hashlib.sha256()
+    for name, value in bound.arguments.items():
+        if name in ignore:
+            continue
+        h.update(name.encode("utf-8"))
+        _update_hash(h, value)
+    return h.hexdigest()[:16]
+
+
+def fixture_path(name, key):
+    return Path(config.FIXTURE_DIR) / f"{name}-{key}.pkl"
+
+
+def recorded(name=None, ignore=("db",)):
+    """
+    Decorator that records or replays a loader's return value depending on DATA_MODE.
+    Arguments named in `ignore` (the WRDS connection by default) are not part of the fixture key.
+    """
+    def decorator(func):
+        fixture_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            mode = get_mode()
+            if mode == "live":
+                return func(*args, **kwargs)
+            path = fixture_path(fixture_name, fixture_key(func, args, kwargs, ignore))
+            if mode == "replay":
+                if not path.exists():
+                    raise FileNotFoundError(
+                        f"No recorded fixture for {fixture_name} at {path}. "
+                        "Run once with DATA_MODE=record to create it."
+                    )
+                return pd.read_pickle(path)
+            result = func(*args, **kwargs)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            pd.to_pickle(result, path)
+            print(f"Recorded fixture for {fixture_name} to {path}")
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,157 @@
+"""
+link_resolution.py
+
+Applies the CRSP-Compustat link table (pull_CRSP_Comp_Link_Table in Table02Prep.py and
+pull_CRSP_Compustat.py) to whole panels: (permno, date) -> gvkey for CRSP data and
+(gvkey, datadate) -> permno for Compustat data.
+
+A key can have several valid links at the same time (e.g. a gvkey with two share classes,
+or an old and a new link overlapping for a few days). `link_timeline` resolves these once
+into a disjoint timeline per key, keeping at each date the link with the best linkprim
+(P > C > J > N), then linktype (LC > LU > LS > others), then the latest linkdt.
+Missing linkenddt (still active links) are open-ended.
+
+Because the timeline is disjoint, resolving a panel is a binary search of each
+(key, date) among the interval starts, O(n log m), without row-wise lookups:
+
+```
+links = pull_CRSP_Compustat.load_CRSP_Comp_Link_Table()
+crsp = resolve_links(crsp, link_timeline(links, key="permno", target="gvkey"),
+                     key="permno", date_col="mthcaldt", target="gvkey")
+fundq = resolve_links(fundq, link_timeline(links, key="gvkey", target="permno"),
+                      key="gvkey", date_col="datadate", target="permno")
+```
+"""
+
+import numpy as np
+import pandas as pd
+
+from dealer_membership import OPEN_END, to_days
+
+LINKPRIM_PRIORITY = ("P", "C", "J", "N")
+LINKTYPE_PRIORITY = ("LC", "LU", "LS")
+
+
+def _normalize_keys(values):
+    """Keys as int64 when they are numeric (gvkey '001004' and 1004 match), else as given."""
+    numeric = pd.to_numeric(pd.Series(values), errors="coerce")
+    if numeric.notna().sum() == pd.Series(values).notna().sum():
+        return numeric.fillna(-1).astype("int64").to_numpy()
+    return pd.Series(values).to_numpy()
+
+
+def _pack(codes, days):
+    # (key code, day) packed into one sortable int64; days are offset to be non-negative
+    return (np.asarray(codes, dtype="int64") << 32) | (np.asarray(days, dtype="int64") + 2**31)
+
+
+def _unpack_days(packed):
+    return (packed & 0xFFFFFFFF) - 2**31
+
+
+def _rank(values, priority):
+    """Position of each value in priority (len(priority) for values not listed)."""
+    lookup = {v: i for i, v in enumerate(priority)}
+    return pd.Series(values).map(lookup).fillna(len(priority)).to_numpy(dtype="int64")
+
+
+def link_timeline(links, key="permno", target="gvkey", priority=LINKPRIM_PRIORITY):
+    """
+    Disjoint link timeline from a link table with key, target, linkprim, linktype,
+    linkdt and linkenddt columns.
+
+    Returns a DataFrame with key, target, linkprim, linktype, start and end (inclusive
+    days since 1970-01-01, end = OPEN_END for open links), sorted by key and start.
+    Adjacent periods with the same link are merged.
+    """
+    links = links.dropna(subset=[key, target, "linkdt"]).reset_index(drop=True)
+    keys = _normalize_keys(links[key])
+    codes, uniques = pd.factorize(keys, sort=True)
+    start = to_days(links["linkdt"])
+    open_link = links["linkenddt"].isna().to_numpy()
+    end = np.where(open_link, OPEN_END, to_days(links["linkenddt"].where(~open_link)))
+    valid = start <= end
+    codes, start, end = codes[valid], start[valid], end[valid]
+    link_ids = np.flatnonzero(valid)
+
+    # Change points of each key: every link start, and the day after every link end.
+    # Between consecutive change points the set of valid links is constant.
+    bounds = np.unique(np.concatenate([_pack(codes, start), _pack(codes[end < OPEN_END], end[end < OPEN_END] + 1)]))
+    first = np.searchsorted(bounds, _pack(codes, start))
+    last = np.searchsorted(bounds, _pack(codes, end), side="right") - 1
+    counts = last - first + 1
+    link_of = np.repeat(np.arange(len(codes)), counts)
+    segment = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    # Best link in each segment
+    prim_rank = _rank(links["linkprim"].to_numpy()[link_ids], priority)
+    type_rank = _rank(links["linktype"].to_numpy()[link_ids], LINKTYPE_PRIORITY)
+    order = np.lexsort((-start[link_of], type_rank[link_of], prim_rank[link_of], segment))
+    segment, link_of = segment[order], link_of[order]
+    best = np.ones(len(segment), dtype=bool)
+    best[1:] = segment[1:] != segment[:-1]
+    segment, link_of = segment[best], link_of[best]
+
+    seg_start = _unpack_days(bounds[segment])
+    # A segment ends the day before the next change point of the same key (open links have none)
+    has_next = segment + 1 < len(bounds)
+    next_bound = bounds[np.minimum(segment + 1, len(bounds) - 1)]
+    same_key = has_next & ((next_bound >> 32) == codes[link_of])
+    seg_end = np.where(same_key, _unpack_days(next_bound) - 1, OPEN_END)
+
+    timeline = pd.DataFrame({
+        key: uniques[codes[link_of]],
+        target: links[target].to_numpy()[link_ids][link_of],
+        "linkprim": links["linkprim"].to_numpy()[link_ids][link_of],
+        "linktype": links["linktype"].to_numpy()[link_ids][link_of],
+        "start": seg_start,
+        "end": seg_end,
+    })
+    if timeline.empty:
+        return timeline
+    # Merge consecutive segments of the same key that resolve to the same link
+    same = timeline[[key, target, "linkprim", "linktype"]].eq(timeline[[key, target, "linkprim", "linktype"]].shift())
+    contiguous = timeline["start"].to_numpy() == np.r_[np.nan, timeline["end"].to_numpy()[:-1] + 1]
+    run = np.cumsum(~(same.all(axis=1).to_numpy() & contiguous))
+    return timeline.groupby(run).agg(
+        **{key: (key, "first"), target: (target, "first"), "linkprim": ("linkprim", "first"),
+           "linktype": ("linktype", "first"), "start": ("start", "min"), "end": ("end", "max")}
+    ).reset_index(drop=True)
+
+
+def resolve_links(panel, timeline, key="permno", date_col="date", target="gvkey"):
+    """
+    Copy of panel with a `target` column: the target of the link of each row's key that
+    is valid at the row's date (missing when there is none). Row order and index are kept.
+    """
+    tl_keys = np.asarray(timeline[key].to_numpy())
+    panel_keys = _normalize_keys(panel[key].to_numpy())
+    uniques = pd.Index(np.unique(tl_keys))
+    codes = uniques.get_indexer(panel_keys)
+    days = to_days(panel[date_col]) if len(panel) else np.empty(0, dtype="int64")
+
+    tl_codes = uniques.get_indexer(tl_keys)
+    starts = _pack(tl_codes, timeline["start"].to_numpy())
+    # Only the last interval starting at or before (key, date) can contain the date
+    pos = np.searchsorted(starts, _pack(np.maximum(codes, 0), days), side="right") - 1
+    safe = np.maximum(pos, 0)
+    matched = (codes >= 0) & (pos >= 0) & (len(timeline) > 0)
+    if len(timeline):
+        matched &= (tl_codes[safe] == codes) & (days <= timeline["end"].to_numpy()[safe])
+    values = timeline[target].to_numpy()[safe] if len(timeline) else np.full(len(panel), np.nan)
+    resolved = pd.Series(values, index=panel.index).where(matched)
+    if pd.api.types.is_integer_dtype(timeline[target]):
+        resolved = resolved.astype("Int64")
+    return panel.assign(**{target: resolved})
+
+
+def permno_to_gvkey(panel, links, date_col="date"):
+    """gvkey of each (permno, date) row of a CRSP panel."""
+    return resolve_links(panel, link_timeline(links, key="permno", target="gvkey"),
+                         key="permno", date_col=date_col, target="gvkey")
+
+
+def gvkey_to_permno(panel, links, date_col="datadate"):
+    """Primary permno of each (gvkey, datadate) row of a Compustat panel."""
+    return resolve_links(panel, link_timeline(links, key="gvkey", target="permno"),
+                         key="gvkey", date_col=date_col, target="permno")
@@ -3,6 +3,7 @@ import pandas_datareader
 import config
 from pathlib import Path
 from datetime import datetime
+from fixture_store import recorded
 
 # Use config.DATA_DIR as the data directory
 DATA_DIR = Path(config.DATA_DIR)
@@ -72,6 +73,7 @@ def pull_fred_macro_data(data_dir=DATA_DIR, start=config.START_DATE, end=config.
         print(f"Failed to pull or save FRED macro data: {e}")
 
 
+@recorded()
 def load_fred_macro_data(data_dir=DATA_DIR, from_cache=True, start=config.START_DATE, end=None):
     """
     Load FRED macro data. If cache exists (data_dir/pulled/fred_macro.parquet), read it.
@@ -10,6 +10,11 @@ import matplotlib.dates as mdates
 
 from dateutil.relativedelta import relativedelta
 import datetime
+import hashlib
+import io
+import os
+import uuid
+from pathlib import Path
 
 
 ########################################################################################
@@ -133,17 +138,37 @@ def merge_stats(df_left, df_right, on=[]):
     return df_stats
 
 
-def dataframe_set_difference(dff, df, library="pandas", show="rows_and_numbers"):
+def dataframe_set_difference(
+    dff, df, library="pandas", show="rows_and_numbers", method="merge", chunksize=None
+):
     """
     Gives the rows that appear in dff but not in df
 
+    For pandas, method="merge" (default) does a left merge on all columns with an
+    indicator. method="hash" instead hashes each row to 64 bits with
+    `pd.util.hash_pandas_object` and anti-joins on the sorted hashes of df with
+    searchsorted. Rows whose hash matches are then compared value by value to rule out
+    hash collisions. It never materializes a joined frame, and with `chunksize` the rows
+    of dff are hashed and checked in chunks, so it scales to multi-million-row snapshots.
+    The hash method expects the columns of dff and df to have the same dtypes (e.g. 1 and
+    1.0 hash differently).
+
+    Returns the index labels of the rows of dff (row numbers for polars), and with
+    show="rows_and_numbers" also the rows themselves.
+
     Example
     -------
     ```
     rows = data_frame_set_difference(dff, df)
+    row_numbers, rows = dataframe_set_difference(new_pull, old_pull, method="hash", chunksize=1_000_000)
     ```
     """
-    if library == "pandas":
+    if library == "pandas" and method == "hash":
+        positions = _hashed_set_difference(dff, df[dff.columns], chunksize=chunksize)
+        row_numbers = dff.index[positions].tolist()
+        ret = row_numbers
+
+    elif library == "pandas":
         # Reset index to ensure the row numbers are captured as a column
         # This is important for tracking the original row numbers after operations
         dff_reset = dff.reset_index().rename(columns={"index": "original_row_number"})
@@ -185,12 +210,74 @@ def dataframe_set_difference(dff, df, library="pandas", show="rows_and_numbers")
     else:
         raise ValueError("Unknown library")
     if show == "rows_and_numbers":
-        rows = dff[row_numbers]
+        if library == "pandas":
+            rows = dff.loc[row_numbers]
+        else:
+            rows = dff[row_numbers]
         ret = row_numbers, rows
 
     return ret
 
 
+def _hash_rows(df, chunksize=None):
+    """64-bit hash of each row of df (ignoring the index), computed chunk by chunk."""
+    if chunksize is None or len(df) <= chunksize:
+        return pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return np.concatenate(
+        [
+            pd.util.hash_pandas_object(df.iloc[start : start + chunksize], index=False).to_numpy()
+            for start in range(0, len(df), chunksize)
+        ]
+    )
+
+
+def _rows_equal(left, right):
+    """Elementwise row equality of two frames with the same columns (missing equals missing)."""
+    equal = np.ones(len(left), dtype=bool)
+    for col in left.columns:
+        a, b = left[col].to_numpy(), right[col].to_numpy()
+        equal &= (a == b) | (pd.isna(a) & pd.isna(b))
+    return equal
+
+
+def _hashed_set_difference(dff, df, chunksize=None):
+    """Positions of the rows of dff that do not appear in df, using sorted row hashes."""
+    if len(df) == 0:
+        return np.arange(len(dff))
+    right_hashes = _hash_rows(df, chunksize)
+    right_order = np.argsort(right_hashes, kind="stable")
+    right_hashes = right_hashes[right_order]
+
+    missing = []
+    chunksize = chunksize or max(len(dff), 1)
+    for start in range(0, len(dff), chunksize):
+        chunk = dff.iloc[start : start + chunksize]
+        hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        # Looking up sorted hashes is much more cache friendly than random lookups
+        order = np.argsort(hashes)
+        pos = np.empty(len(hashes), dtype=np.int64)
+        pos[order] = np.searchsorted(right_hashes, hashes[order])
+        pos_clipped = np.minimum(pos, len(right_hashes) - 1)
+        candidate = right_hashes[pos_clipped] == hashes
+
+        # Verify candidates against the first row of df with the same hash
+        cand = np.flatnonzero(candidate)
+        matched = _rows_equal(
+            chunk.iloc[cand], df.iloc[right_order[pos_clipped[cand]]]
+        )
+        # On a mismatch (a hash collision), check the other rows of df with that hash
+        for i in cand[~matched]:
+            hi = np.searchsorted(right_hashes, hashes[i], side="right")
+            others = df.iloc[right_order[pos[i] + 1 : hi]]
+            row = chunk.iloc[[i] * len(others)]
+            candidate[i] = bool(_rows_equal(row, others).any())
+        missing.append(start + np.flatnonzero(~candidate))
+
+    if not missing:
+        return np.array([], dtype=np.int64)
+    return np.concatenate(missing)
+
+
 def freq_counts(df, col=None, with_count=True, with_cum_freq=True):
     """Like value_counts, but normalizes to give frequency
     Polars function
@@ -263,6 +350,34 @@ def weighted_average(data_col=None, weight_col=None, data=None):
     return result
 
 
+def _group_codes(data, by_col):
+    """Integer group code of each row (-1 where a key is missing) and the sorted group index,
+    both as produced by data.groupby(by_col)."""
+    grouped = data.groupby(by_col, sort=True)
+    codes = grouped.ngroup().to_numpy(dtype=float)
+    missing = np.isnan(codes)
+    codes = np.where(missing, -1, codes).astype(np.int64)
+    return codes, grouped.size().index
+
+
+def _grouped_result(result, data_col, index, codes, data, transform, new_column_name):
+    """
+    Wrap a (groups x columns) array of grouped statistics: a Series for a single
+    `data_col`, a DataFrame for a list. With transform=True, the values are broadcast
+    back to the rows of `data` (NaN where the group key is missing).
+    """
+    columns = [data_col] if isinstance(data_col, str) else list(data_col)
+    if transform:
+        result = result[np.where(codes < 0, 0, codes)]
+        result[codes < 0] = np.nan
+        if isinstance(data_col, str):
+            return pd.Series(result[:, 0], index=data.index, name=new_column_name)
+        return pd.DataFrame(result, index=data.index, columns=columns)
+    if isinstance(data_col, str):
+        return pd.Series(result[:, 0], index=index)
+    return pd.DataFrame(result, index=index, columns=columns)
+
+
 def groupby_weighted_average(
     data_col=None,
     weight_col=None,
@@ -277,6 +392,12 @@ def groupby_weighted_average(
     From:
     https://stackoverflow.com/a/44683506
 
+    The grouped sums of w*x and w (over rows where x is not missing) are computed on the
+    underlying arrays, so `data` is not modified. `data_col` may be a list of columns
+    sharing the same weight column, in which case a DataFrame is returned. With
+    transform=True, the result is broadcast back to the rows of `data` (keeping its index)
+    using the group codes rather than a merge.
+
     Examples
     --------
 
@@ -295,24 +416,34 @@ def groupby_weighted_average(
     ```
 
     """
-    data["_data_times_weight"] = data[data_col] * data[weight_col]
-    data["_weight_where_notnull"] = data[weight_col] * pd.notnull(data[data_col])
-    g = data.groupby(by_col)
-    result = g["_data_times_weight"].sum() / g["_weight_where_notnull"].sum()
-    del data["_data_times_weight"], data["_weight_where_notnull"]
+    columns = [data_col] if isinstance(data_col, str) else list(data_col)
+    codes, index = _group_codes(data, by_col)
+    n_groups = len(index)
+    weights = data[weight_col].to_numpy(dtype=float)
 
-    if transform:
-        result.name = f"__{data_col}"
-        result = data.merge(result.reset_index(), how="left", on=by_col)[
-            f"__{data_col}"
-        ]
-        result.name = new_column_name
+    # Work on the underlying arrays so that `data` is never modified
+    result = np.full((n_groups, len(columns)), np.nan)
+    for j, col in enumerate(columns):
+        x = data[col].to_numpy(dtype=float)
+        valid = (codes >= 0) & ~np.isnan(x) & ~np.isnan(weights)
+        c, xv, wv = codes[valid], x[valid], weights[valid]
+        sum_wx = np.bincount(c, weights=wv * xv, minlength=n_groups)
+        sum_w = np.bincount(c, weights=wv, minlength=n_groups)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result[:, j] = sum_wx / sum_w
 
-    return result
+    return _grouped_result(result, data_col, index, codes, data, transform, new_column_name)
 
 
 def groupby_weighted_std(
-    data_col=None, weight_col=None, by_col=None, data=None, ddof=1
+    data_col=None,
+    weight_col=None,
+    by_col=None,
+    data=None,
+    ddof=1,
+    transform=False,
+    new_column_name="",
+    method="two_pass",
 ):
     """
     Method for calculating grouped weighted standard devation.
@@ -320,6 +451,21 @@ def groupby_weighted_std(
     From:
     https://stackoverflow.com/a/72915123
 
+    The variance is computed from grouped sums of w, w*x and w*x**2, without a per-group
+    apply. With method="two_pass" (default), the weighted mean is computed first and
+    broadcast back to the rows, and the squared deviations are summed in a second pass,
+    which is numerically stable. method="one_pass" uses sum(w*x**2) - sum(w*x)**2 / sum(w),
+    which is faster but can lose precision when the mean is large relative to the spread.
+
+    The degrees-of-freedom correction is the same as before:
+    var = sum(w * (x - xbar)**2) / (((n - ddof) / n) * sum(w)), where n counts the
+    non-missing values in the group (including those with zero weight). Rows where the
+    value or the weight is missing are ignored.
+
+    `data_col` may be a list of columns, in which case a DataFrame is returned. With
+    transform=True, the result is broadcast back to the rows of `data`, like
+    `groupby_weighted_average`.
+
     Examples
     --------
 
@@ -352,19 +498,33 @@ def groupby_weighted_std(
     ```
 
     """
-
-    def weighted_sd(input_df):
-        weights = input_df[weight_col]
-        vals = input_df[data_col]
-
-        weighted_avg = np.average(vals, weights=weights)
-
-        numer = np.sum(weights * (vals - weighted_avg) ** 2)
-        denom = ((vals.count() - ddof) / vals.count()) * np.sum(weights)
-
-        return np.sqrt(numer / denom)
-
-    return data.groupby(by_col).apply(weighted_sd)
+    if method not in ("two_pass", "one_pass"):
+        raise ValueError("method must be 'two_pass' or 'one_pass'")
+    columns = [data_col] if isinstance(data_col, str) else list(data_col)
+    codes, index = _group_codes(data, by_col)
+    n_groups = len(index)
+    weights = data[weight_col].to_numpy(dtype=float)
+
+    result = np.full((n_groups, len(columns)), np.nan)
+    for j, col in enumerate(columns):
+        x = data[col].to_numpy(dtype=float)
+        valid = (codes >= 0) & ~np.isnan(x) & ~np.isnan(weights)
+        c, xv, wv = codes[valid], x[valid], weights[valid]
+
+        count = np.bincount(c, minlength=n_groups)
+        sum_w = np.bincount(c, weights=wv, minlength=n_groups)
+        sum_wx = np.bincount(c, weights=wv * xv, minlength=n_groups)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if method == "two_pass":
+                mean = sum_wx / sum_w
+                numer = np.bincount(c, weights=wv * (xv - mean[c]) ** 2, minlength=n_groups)
+            else:
+                sum_wxx = np.bincount(c, weights=wv * xv * xv, minlength=n_groups)
+                numer = np.maximum(sum_wxx - sum_wx**2 / sum_w, 0.0)
+            denom = ((count - ddof) / count) * sum_w
+            result[:, j] = np.sqrt(numer / denom)
+
+    return _grouped_result(result, data_col, index, codes, data, transform, new_column_name)
 
 
 def weighted_quantile(
@@ -426,23 +586,147 @@ def weighted_quantile(
     return np.interp(quantiles, weighted_quantiles, values)
 
 
+def groupby_weighted_quantiles(
+    data_col=None,
+    weight_col=None,
+    by_col=None,
+    data=None,
+    quantiles=[0.25, 0.5, 0.75],
+    old_style=False,
+):
+    """Grouped version of `weighted_quantile` that computes several quantiles for all
+    groups at once.
+
+    The data are sorted once by (group, value). The weighted cumulative distribution of
+    each group comes from a segmented cumsum, and every quantile is then found with
+    vectorized interpolation, instead of sorting each group in Python once per quantile.
+    Rows with a missing value or weight are ignored. If `weight_col` is None, all rows
+    get equal weight.
+
+    Returns a DataFrame indexed by group with one column per quantile.
+
+    Examples
+    --------
+    ```
+    >>> df = pd.DataFrame({
+    ...     'date': ['2020-01-01'] * 4 + ['2020-01-02'] * 3,
+    ...     'rate': [1, 2, 3, 4, 5, 7, 6],
+    ...     'volume': [1, 1, 1, 1, 1, 2, 1]},
+    ... )
+    >>> groupby_weighted_quantiles(data=df, data_col='rate', weight_col='volume', by_col='date', quantiles=[0.25, 0.5]).round(2).values
+    array([[1.5 , 2.5 ],
+           [5.5 , 6.33]])
+    >>> weighted_quantile([5, 7, 6], [0.25, 0.5], sample_weight=[1, 2, 1]).round(2)
+    array([5.5 , 6.33])
+
+    ```
+    """
+    quantiles = np.atleast_1d(np.asarray(quantiles, dtype=float))
+    assert np.all(quantiles >= 0) and np.all(
+        quantiles <= 1
+    ), "quantiles should be in [0, 1]"
+
+    codes, index = _group_codes(data, by_col)
+    n_groups = len(index)
+    values = data[data_col].to_numpy(dtype=float)
+    if weight_col is None:
+        weights = np.ones(len(values))
+    else:
+        weights = data[weight_col].to_numpy(dtype=float)
+
+    keep = (codes >= 0) & ~np.isnan(values) & ~np.isnan(weights)
+    codes = codes[keep]
+    values = values[keep]
+    weights = weights[keep]
+
+    order = np.lexsort((values, codes))
+    codes, values, weights = codes[order], values[order], weights[order]
+
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    last = starts + counts - 1
+    totals = np.bincount(codes, weights=weights, minlength=n_groups)
+
+    # Same cumulative weights as weighted_quantile, within each group
+    cw = pd.Series(weights).groupby(codes, sort=False).cumsum().to_numpy() - 0.5 * weights
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if old_style:
+            cw = cw - cw[starts[codes]]
+            cw = cw / cw[last[codes]]
+        else:
+            cw = cw / totals[codes]
+
+    nonempty = counts > 0
+    if not old_style:
+        nonempty &= totals > 0
+    s, l = starts[nonempty], last[nonempty]
+    result = np.full((n_groups, len(quantiles)), np.nan)
+    for j, q in enumerate(quantiles):
+        # Number of (sorted) observations in each group at or below quantile q
+        k = np.bincount(codes, weights=(cw <= q), minlength=n_groups)[nonempty].astype(np.int64)
+        lo = np.clip(s + k - 1, s, l)
+        hi = np.clip(s + k, s, l)
+        x0, x1 = cw[lo], cw[hi]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frac = np.where(hi > lo, (q - x0) / (x1 - x0), 0.0)
+        result[nonempty, j] = values[lo] + frac * (values[hi] - values[lo])
+
+    return pd.DataFrame(result, index=index, columns=pd.Index(quantiles))
+
+
 _alphabet = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ*@#"
 
+# Digit sum contributed by each byte of a CUSIP at an even (value) or odd (2 * value)
+# position, where value is the position of the character in _alphabet. Invalid
+# characters map to -1; NUL (padding of shorter strings in a fixed-width byte array) to 0.
+def _cusip_digit_sum_table(multiplier):
+    table = np.full(256, -1, dtype=np.int16)
+    table[0] = 0
+    products = multiplier * np.arange(len(_alphabet))
+    table[[ord(c) for c in _alphabet]] = products // 10 + products % 10
+    return table
+
+
+_cusip_even_digit_sums = _cusip_digit_sum_table(1)
+_cusip_odd_digit_sums = _cusip_digit_sum_table(2)
+
 
-@np.vectorize
 def calc_check_digit(number):
     """Calculate the check digits for the 8-digit cusip.
     This function is taken from
     https://github.com/arthurdejong/python-stdnum/blob/master/stdnum/cusip.py
+
+    Works on a single CUSIP (returns a str) or on an array/Series of CUSIPs (returns a
+    numpy array of str). The CUSIPs are viewed as a fixed-width byte array, and each
+    byte is mapped through a lookup table straight to its digit-sum contribution (with
+    every other value doubled). Only integer array operations remain, so millions of
+    CUSIPs take well under a second.
+
+    Examples
+    --------
+    ```
+    >>> calc_check_digit('03783310')
+    '0'
+    >>> calc_check_digit(pd.Series(['03783310', '59491810', '38259P50']))
+    array(['0', '4', '8'], dtype='<U1')
+
+    ```
     """
+    scalar = isinstance(number, str)
+    chars = np.asarray([number] if scalar else number, dtype=bytes)
+    chars = chars.view(np.uint8).reshape(len(chars), chars.dtype.itemsize)
     # convert to numeric first, then sum individual digits
-    number = "".join(
-        str((1, 2)[i % 2] * _alphabet.index(n)) for i, n in enumerate(number)
-    )
-    return str((10 - sum(int(n) for n in number)) % 10)
+    even = _cusip_even_digit_sums[chars[:, 0::2]]
+    odd = _cusip_odd_digit_sums[chars[:, 1::2]]
+    if (even.min(initial=0) < 0) or (odd.min(initial=0) < 0):
+        raise ValueError("CUSIPs may only contain digits, uppercase letters, '*', '@' and '#'")
+    total = even.sum(axis=1) + odd.sum(axis=1)
+    digits = np.array(list("0123456789"))[(10 - total % 10) % 10]
+    return digits[0] if scalar else digits
 
 
 def convert_cusips_from_8_to_9_digit(cusip_8dig_series):
+    """Append the check digit to a Series of 8-digit CUSIPs."""
     dig9 = calc_check_digit(cusip_8dig_series)
     new9 = cusip_8dig_series + dig9
     return new9
@@ -502,6 +786,12 @@ def with_lagged_columns(
     """
     Add lagged columns to a dataframe, respecting frequency of the data.
 
+    `column_to_lag` may be a single column or a list of columns, and `lags` a single lag
+    or a list of lags; one column f"{prefix}{lag}_{column}" is added for each pair.
+    With resample=True, lags are taken over `freq` periods, so a missing period breaks
+    the lag (see below), and rows are added where only the lagged value exists. This
+    works on sorted (id, period) keys rather than a dense wide date x id panel.
+
     Examples
     --------
 
@@ -554,17 +844,17 @@ def with_lagged_columns(
     >>> df_lag = with_lagged_columns(df=df, column_to_lag='value', id_column='id', lags=1, freq="MS", resample=True)
     >>> df_lag
        id       date  value  L1_value
-    2   A 1990-01-01   1.00       NaN
-    4   A 1990-02-01   2.00      1.00
-    6   A 1990-03-01   3.00      2.00
-    8   A 1990-04-01    NaN      3.00
-    1   B 1989-12-01  12.00       NaN
-    3   B 1990-01-01   1.00     12.00
-    5   B 1990-02-01   2.00      1.00
+    0   A 1990-01-01   1.00       NaN
+    1   A 1990-02-01   2.00      1.00
+    2   A 1990-03-01   3.00      2.00
+    3   A 1990-04-01    NaN      3.00
+    4   B 1989-12-01  12.00       NaN
+    5   B 1990-01-01   1.00     12.00
+    6   B 1990-02-01   2.00      1.00
     7   B 1990-03-01   3.00      2.00
-    9   B 1990-04-01   4.00      3.00
-    11  B 1990-05-01    NaN      4.00
-    13  B 1990-06-01   6.00       NaN
+    8   B 1990-04-01   4.00      3.00
+    9   B 1990-05-01    NaN      4.00
+    10  B 1990-06-01   6.00       NaN
 
     ```
 
@@ -596,29 +886,133 @@ def with_lagged_columns(
     as seen here: https://business-science.github.io/pytimetk/guides/03_pandas_frequency.html
 
     """
+    columns = [column_to_lag] if isinstance(column_to_lag, str) else list(column_to_lag)
+    lags = [lags] if np.ndim(lags) == 0 else list(lags)
     if resample:
-        df_wide = df.pivot(index=date_col, columns=id_column, values=column_to_lag)
-        new_col = f"{prefix}{lags}_{column_to_lag}"
-        df_resampled = df_wide.resample(freq).last()
-        df_lagged = df_resampled.shift(lags)
-        df_lagged = df_lagged.stack(dropna=False).reset_index(name=new_col)
-        df_lagged = df.merge(df_lagged, on=[date_col, id_column], how="right")
-        df_lagged = df_lagged.dropna(subset=[column_to_lag, new_col], how="all")
-        df_lagged = df_lagged.sort_values(by=[id_column, date_col])
-    else:
-        df_lagged = _with_lagged_column_no_resample(
+        if freq is None:
+            raise ValueError("freq is required when resample=True")
+        df_lagged = _with_lagged_columns_resampled(
             df=df,
-            columns_to_lag=[column_to_lag],
-            id_columns=[id_column],
+            columns_to_lag=columns,
+            id_column=id_column,
             lags=lags,
             date_col=date_col,
             prefix=prefix,
+            freq=freq,
         )
+    else:
+        df_lagged = df
+        for lag in lags:
+            df_lagged = _with_lagged_column_no_resample(
+                df=df_lagged,
+                columns_to_lag=columns,
+                id_columns=[id_column],
+                lags=lag,
+                prefix=prefix,
+            )
 
     return df_lagged
 
 
-def leave_one_out_sums(df, groupby=[], summed_col=""):
+def _last_valid_per_key(keys, order_within_key, values):
+    """Sorted unique keys and the last non-missing value for each key
+    (as in `resample(...).last()`)."""
+    valid = ~pd.isna(values)
+    keys, order_within_key, values = keys[valid], order_within_key[valid], values[valid]
+    order = np.lexsort((order_within_key, keys))
+    keys, values = keys[order], values[order]
+    is_last = np.ones(len(keys), dtype=bool)
+    is_last[:-1] = keys[1:] != keys[:-1]
+    return keys[is_last], values[is_last]
+
+
+def _with_lagged_columns_resampled(
+    df=None,
+    columns_to_lag=None,
+    id_column=None,
+    lags=[1],
+    date_col="date",
+    prefix="L",
+    freq=None,
+):
+    """
+    Sparse version of resampling to a wide (date x id) panel, shifting and stacking back.
+
+    Each row gets an integer period, the index of its `freq` bin between the first and
+    last date in `df`, and a key id_code * n_periods + period. Lagged values are then
+    looked up with searchsorted on the sorted keys, so memory scales with the number of
+    rows rather than with ids x periods. Within a period, the last non-missing value of
+    an id is used, and rows whose date is not the period's label (e.g. "MS" month starts)
+    do not appear in the output, as with the wide resample. Periods where an id has no
+    observation break the lag, as they would after resampling.
+    """
+    dates = pd.DatetimeIndex(df[date_col])
+    unique_dates = dates.unique().dropna().sort_values()
+    dates_per_period = pd.Series(1, index=unique_dates).resample(freq).size()
+    period_labels = dates_per_period.index
+    n_periods = len(period_labels)
+    period_of_unique = np.repeat(np.arange(n_periods), dates_per_period.to_numpy())
+
+    id_codes, id_values = pd.factorize(df[id_column], sort=True)
+    position = unique_dates.get_indexer(dates)
+    in_panel = (id_codes >= 0) & (position >= 0)
+    period = np.where(in_panel, period_of_unique[position], -1)
+    keys = id_codes.astype(np.int64) * n_periods + period
+    date_values = dates.asi8
+
+    # Rows of df that land in the output: those dated on their period's label
+    aligned = in_panel & (date_values == period_labels.asi8[np.maximum(period, 0)])
+    aligned_rows = np.flatnonzero(aligned)
+    aligned_rows = aligned_rows[np.argsort(keys[aligned_rows], kind="stable")]
+    aligned_keys = keys[aligned_rows]
+    if (aligned_keys[1:] == aligned_keys[:-1]).any():
+        raise ValueError(f"df has duplicate ({id_column}, {date_col}) entries")
+
+    sources = {}
+    candidate_keys = [aligned_keys]
+    for col in columns_to_lag:
+        values = df[col].to_numpy()
+        src_keys, src_values = _last_valid_per_key(keys[in_panel], date_values[in_panel], values[in_panel])
+        sources[col] = (src_keys, src_values)
+        src_period = src_keys % n_periods
+        for lag in lags:
+            reachable = (src_period + lag >= 0) & (src_period + lag < n_periods)
+            candidate_keys.append(src_keys[reachable] + lag)
+    out_keys = np.unique(np.concatenate(candidate_keys))
+    out_period = out_keys % n_periods
+
+    # Place the aligned rows of df at their keys; other rows are all-missing
+    df_lagged = df.iloc[aligned_rows]
+    df_lagged.index = np.searchsorted(out_keys, aligned_keys)
+    df_lagged = df_lagged.reindex(pd.RangeIndex(len(out_keys)))
+    df_lagged[id_column] = id_values[out_keys // n_periods]
+    df_lagged[date_col] = period_labels[out_period]
+
+    new_cols = []
+    for lag in lags:
+        target = out_keys - lag
+        has_target = (out_period - lag >= 0) & (out_period - lag < n_periods)
+        for col in columns_to_lag:
+            src_keys, src_values = sources[col]
+            pos = np.minimum(np.searchsorted(src_keys, target), max(len(src_keys) - 1, 0))
+            found = has_target & (src_keys[pos] == target) if len(src_keys) else has_target & False
+            lagged = np.full(len(out_keys), np.nan, dtype=object if src_values.dtype == object else float)
+            lagged[found] = src_values[pos[found]]
+            new_col = f"{prefix}{lag}_{col}"
+            df_lagged[new_col] = lagged
+            new_cols.append(new_col)
+
+    df_lagged = df_lagged.dropna(subset=[*columns_to_lag, *new_cols], how="all")
+    return df_lagged.reset_index(drop=True)
+
+
+def _grouped_totals(values, df, groupby):
+    """Group sums of the columns of `values` (aligned with df), broadcast back to the rows."""
+    keys = [df[g] for g in ([groupby] if isinstance(groupby, str) else groupby)]
+    return values.groupby(keys).transform("sum")
+
+
+def leave_one_out_sums(df, groupby=[], summed_col="", weight_col=None):
     """
     Compute leave-one-out sums,
 
@@ -627,6 +1021,11 @@ def leave_one_out_sums(df, groupby=[], summed_col=""):
     This is helpful for constructing the shift-share instruments
     in Borusyak, Hull, Jaravel (2022).
 
+    The group totals come from a vectorized `transform("sum")` and each row's own value
+    is subtracted, so there is no Python call per group. `summed_col` may be a list of
+    columns (a DataFrame is returned). With `weight_col`, the sums are of weight * value.
+    As before, the result is missing where the row's own value is missing.
+
     Examples
     --------
 
@@ -653,21 +1052,105 @@ def leave_one_out_sums(df, groupby=[], summed_col=""):
     ```
 
     """
-    s = df.groupby(groupby)[summed_col].transform(lambda x: x.sum() - x)
-    return s
+    cols = [summed_col] if isinstance(summed_col, str) else list(summed_col)
+    values = df[cols]
+    if weight_col is not None:
+        values = values.mul(df[weight_col], axis=0)
+    s = _grouped_totals(values, df, groupby) - values
+    return s[summed_col] if isinstance(summed_col, str) else s
+
+
+def leave_one_out_counts(df, groupby=[], counted_col=""):
+    """
+    Number of other rows in the group with a non-missing `counted_col`
+    (a list of columns gives a DataFrame).
+
+    ```
+    >>> df = pd.DataFrame({'B': ['one', 'one', 'one', 'two'], 'C': [1, None, 5, 2]})
+    >>> leave_one_out_counts(df, groupby=['B'], counted_col='C').tolist()
+    [1, 2, 1, 0]
+
+    ```
+    """
+    cols = [counted_col] if isinstance(counted_col, str) else list(counted_col)
+    present = df[cols].notna().astype(np.int64)
+    s = _grouped_totals(present, df, groupby) - present
+    return s[counted_col] if isinstance(counted_col, str) else s
+
+
+def leave_one_out_means(df, groupby=[], mean_col="", weight_col=None):
+    """
+    Mean (or `weight_col`-weighted mean) of `mean_col` over the other rows of the group,
+    ignoring missing values. For example, with dealer-quarter rows grouped by quarter,
+    this gives each dealer the average of the rest of the group. A row whose own value is
+    missing gets the mean of all the others; a row that is alone in its group gets NaN.
+    `mean_col` may be a list of columns (a DataFrame is returned).
+
+    ```
+    >>> df = pd.DataFrame({
+    ...     'B': ['one', 'one', 'one', 'two'],
+    ...     'C': [1.0, None, 5.0, 2.0],
+    ...     'W': [1.0, 1.0, 3.0, 1.0]})
+    >>> leave_one_out_means(df, groupby=['B'], mean_col='C').tolist()
+    [5.0, 3.0, 1.0, nan]
+    >>> leave_one_out_means(df, groupby=['B'], mean_col='C', weight_col='W').tolist()
+    [5.0, 4.0, 1.0, nan]
+
+    ```
+    """
+    cols = [mean_col] if isinstance(mean_col, str) else list(mean_col)
+    values = df[cols]
+    if weight_col is None:
+        weights = pd.DataFrame(1.0, index=df.index, columns=cols)
+    else:
+        weights = pd.DataFrame({c: df[weight_col] for c in cols}, index=df.index)
+    weights = weights.where(values.notna() & weights.notna(), 0.0)
+    weighted = (values * weights).fillna(0.0)
+    numer = _grouped_totals(weighted, df, groupby) - weighted
+    denom = _grouped_totals(weights, df, groupby) - weights
+    s = numer / denom.where(denom != 0)
+    return s[mean_col] if isinstance(mean_col, str) else s
+
+
+def _month_values(d):
+    """Dates in a DatetimeIndex/Series/array-like as numpy datetime64[M] (months)."""
+    return pd.DatetimeIndex(d).to_numpy(dtype="datetime64[ns]").astype("datetime64[M]")
+
+
+def _like_input(d, values):
+    """Wrap datetime64 values in the container type of d (Series, Index or ndarray)."""
+    values = values.astype("datetime64[ns]")
+    if isinstance(d, pd.Series):
+        return pd.Series(values, index=d.index, name=d.name)
+    if isinstance(d, pd.Index):
+        return pd.DatetimeIndex(values, name=d.name)
+    return values
+
+
+def _quarter_start_months(months):
+    """First month of the quarter of each datetime64[M] value (1970-01 is a quarter start)."""
+    return months - months.astype(np.int64) % 3
 
 
 def get_most_recent_quarter_end(d):
     """
     Take a datetime and find the most recent quarter end date
 
+    Also accepts a DatetimeIndex, Series or array of dates, in which case the result is
+    computed with integer month arithmetic and returned in the same container type.
+
     ```
     >>> d = pd.to_datetime('2019-10-21')
     >>> get_most_recent_quarter_end(d)
     datetime.datetime(2019, 9, 30, 0, 0)
+    >>> get_most_recent_quarter_end(pd.DatetimeIndex(['2019-10-21', '2020-03-31']))
+    DatetimeIndex(['2019-09-30', '2019-12-31'], dtype='datetime64[ns]', freq=None)
 
     ```
     """
+    if np.ndim(d) > 0:
+        quarter_start = _quarter_start_months(_month_values(d))
+        return _like_input(d, quarter_start.astype("datetime64[D]") - np.timedelta64(1, "D"))
     quarter_month = (d.month - 1) // 3 * 3 + 1
     quarter_end = datetime.datetime(d.year, quarter_month, 1) - relativedelta(days=1)
     return quarter_end
@@ -677,13 +1160,20 @@ def get_next_quarter_start(d):
     """
     Take a datetime and find the start date of the next quarter
 
+    Also accepts a DatetimeIndex, Series or array of dates (see get_most_recent_quarter_end).
+
     ```
     >>> d = pd.to_datetime('2019-10-21')
     >>> get_next_quarter_start(d)
     datetime.datetime(2020, 1, 1, 0, 0)
+    >>> get_next_quarter_start(pd.Series(pd.to_datetime(['2019-10-21', '2020-03-31']))).tolist()
+    [Timestamp('2020-01-01 00:00:00'), Timestamp('2020-04-01 00:00:00')]
 
     ```
     """
+    if np.ndim(d) > 0:
+        next_quarter = _quarter_start_months(_month_values(d)) + np.timedelta64(3, "M")
+        return _like_input(d, next_quarter.astype("datetime64[D]"))
     quarter_month = (d.month - 1) // 3 * 3 + 4
     years_to_add = quarter_month // 12
     quarter_month_mod = quarter_month % 12
@@ -696,6 +1186,8 @@ def get_end_of_current_month(d):
     Take a datetime and find the last date of the current month
     and also reset time to zero.
 
+    Also accepts a DatetimeIndex, Series or array of dates (see get_most_recent_quarter_end).
+
     ```
     >>> d = pd.to_datetime('2019-10-21')
     >>> get_end_of_current_month(d)
@@ -705,10 +1197,17 @@ def get_end_of_current_month(d):
     >>> get_end_of_current_month(d)
     Timestamp('2023-03-31 00:00:00')
 
+    >>> get_end_of_current_month(pd.DatetimeIndex(['2020-02-10', '2023-03-31 12:00:00']))
+    DatetimeIndex(['2020-02-29', '2023-03-31'], dtype='datetime64[ns]', freq=None)
+
     ```
 
     From https://stackoverflow.com/a/13565185
     """
+    if np.ndim(d) > 0:
+        next_month = _month_values(d) + np.timedelta64(1, "M")
+        return _like_input(d, next_month.astype("datetime64[D]") - np.timedelta64(1, "D"))
+
     # Reset tiem part of datetime to zero: https://stackoverflow.com/a/26883852
     d = pd.DatetimeIndex([d]).normalize()[0]
 
@@ -724,6 +1223,8 @@ def get_end_of_current_quarter(d):
     Take a datetime and find the last date of the current quarter
     and also reset time to zero.
 
+    Also accepts a DatetimeIndex, Series or array of dates (see get_most_recent_quarter_end).
+
     ```
     >>> d = pd.to_datetime('2019-10-21')
     >>> get_end_of_current_quarter(d)
@@ -738,6 +1239,8 @@ def get_end_of_current_quarter(d):
     ```
     """
     quarter_start = get_next_quarter_start(d)
+    if np.ndim(d) > 0:
+        return quarter_start - np.timedelta64(1, "D")
     quarter_end = quarter_start - datetime.timedelta(days=1)
     return quarter_end
 
@@ -847,9 +1350,14 @@ def plot_weighted_median_with_distribution_bars(
         plt.clf()
         _, ax = plt.subplots()
 
-    median_series = data.groupby(date_col).apply(
-        lambda x: weighted_quantile(x[variable_name], 0.5, sample_weight=x[weight_col])
+    quantile_table = groupby_weighted_quantiles(
+        data_col=variable_name,
+        weight_col=weight_col,
+        by_col=date_col,
+        data=data,
+        quantiles=list(dict.fromkeys([0.5] + list(percentiles))),
     )
+    median_series = quantile_table[0.5]
     if rolling:
         wavrs = median_series.rolling(
             rolling_window, min_periods=rolling_min_periods
@@ -859,16 +1367,8 @@ def plot_weighted_median_with_distribution_bars(
     (wavrs * rescale_factor).plot(ax=ax, label=label)
 
     if percentile_bars:
-        lower = data.groupby(date_col).apply(
-            lambda x: weighted_quantile(
-                x[variable_name], percentiles[0], sample_weight=x[weight_col]
-            )
-        )
-        upper = data.groupby(date_col).apply(
-            lambda x: weighted_quantile(
-                x[variable_name], percentiles[1], sample_weight=x[weight_col]
-            )
-        )
+        lower = quantile_table[float(percentiles[0])]
+        upper = quantile_table[float(percentiles[1])]
         if rolling:
             lower = lower.rolling(
                 rolling_window, min_periods=rolling_min_periods
@@ -906,5 +1406,90 @@ def plot_weighted_median_with_distribution_bars(
     return ax
 
 
+########################################################################################
+## File Output Helpers
+########################################################################################
+
+
+def _hash_bytes(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of the file at `path`, or None if it doesn't exist."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_bytes_if_changed(path, content):
+    """Atomically write `content` to `path`, but only if it differs from what is on disk.
+
+    The file is first written to a temporary file in the same directory and then
+    moved into place with `os.replace`, so readers never see a half-written file.
+    When the existing file already has the same SHA-256 hash, nothing is written
+    and the file's mtime is left untouched, which keeps downstream tasks (e.g.,
+    the LaTeX document build) from rerunning.
+
+    Returns
+    -------
+    bool
+        True if the file was (re)written, False if it was left unchanged.
+    """
+    path = Path(path)
+    if file_hash(path) == _hash_bytes(content):
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.parent / f".{path.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "xb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
+def write_text_if_changed(path, text, encoding="utf-8"):
+    """Text version of `write_bytes_if_changed`.
+
+    Examples
+    --------
+    ```
+    >>> import tempfile
+    >>> out = Path(tempfile.mkdtemp()) / "table.tex"
+    >>> write_text_if_changed(out, "a & b")
+    True
+    >>> write_text_if_changed(out, "a & b")
+    False
+
+    ```
+    """
+    return write_bytes_if_changed(path, text.encode(encoding))
+
+
+def savefig_if_changed(path, fig=None, **savefig_kwargs):
+    """Render a matplotlib figure to memory and write it only if the image changed.
+
+    Creation dates are dropped from PDF metadata, so identical figures produce
+    identical bytes. `fig` defaults to the current figure.
+    """
+    if fig is None:
+        fig = plt.gcf()
+    fmt = savefig_kwargs.pop("format", Path(path).suffix.lstrip(".") or "png")
+    if fmt == "pdf":
+        savefig_kwargs.setdefault("metadata", {"CreationDate": None})
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt, **savefig_kwargs)
+    return write_bytes_if_changed(path, buffer.getvalue())
+
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,283 @@
+"""
+pipeline_profiling.py
+
+Lightweight instrumentation for the Table 02 and Table 03 pipelines.
+
+Stage functions are wrapped with the `stage` decorator (or the `stage_timer` context
+manager for ad-hoc blocks). When profiling is switched on (PROFILE_PIPELINE=True in
+the .env file or environment), each call records:
+  - wall time,
+  - rows in (first DataFrame-like argument) and rows out (the return value),
+  - bytes fetched (for loaders marked with fetch=True, or reported via record_bytes),
+  - peak Python memory allocated during the stage (via tracemalloc, which `profiled_run`
+    switches on for the duration of the run; stages outside a run record no peak).
+
+The `profiled_run` decorator on a pipeline's main() collects these records and writes
+a structured JSON run report to OUTPUT_DIR. Setting PROFILE_DUMP=cprofile (or
+pyinstrument, if installed) additionally dumps a profile for each outermost stage
+under main() to OUTPUT_DIR/profiles (profilers cannot be nested).
+
+When profiling is off, the decorators call straight through to the wrapped function.
+"""
+
+import cProfile
+import functools
+import inspect
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+import config
+
+_records = []
+_stack = []
+
+
+def is_enabled():
+    return config.PROFILE_PIPELINE
+
+
+def _count_rows(obj):
+    """Number of rows in a DataFrame/Series, or the total across a dict/tuple/list of them."""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    if isinstance(obj, dict):
+        counts = [_count_rows(v) for v in obj.values()]
+    elif isinstance(obj, (tuple, list)):
+        counts = [_count_rows(v) for v in obj]
+    else:
+        return None
+    counts = [c for c in counts if c is not None]
+    return sum(counts) if counts else None
+
+
+def _count_bytes(obj):
+    """Deep memory usage of a DataFrame/Series, or the total across a dict/tuple/list of them."""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, dict):
+        return sum(_count_bytes(v) for v in obj.values())
+    if isinstance(obj, (tuple, list)):
+        return sum(_count_bytes(v) for v in obj)
+    return 0
+
+
+def _first_frame_argument(args, kwargs):
+    for value in list(args) + list(kwargs.values()):
+        if _count_rows(value) is not None:
+            return value
+    return None
+
+
+def _start_dump(name):
+    """Start a per-stage profiler for top-level stages if PROFILE_DUMP asks for one."""
+    dump = config.PROFILE_DUMP.lower()
+    if not dump or any(rec.get("_profiler") is not None for rec in _stack):
+        return None
+    if dump == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed; falling back to cProfile.")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            return profiler
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _stop_dump(profiler, name):
+    profile_dir = config.OUTPUT_DIR / "profiles"
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        path = profile_dir / f"{name}.prof"
+        profiler.dump_stats(path)
+    else:
+        profiler.stop()
+        path = profile_dir / f"{name}.html"
+        path.write_text(profiler.output_html(), encoding="utf-8")
+    return str(path)
+
+
+def record_bytes(n):
+    """Add `n` bytes to the bytes-fetched counter of the innermost running stage."""
+    if _stack:
+        _stack[-1]["bytes_fetched"] += int(n)
+
+
+def set_rows(rows_in=None, rows_out=None):
+    """Set the row counts of the innermost running stage (for use inside stage_timer blocks)."""
+    if _stack:
+        if rows_in is not None:
+            _stack[-1]["rows_in"] = rows_in
+        if rows_out is not None:
+            _stack[-1]["rows_out"] = rows_out
+
+
+@contextmanager
+def stage_timer(name, dump=True):
+    """
+    Context manager that records a stage. Does nothing when profiling is off.
+    With dump=False the stage is never profiled with PROFILE_DUMP, leaving its
+    child stages to be dumped individually.
+
+    Example
+    -------
+    ```
+    with stage_timer("Table03.excel_parse"):
+        df = pd.read_excel(path)
+        set_rows(rows_out=len(df))
+    ```
+    """
+    if not is_enabled():
+        yield None
+        return
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        if _stack:
+            # reset_peak() below would forget the parent's peak so far, so remember it
+            parent = _stack[-1]
+            parent["_peak_so_far"] = max(parent["_peak_so_far"], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    record = {
+        "stage": name,
+        "depth": len(_stack),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "wall_time_s": None,
+        "rows_in": None,
+        "rows_out": None,
+        "bytes_fetched": 0,
+        "peak_memory_bytes": None,
+        "profile": None,
+        "_peak_so_far": 0,
+    }
+    record["_profiler"] = _start_dump(name) if dump else None
+    _stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["wall_time_s"] = round(time.perf_counter() - start, 6)
+        _stack.pop()
+        peak_so_far = record.pop("_peak_so_far")
+        if tracing and tracemalloc.is_tracing():
+            peak = max(peak_so_far, tracemalloc.get_traced_memory()[1])
+            record["peak_memory_bytes"] = int(peak)
+            if _stack:
+                _stack[-1]["_peak_so_far"] = max(_stack[-1]["_peak_so_far"], peak)
+        profiler = record.pop("_profiler")
+        if profiler is not None:
+            record["profile"] = _stop_dump(profiler, name)
+        _records.append(record)
+
+
+def stage(name=None, fetch=False):
+    """
+    Decorator that records each call of a pipeline stage function.
+
+    Rows in are counted from the first DataFrame-like argument and rows out from the
+    return value. With fetch=True the size of the returned data is also counted as
+    bytes fetched (used for the WRDS / FRED / Fama-French loaders).
+    """
+    def decorator(func):
+        stage_name = name or f"{func.__module__}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return func(*args, **kwargs)
+            with stage_timer(stage_name) as record:
+                record["rows_in"] = _count_rows(_first_frame_argument(args, kwargs))
+                result = func(*args, **kwargs)
+                record["rows_out"] = _count_rows(result)
+                if fetch:
+                    record["bytes_fetched"] += _count_bytes(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def reset_run_report():
+    _records.clear()
+
+
+def summarize_records(records=None):
+    """Total wall time, call count and max peak memory per stage, slowest first."""
+    records = _records if records is None else records
+    if not records:
+        return pd.DataFrame(columns=["calls", "wall_time_s", "rows_out", "bytes_fetched", "peak_memory_bytes"])
+    df = pd.DataFrame(records)
+    summary = df.groupby("stage").agg(
+        calls=("stage", "size"),
+        wall_time_s=("wall_time_s", "sum"),
+        rows_out=("rows_out", "sum"),
+        bytes_fetched=("bytes_fetched", "sum"),
+        peak_memory_bytes=("peak_memory_bytes", "max"),
+    )
+    return summary.sort_values("wall_time_s", ascending=False)
+
+
+def write_run_report(run_name, params=None):
+    """Write the stages recorded so far to OUTPUT_DIR/run_report_<run_name>.json."""
+    summary = summarize_records()
+    report = {
+        "run": run_name,
+        "written_at": datetime.now().isoformat(timespec="seconds"),
+        "params": params or {},
+        "stages": _records,
+        "summary": json.loads(summary.reset_index().to_json(orient="records")),
+    }
+    config.OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    outfile = config.OUTPUT_DIR / f"run_report_{run_name}.json"
+    with open(outfile, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Run report saved to: {outfile}")
+    return outfile
+
+
+def profiled_run(run_name):
+    """
+    Decorator for a pipeline's main(): records the whole run as a stage and writes the
+    JSON run report afterwards. Runs called with UPDATED=True (by keyword or position) get
+    an '_updated' suffix. Memory tracing is switched on for the run and off again afterwards,
+    unless it was already on.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            reset_run_report()
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            try:
+                with stage_timer(f"{func.__module__}.{func.__name__}", dump=False):
+                    result = func(*args, **kwargs)
+            finally:
+                if started_tracing:
+                    tracemalloc.stop()
+            name = f"{run_name}_updated" if bound.arguments.get("UPDATED") else run_name
+            write_run_report(name, params=dict(bound.arguments))
+            return result
+
+        return wrapper
+
+    return decorator
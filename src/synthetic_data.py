@@ -0,0 +1,180 @@
+"""
+synthetic_data.py
+
+Generates synthetic datasets shaped like the WRDS / FRED pulls used in this project,
+so that the pipeline functions can be exercised (and benchmarked) without WRDS
+credentials or network access.
+
+ - make_fundq_panel: Compustat fundq-style firm-quarter panel with the columns returned by
+   Table02Prep.fetch_financial_data and Table03Load.fetch_financial_data_quarterly.
+ - make_comparison_group_datasets: the {"PD", "BD", "Banks", "Cmpust."} dict used by Table 2.
+ - make_bd_financials: the broker-dealer Z.1 series (bd_fin_assets, bd_liabilities).
+ - make_ratio_panel: quarterly capital ratios as produced by Table03.aggregate_ratios.
+ - make_long_panel: CRSP-style (id, date, value) panel with gaps, for the lag helpers.
+
+The numbers are random but have plausible magnitudes and relationships
+(book_debt = total_assets - book_equity, etc.). Everything is seeded and vectorized,
+so panels with millions of rows are generated in seconds; memory is the limit
+(roughly 100 bytes per firm-quarter row including the string columns).
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _quarter_table(start_year, n_quarters):
+    """Quarter labels ('1960Q1') and quarter-end dates for n_quarters quarters."""
+    periods = pd.period_range(start=f"{start_year}Q1", periods=n_quarters, freq="Q")
+    labels = np.array([f"{p.year}Q{p.quarter}" for p in periods], dtype=object)
+    ends = periods.to_timestamp(how="end").normalize()
+    return labels, ends
+
+
+def make_fundq_panel(n_firms=100, n_years=50, start_year=1960, seed=0, missing_frac=0.02, balanced=False):
+    """
+    Synthetic Compustat fundq panel.
+
+    Each firm is alive over a random contiguous window of quarters (the whole sample if
+    balanced=True), so the panel has on average about n_firms * n_years * 2 rows.
+
+    Returns a DataFrame with columns
+    datadate, datafqtr, total_assets, book_debt, book_equity, market_equity, gvkey, conm.
+
+    Examples
+    --------
+    ```
+    >>> df = make_fundq_panel(n_firms=3, n_years=1, balanced=True, missing_frac=0)
+    >>> df.shape
+    (12, 8)
+    >>> df['datafqtr'].iloc[:4].tolist()
+    ['1960Q1', '1960Q2', '1960Q3', '1960Q4']
+
+    ```
+    """
+    rng = np.random.default_rng(seed)
+    n_quarters = 4 * n_years
+    labels, ends = _quarter_table(start_year, n_quarters)
+
+    if balanced:
+        first = np.zeros(n_firms, dtype=np.int64)
+        length = np.full(n_firms, n_quarters, dtype=np.int64)
+    else:
+        length = rng.integers(4, n_quarters + 1, size=n_firms)
+        first = (rng.random(n_firms) * (n_quarters - length + 1)).astype(np.int64)
+
+    firm = np.repeat(np.arange(n_firms), length)
+    offsets = np.repeat(np.cumsum(length) - length, length)
+    quarter = np.repeat(first, length) + (np.arange(len(firm)) - offsets)
+    n = len(firm)
+
+    # Firm size follows a log random walk around a firm-specific level
+    size = rng.lognormal(mean=7.0, sigma=1.5, size=n_firms)
+    shocks = rng.normal(0, 0.05, size=n)
+    cumulative = np.cumsum(shocks)
+    start_idx = np.cumsum(length) - length
+    walk = cumulative - np.repeat(cumulative[start_idx] - shocks[start_idx], length)
+    total_assets = size[firm] * np.exp(walk)
+    equity_share = rng.uniform(0.03, 0.15, size=n_firms)[firm] * np.exp(rng.normal(0, 0.1, size=n))
+    book_equity = total_assets * equity_share
+    book_debt = total_assets - book_equity
+    market_equity = book_equity * rng.lognormal(0.2, 0.4, size=n)
+
+    df = pd.DataFrame({
+        "datadate": ends[quarter],
+        "datafqtr": labels[quarter],
+        "total_assets": total_assets,
+        "book_debt": book_debt,
+        "book_equity": book_equity,
+        "market_equity": market_equity,
+        "gvkey": np.char.zfill((firm + 1001).astype(str), 6).astype(object),
+        "conm": np.char.add("FIRM ", (firm + 1001).astype(str)).astype(object),
+    })
+    if missing_frac > 0:
+        for col in ["book_equity", "market_equity"]:
+            mask = rng.random(n) < missing_frac
+            df.loc[mask, col] = np.nan
+    return df
+
+
+def make_comparison_group_datasets(n_firms=100, n_years=50, start_year=1960, seed=0, missing_frac=0.02):
+    """
+    Synthetic version of the dict returned by Table02Prep.pull_data_for_all_comparison_groups.
+    Group sizes are in the rough proportions of the real data (Cmpust. is by far the largest).
+    """
+    sizes = {
+        "PD": max(2, n_firms // 50),
+        "BD": max(2, n_firms // 20),
+        "Banks": max(2, n_firms // 5),
+        "Cmpust.": n_firms,
+    }
+    datasets = {}
+    for i, (group, size) in enumerate(sizes.items()):
+        df = make_fundq_panel(n_firms=size, n_years=n_years, start_year=start_year,
+                              seed=seed + i, missing_frac=missing_frac)
+        datasets[group] = df.drop(columns=["datafqtr"])
+    return datasets
+
+
+def make_bd_financials(n_years=50, start_year=1960, seed=0):
+    """
+    Synthetic broker-dealer financial assets and liabilities, indexed by quarter-end
+    dates named 'datafqtr' like Table03.combine_bd_financials.
+    """
+    rng = np.random.default_rng(seed)
+    _, ends = _quarter_table(start_year, 4 * n_years)
+    assets = 1000 * np.exp(np.cumsum(rng.normal(0.02, 0.04, size=len(ends))))
+    liabilities = assets * rng.uniform(0.90, 0.98, size=len(ends))
+    bd = pd.DataFrame({"bd_fin_assets": assets, "bd_liabilities": liabilities}, index=ends)
+    bd.index.name = "datafqtr"
+    return bd
+
+
+def make_ratio_panel(n_quarters=172, start_year=1970, seed=0):
+    """
+    Synthetic quarterly market_cap_ratio, book_cap_ratio (persistent AR(1) processes)
+    and aem_leverage, indexed by quarter-end dates named 'date'.
+    """
+    rng = np.random.default_rng(seed)
+    _, ends = _quarter_table(start_year, n_quarters)
+
+    def ar1(mean, phi, sigma):
+        x = np.empty(n_quarters)
+        x[0] = mean
+        eps = rng.normal(0, sigma, size=n_quarters)
+        for t in range(1, n_quarters):
+            x[t] = mean + phi * (x[t - 1] - mean) + eps[t]
+        return x
+
+    ratios = pd.DataFrame({
+        "market_cap_ratio": np.clip(ar1(0.08, 0.95, 0.01), 0.01, None),
+        "book_cap_ratio": np.clip(ar1(0.06, 0.97, 0.005), 0.01, None),
+        "aem_leverage": np.clip(ar1(20, 0.9, 2), 2, None),
+    }, index=ends)
+    ratios.index.name = "date"
+    return ratios
+
+
+def make_long_panel(n_ids=100, n_periods=120, start="1990-01-01", freq="MS", gap_frac=0.05, seed=0):
+    """
+    Synthetic long (id, date, value) panel such as CRSP monthly returns, with a fraction
+    `gap_frac` of the observations removed to create gaps in each id's history.
+
+    Examples
+    --------
+    ```
+    >>> make_long_panel(n_ids=2, n_periods=3, gap_frac=0).shape
+    (6, 3)
+
+    ```
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start=start, periods=n_periods, freq=freq)
+    ids = np.repeat(np.arange(10001, 10001 + n_ids), n_periods)
+    df = pd.DataFrame({
+        "id": ids,
+        "date": np.tile(dates.values, n_ids),
+        "value": rng.normal(0.01, 0.1, size=n_ids * n_periods),
+    })
+    if gap_frac > 0:
+        df = df[rng.random(len(df)) >= gap_frac].reset_index(drop=True)
+    return df
@@ -0,0 +1,87 @@
+import pytest
+
+import LaTeXDocGenerator
+from LaTeXDocGenerator import SECTIONS, SECTIONS_DIRNAME
+
+
+@pytest.fixture
+def compiles(tmp_path, monkeypatch):
+    """A tmp output directory with every table and figure the document needs, and a fake PDF step."""
+    for _, _, inputs in SECTIONS:
+        for fname in inputs:
+            (tmp_path / fname).write_bytes(f"{fname} v1\n".encode("utf-8"))
+    compiles = []
+
+    def fake_compile(output_dir, tex_filename):
+        compiles.append((output_dir / tex_filename).read_text(encoding="utf-8"))
+        (output_dir / tex_filename).with_suffix(".pdf").write_bytes(b"%PDF")
+        return True
+
+    monkeypatch.setattr(LaTeXDocGenerator, "OUTPUT_DIR", tmp_path)
+    monkeypatch.setattr(LaTeXDocGenerator, "compile_pdf", fake_compile)
+    return compiles
+
+
+def _mtimes(output_dir):
+    return {path.name: path.stat().st_mtime_ns for path in (output_dir / SECTIONS_DIRNAME).iterdir()} | {
+        "combined_document.tex": (output_dir / "combined_document.tex").stat().st_mtime_ns}
+
+
+def test_unchanged_second_run_rewrites_nothing(tmp_path, compiles):
+    output_dir = tmp_path
+    LaTeXDocGenerator.main()
+    assert len(compiles) == 1
+    assert r"\input{sections/table02}" in compiles[0]
+    assert r"\include{" not in compiles[0]
+    before = _mtimes(output_dir)
+
+    LaTeXDocGenerator.main()
+    assert len(compiles) == 1
+    assert _mtimes(output_dir) == before
+
+
+def test_changed_inputs_rebuild_only_their_section(tmp_path, compiles):
+    output_dir = tmp_path
+    LaTeXDocGenerator.main()
+    manifest_path = output_dir / SECTIONS_DIRNAME / LaTeXDocGenerator.MANIFEST_FILENAME
+
+    (output_dir / "table02_corr.tex").write_text("table02_corr.tex v2\n", encoding="utf-8")
+    manifest = LaTeXDocGenerator.load_manifest(manifest_path)
+    assert LaTeXDocGenerator.build_sections(output_dir, manifest) == ["table02"]
+    assert "v2" in (output_dir / SECTIONS_DIRNAME / "table02.tex").read_text(encoding="utf-8")
+
+    # A figure replaced under the same name leaves the fragment text alone but still counts
+    (output_dir / "table03_figure.png").write_bytes(b"new image")
+    assert LaTeXDocGenerator.build_sections(output_dir, manifest) == ["table03"]
+    assert LaTeXDocGenerator.build_sections(output_dir, manifest) == []
+    LaTeXDocGenerator.save_manifest(manifest_path, manifest)
+
+    (output_dir / "updated_table03_figure03.png").write_bytes(b"new image")
+    LaTeXDocGenerator.main(includeonly="changed")
+    assert len(compiles) == 2
+    combined = compiles[-1]
+    assert r"\includeonly{sections/updated_table03}" in combined
+    assert r"\include{sections/introduction}" in combined and r"\input{" not in combined
+
+
+def test_force_rebuilds_everything(tmp_path, compiles):
+    output_dir = tmp_path
+    LaTeXDocGenerator.main()
+    manifest_path = output_dir / SECTIONS_DIRNAME / LaTeXDocGenerator.MANIFEST_FILENAME
+    manifest = LaTeXDocGenerator.load_manifest(manifest_path)
+    assert LaTeXDocGenerator.build_sections(output_dir, manifest) == []
+    assert LaTeXDocGenerator.build_sections(output_dir, manifest, force=True) == [name for name, _, _ in SECTIONS]
+
+    LaTeXDocGenerator.main(force=True)
+    assert len(compiles) == 2
+
+
+def test_build_main_document_includeonly():
+    full = LaTeXDocGenerator.build_main_document()
+    assert r"\includeonly" not in full
+    assert full.count(r"\input{sections/") == len(SECTIONS)
+
+    partial = LaTeXDocGenerator.build_main_document(includeonly=["table02", "table03"])
+    assert r"\includeonly{sections/table02,sections/table03}" in partial
+    assert partial.index(r"\includeonly") < partial.index(r"\begin{document}")
+    assert partial.count(r"\include{sections/") == len(SECTIONS)
@@ -0,0 +1,41 @@
+import pandas as pd
+import pytest
+
+import config
+import synthetic_data
+import Table02Analysis
+import Table02Prep
+
+
+def _datasets():
+    return synthetic_data.make_comparison_group_datasets(n_firms=200, n_years=60, seed=3)
+
+
+def test_polars_backend_matches_pandas(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "OUTPUT_DIR", tmp_path)
+    results = {}
+    for backend in ["pandas", "polars"]:
+        ds = _datasets()
+        prepped = Table02Prep.prep_datasets(ds, backend=backend)
+        ratios = Table02Prep.create_ratios_for_table({k: v.copy() for k, v in prepped.items()},
+                                                     UPDATED=True, backend=backend)
+        Table02Analysis.create_corr_matrix_for_data(ds, backend=backend)
+        corr = (tmp_path / "table02_corr.tex").read_text()
+        results[backend] = (ds, prepped, ratios, corr)
+
+    pd_ds, pd_prepped, pd_ratios, pd_corr = results["pandas"]
+    pl_ds, pl_prepped, pl_ratios, pl_corr = results["polars"]
+    for group in pd_prepped:
+        pd.testing.assert_frame_equal(pl_prepped[group], pd_prepped[group], check_dtype=False, rtol=1e-12)
+        # The cleaned inputs are shared with the summary-statistics and correlation stages
+        cols = ["datadate", *Table02Prep.KEY_COLS]
+        pd.testing.assert_frame_equal(pl_ds[group][cols], pd_ds[group][cols], check_dtype=False, rtol=1e-12)
+    pd.testing.assert_frame_equal(pl_ratios, pd_ratios, check_dtype=False, check_freq=False, rtol=1e-12)
+    assert pl_corr == pd_corr
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        Table02Prep.prep_datasets(_datasets(), backend="spark")
+    with pytest.raises(ValueError):
+        Table02Analysis.create_corr_matrix_for_data(_datasets(), backend="polar")
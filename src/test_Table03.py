@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+import synthetic_data
+import Table03
+
+
+def test_ratio_variants_match_direct_computation():
+    dataset = synthetic_data.make_fundq_panel(n_firms=15, n_years=20, start_year=1970, seed=2).drop(columns=["datadate"])
+    bd = synthetic_data.make_bd_financials(n_years=20, start_year=1970)
+    variants = Table03.calculate_ratio_variants(dataset, bd_financials=bd)
+
+    base = Table03.aggregate_ratios(Table03.prep_dataset(dataset.copy(), bd_financials=bd))
+    pd.testing.assert_series_equal(variants["market_cap_ratio_aggregate"], base["market_cap_ratio"], check_names=False)
+
+    rows = dataset.dropna().assign(datafqtr=lambda d: Table03.quarter_to_date(d["datafqtr"]))
+    rows["mcr"] = rows["market_equity"] / (rows["book_debt"] + rows["market_equity"])
+    rows["bcr"] = rows["book_equity"] / (rows["book_debt"] + rows["book_equity"])
+    grouped = rows.groupby("datafqtr")
+    value = grouped.apply(lambda g: np.average(g["mcr"], weights=g["market_equity"]))
+    np.testing.assert_allclose(variants["market_cap_ratio_value"], value.reindex(variants.index), rtol=1e-12)
+    np.testing.assert_allclose(variants["book_cap_ratio_equal"], grouped["bcr"].mean().reindex(variants.index), rtol=1e-12)
+    np.testing.assert_allclose(variants["book_cap_ratio_median"], grouped["bcr"].median().reindex(variants.index), rtol=1e-12)
+
+
+def test_ratio_variants_reuse_precomputed_ratios():
+    dataset = synthetic_data.make_fundq_panel(n_firms=10, n_years=15, start_year=1975, seed=5).drop(columns=["datadate"])
+    bd = synthetic_data.make_bd_financials(n_years=15, start_year=1975)
+    ratios = Table03.aggregate_ratios(Table03.prep_dataset(dataset, bd_financials=bd))
+    pd.testing.assert_frame_equal(Table03.calculate_ratio_variants(dataset, ratios=ratios),
+                                  Table03.calculate_ratio_variants(dataset, bd_financials=bd))
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+import Table03AssetPricing
+
+
+def _returns(n_periods=160, n_assets=40, seed=0, missing_frac=0.0):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("1970-03-31", periods=n_periods, freq="QE")
+    factors = pd.DataFrame(rng.normal([0.02, 0.01], [0.08, 0.05], size=(n_periods, 2)), index=index,
+                           columns=["Market excess return", "Market capital factor"])
+    betas = rng.normal(1, 0.5, size=(n_assets, 2))
+    premia = np.array([0.02, 0.01])
+    returns = (betas @ premia + (factors.to_numpy() - factors.mean().to_numpy()) @ betas.T
+               + rng.normal(0, 0.02, size=(n_periods, n_assets)))
+    returns[rng.random(returns.shape) < missing_frac] = np.nan
+    return pd.DataFrame(returns, index=index, columns=[f"p{i}" for i in range(n_assets)]), factors
+
+
+def _loop_reference(returns, factors):
+    betas = []
+    for col in returns.columns:
+        data = pd.concat([returns[col], factors], axis=1).dropna()
+        X = np.column_stack([np.ones(len(data)), data[factors.columns]])
+        betas.append(np.linalg.lstsq(X, data[col], rcond=None)[0])
+    betas = np.array(betas)
+    premia = []
+    for t in returns.index:
+        ok = returns.loc[t].notna().to_numpy()
+        X = np.column_stack([np.ones(ok.sum()), betas[ok, 1:]])
+        premia.append(np.linalg.lstsq(X, returns.loc[t].to_numpy()[ok], rcond=None)[0])
+    return betas, np.array(premia)
+
+
+def test_fama_macbeth_matches_loop_and_shanken_formula():
+    for missing_frac in (0.0, 0.1):
+        returns, factors = _returns(missing_frac=missing_frac)
+        result = Table03AssetPricing.fama_macbeth(returns, factors)
+        betas, premia = _loop_reference(returns, factors)
+        np.testing.assert_allclose(result['betas'].to_numpy(), betas, rtol=1e-8, atol=1e-12)
+        np.testing.assert_allclose(result['premia'].to_numpy(), premia, rtol=1e-8, atol=1e-12)
+
+        lam, T = premia.mean(axis=0), len(premia)
+        var_fm = np.cov(premia, rowvar=False, ddof=0) / T
+        sigma_f = np.cov(factors.to_numpy(), rowvar=False)
+        c = lam[1:] @ np.linalg.solve(sigma_f, lam[1:])
+        var_shanken = (1 + c) * var_fm
+        var_shanken[1:, 1:] += sigma_f / T
+        summary = result['summary']
+        np.testing.assert_allclose(summary['se_fm'], np.sqrt(np.diag(var_fm)), rtol=1e-8)
+        np.testing.assert_allclose(summary['se_shanken'], np.sqrt(np.diag(var_shanken)), rtol=1e-8)
+        assert (summary['se_shanken'] > summary['se_fm']).all()
+
+
+def test_quarterly_returns_compound_months():
+    monthly = pd.DataFrame({"a": [0.01, 0.02, -0.01, 0.03, np.nan, 0.0]},
+                           index=pd.period_range("1990-01", periods=6, freq="M"))
+    quarterly = Table03AssetPricing.quarterly_returns(monthly)
+    assert np.isclose(quarterly["a"].iloc[0], 1.01 * 1.02 * 0.99 - 1)
+    assert np.isnan(quarterly["a"].iloc[1])
+    assert quarterly.index[0] == pd.Timestamp("1990-03-31")
+
+
+def test_export_writes_betas_once(tmp_path, monkeypatch):
+    import config
+
+    monkeypatch.setattr(config, "OUTPUT_DIR", tmp_path)
+    returns, factors = _returns(n_assets=10)
+    result = Table03AssetPricing.fama_macbeth(returns, factors)
+    Table03AssetPricing.export_asset_pricing_table(result)
+    betas = tmp_path / "table03_asset_pricing_betas.parquet"
+    mtime = betas.stat().st_mtime_ns
+    Table03AssetPricing.export_asset_pricing_table(result)
+    assert betas.stat().st_mtime_ns == mtime
+    assert pd.read_parquet(betas)["asset"].tolist() == list(returns.columns)
@@ -0,0 +1,26 @@
+import pandas as pd
+import pyarrow.parquet as pq
+
+import synthetic_data
+import Table03
+import Table03DealerPanel
+
+
+def test_round_trip_slicing_and_aggregate(tmp_path):
+    dataset = synthetic_data.make_fundq_panel(n_firms=30, n_years=20, start_year=1970, seed=5).drop(columns=["datadate"])
+    dataset = pd.concat([dataset, dataset.iloc[:10]])  # duplicated rows, as in a row-by-row fetch
+    bd = synthetic_data.make_bd_financials(n_years=20, start_year=1970)
+    path = tmp_path / "panel.parquet"
+    Table03DealerPanel.save_dealer_panel(Table03DealerPanel.build_dealer_panel(dataset), path=path, row_group_size=200)
+    assert pq.ParquetFile(path).metadata.num_row_groups > 1
+
+    panel = Table03DealerPanel.load_dealer_panel(path=path)
+    assert not panel.duplicated(["gvkey", "date"]).any()
+    expected = Table03.prep_dataset(dataset.copy(), bd_financials=bd)
+    from_panel = Table03.prep_dataset(Table03DealerPanel.to_fundq(panel), bd_financials=bd)
+    pd.testing.assert_frame_equal(from_panel.reset_index(drop=True), expected.reset_index(drop=True))
+
+    gvkeys = sorted(panel["gvkey"].unique())[:3]
+    sliced = Table03DealerPanel.load_dealer_panel(gvkeys=gvkeys, start="1980-01-01", end="1984-12-31", path=path)
+    mask = panel["gvkey"].isin(gvkeys) & panel["date"].between("1980-01-01", "1984-12-31")
+    pd.testing.assert_frame_equal(sliced, panel[mask].reset_index(drop=True))
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+
+import Table03
+import Table03Inference
+
+
+def _panelA(n_quarters=120, seed=0):
+    rng = np.random.default_rng(seed)
+    columns = Table03Inference.PANEL_A_MAIN + ['E/P', 'Unemployment', 'Financial conditions', 'GDP',
+                                               'Market excess return', 'Market volatility']
+    values = rng.normal(size=(n_quarters, len(columns))).cumsum(axis=0)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    index = pd.date_range("1970-03-31", periods=n_quarters, freq="QE")
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+def test_point_and_replicate_correlations_match_pandas():
+    panelA = _panelA()
+    result = Table03Inference.bootstrap_panelA(panelA, n_boot=50, chunk_size=20)
+    expected = Table03.calculate_correlation_panelA(panelA)
+    pd.testing.assert_frame_equal(result['corr'], expected, check_exact=False, rtol=1e-10)
+
+    columns = Table03Inference.PANEL_A_MAIN + Table03Inference.PANEL_A_OTHER
+    values = panelA[columns].to_numpy()
+    idx = Table03Inference.stationary_indices(len(values), 4, 3, np.random.default_rng(1))
+    batched = Table03Inference.batched_corr(values[idx])
+    for b in range(3):
+        np.testing.assert_allclose(batched[b], pd.DataFrame(values[idx[b]]).corr().to_numpy(), rtol=1e-10)
+
+    assert (result['lower'] <= result['corr'] + 1e-12).where(result['corr'].notna(), True).all().all()
+    assert (result['upper'] >= result['lower']).where(result['corr'].notna(), True).all().all()
+
+
+def test_resamplers_and_process_pool():
+    rng = np.random.default_rng(0)
+    idx = Table03Inference.moving_block_indices(10, 3, 5, rng)
+    assert idx.shape == (5, 10) and idx.min() >= 0 and idx.max() <= 9
+    # Within a block the positions are consecutive
+    assert (np.diff(idx.reshape(5, -1)[:, :9].reshape(5, 3, 3), axis=2) == 1).all()
+    idx = Table03Inference.stationary_indices(10, 3, 5, rng)
+    assert idx.shape == (5, 10) and idx.min() >= 0 and idx.max() <= 9
+
+    values = _panelA(60).to_numpy()
+    serial = Table03Inference.bootstrap_correlations(values, n_boot=40, method='moving', chunk_size=10, n_jobs=1)
+    pooled = Table03Inference.bootstrap_correlations(values, n_boot=40, method='moving', chunk_size=10, n_jobs=2)
+    np.testing.assert_array_equal(serial, pooled)
+
+
+def _panelB(n_quarters=160, seed=3):
+    rng = np.random.default_rng(seed)
+    columns = Table03Inference.PANEL_B_MAIN + Table03Inference.PANEL_B_OTHER
+    values = rng.normal(size=(n_quarters, len(columns)))
+    values[:, 3:] += 0.4 * values[:, [0]]
+    values[1:] += 0.5 * values[:-1]
+    values[0, :3] = np.nan
+    values[:6, 7] = np.nan
+    index = pd.date_range("1970-03-31", periods=n_quarters, freq="QE")
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+def test_hac_correlations_match_per_pair_newey_west():
+    from statsmodels.stats.sandwich_covariance import S_hac_simple
+
+    panelB = _panelB()
+    result = Table03Inference.hac_panelB(panelB, lags=4)
+    pd.testing.assert_frame_equal(result['corr'], Table03.calculate_correlation_panelB(panelB),
+                                  check_exact=False, rtol=1e-10)
+    for row, col in [('Market capital factor', 'Book capital factor'), ('GDP growth', 'Market capital factor'),
+                     ('Financial conditions growth', 'AEM leverage factor')]:
+        pair = panelB[[row, col]].dropna().to_numpy()
+        x, y = ((pair - pair.mean(axis=0)) / pair.std(axis=0)).T
+        r = (x * y).mean()
+        se = np.sqrt(S_hac_simple(x * y - r * (x ** 2 + y ** 2) / 2, 4)[0, 0]) / len(x)
+        assert np.isclose(result['se'].loc[row, col], se, rtol=1e-10)
+
+
+def test_factor_regressions_match_statsmodels():
+    import statsmodels.api as sm
+
+    panelB = _panelB()
+    for joint in (False, True):
+        table = Table03Inference.factor_regressions(panelB, lags=3, joint=joint).set_index(['target', 'regressor'])
+        for target in ['Market excess return', 'Financial conditions growth']:
+            regressors = Table03Inference.PANEL_B_MAIN if joint else ['Book capital factor']
+            data = panelB[[target, *regressors]].dropna()
+            fit = sm.OLS(data[target], sm.add_constant(data[regressors])).fit(cov_type='HAC', cov_kwds={'maxlags': 3})
+            for regressor in regressors:
+                assert np.isclose(table.loc[(target, regressor), 'coef'], fit.params[regressor], rtol=1e-10)
+                assert np.isclose(table.loc[(target, regressor), 'se'], fit.bse[regressor], rtol=1e-10)
+
+
+def test_lag_zero_is_white_covariance():
+    import statsmodels.api as sm
+
+    panelB = _panelB()
+    table = Table03Inference.factor_regressions(panelB, lags=0).set_index(['target', 'regressor'])
+    data = panelB[['GDP growth', 'Market capital factor']].dropna()
+    X = sm.add_constant(data['Market capital factor'])
+    ols = sm.OLS(data['GDP growth'], X).fit()
+    white = sm.OLS(data['GDP growth'], X).fit(cov_type='HC0')
+    row = table.loc[('GDP growth', 'Market capital factor')]
+    assert np.isclose(row['coef'], ols.params['Market capital factor'], rtol=1e-10)
+    assert np.isclose(row['se'], white.bse['Market capital factor'], rtol=1e-10)
+
+    result = Table03Inference.hac_panelB(panelB, lags=0)
+    pair = panelB[['GDP growth', 'Market capital factor']].dropna().to_numpy()
+    x, y = ((pair - pair.mean(axis=0)) / pair.std(axis=0)).T
+    r = (x * y).mean()
+    psi = x * y - r * (x ** 2 + y ** 2) / 2
+    assert np.isclose(result['se'].loc['GDP growth', 'Market capital factor'], np.sqrt((psi ** 2).sum()) / len(x), rtol=1e-10)
+
+
+def test_bootstrap_export_skips_unchanged_files(tmp_path, monkeypatch):
+    import config
+
+    monkeypatch.setattr(config, "OUTPUT_DIR", tmp_path)
+    result = Table03Inference.bootstrap_panelA(_panelA(), n_boot=20)
+    Table03Inference.export_bootstrap_tables(result, result)
+    parquet = tmp_path / "table03_bootstrap.parquet"
+    mtime = parquet.stat().st_mtime_ns
+    Table03Inference.export_bootstrap_tables(result, result)
+    assert parquet.stat().st_mtime_ns == mtime
+    assert len(pd.read_parquet(parquet)) == 2 * result['corr'].notna().sum().sum()
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+import synthetic_data
+import Table03
+import Table03Nowcast
+
+
+def _fundq():
+    return synthetic_data.make_fundq_panel(n_firms=20, n_years=10, start_year=1990, missing_frac=0, seed=4)
+
+
+def test_quarter_end_sample_reproduces_table03():
+    fundq = _fundq()
+    bd = synthetic_data.make_bd_financials(n_years=10, start_year=1990)
+    quarterly = Table03.calculate_ratios(Table03.prep_dataset(fundq.drop(columns=["datadate"]), bd_financials=bd))
+
+    book_debt = Table03Nowcast.book_debt_schedule(fundq)
+    market_equity = fundq.assign(date=Table03.quarter_to_date(fundq["datafqtr"]))[["gvkey", "date", "market_equity"]]
+    nowcast = Table03Nowcast.aggregate_nowcast(Table03Nowcast.dealer_panel(market_equity, book_debt))
+    sample = Table03Nowcast.quarter_end_sample(nowcast)
+    expected = quarterly.set_index("datafqtr")["market_cap_ratio"]
+    np.testing.assert_allclose(sample["market_cap_ratio"].reindex(expected.index), expected, rtol=1e-12)
+
+
+def test_daily_crsp_nowcast_and_incremental_append():
+    fundq = _fundq()
+    book_debt = Table03Nowcast.book_debt_schedule(fundq)
+    gvkeys = fundq["gvkey"].unique()
+    links = pd.DataFrame({
+        "gvkey": gvkeys, "permno": np.arange(len(gvkeys)) + 10000, "linktype": "LC", "linkprim": "P",
+        "linkdt": pd.Timestamp("1980-01-01"), "linkenddt": pd.NaT,
+    })
+    days = pd.bdate_range("1995-01-01", "1996-12-31")
+    rng = np.random.default_rng(0)
+    crsp = pd.DataFrame({
+        "permno": np.repeat(links["permno"].to_numpy(), len(days)),
+        "date": np.tile(days, len(links)),
+        "market_equity": rng.lognormal(6, 1, len(days) * len(links)),
+    })
+    market_equity = Table03Nowcast.dealer_market_equity(crsp, links)
+    full = Table03Nowcast.dealer_panel(market_equity, book_debt)
+
+    # Book debt of a day is the one of the last quarter end on or before it
+    reported = fundq[fundq["datafqtr"] == "1995Q1"].iloc[0]
+    row = full[(full["gvkey"] == int(reported["gvkey"])) & (full["date"] == "1995-05-15")]
+    assert row["book_debt"].iloc[0] == reported["book_debt"]
+
+    # Restricting to membership windows
+    dealers = pd.DataFrame({"gvkey": [int(reported["gvkey"])], "Start Date": ["06/01/1995"], "End Date": ["Current"]})
+    members = Table03Nowcast.dealer_panel(market_equity, book_debt, dealers=dealers)
+    assert set(members["gvkey"]) == {int(reported["gvkey"])}
+    assert members["date"].min() >= pd.Timestamp("1995-06-01")
+
+    split = pd.Timestamp("1996-03-01")
+    panel, _ = Table03Nowcast.append_nowcast(None, market_equity[market_equity["date"] < split], book_debt)
+    panel, new_days = Table03Nowcast.append_nowcast(panel, market_equity[market_equity["date"] >= split], book_debt,
+                                                    previous_book_debt=book_debt)
+    pd.testing.assert_frame_equal(panel, full)
+    assert new_days.index.min() >= split
+    nowcast = Table03Nowcast.aggregate_nowcast(full)
+    assert nowcast["market_cap_ratio"].between(0, 1).all()
+
+
+def test_append_recomputes_days_of_a_newly_reported_quarter():
+    fundq = _fundq()
+    gvkeys = pd.to_numeric(fundq["gvkey"].unique())
+    days = pd.bdate_range("1996-01-01", "1996-12-31")
+    rng = np.random.default_rng(1)
+    market_equity = pd.DataFrame({
+        "gvkey": np.repeat(gvkeys, len(days)),
+        "date": np.tile(days, len(gvkeys)),
+        "market_equity": rng.lognormal(6, 1, len(days) * len(gvkeys)),
+    })
+    # First run on 1996-05-10, before the 1996Q1 10-Q was out; the second run has it
+    old_schedule = Table03Nowcast.book_debt_schedule(fundq[fundq["datafqtr"] < "1996Q1"])
+    new_schedule = Table03Nowcast.book_debt_schedule(fundq[fundq["datafqtr"] <= "1996Q1"])
+    split = pd.Timestamp("1996-05-10")
+
+    panel, _ = Table03Nowcast.append_nowcast(None, market_equity[market_equity["date"] < split], old_schedule)
+    panel, recomputed = Table03Nowcast.append_nowcast(panel, market_equity[market_equity["date"] >= split],
+                                                      new_schedule, previous_book_debt=old_schedule)
+    full = Table03Nowcast.dealer_panel(market_equity, new_schedule)
+    pd.testing.assert_frame_equal(panel, full)
+    assert recomputed.index.min() == pd.Timestamp("1996-04-01")
+
+    # Unchanged schedule: only the new days are recomputed
+    _, recomputed = Table03Nowcast.append_nowcast(panel, market_equity[market_equity["date"] >= split],
+                                                  new_schedule, previous_book_debt=new_schedule)
+    assert recomputed.index.min() >= split
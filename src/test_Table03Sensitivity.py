@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+import synthetic_data
+import Table03
+import Table03Sensitivity
+
+
+def _inputs():
+    dataset = synthetic_data.make_fundq_panel(n_firms=12, n_years=40, start_year=1965, seed=7).drop(columns=["datadate"])
+    bd = synthetic_data.make_bd_financials(n_years=40, start_year=1965)
+    rng = np.random.default_rng(7)
+    index = pd.date_range("1965-03-31", periods=160, freq="QE")
+    macro = pd.DataFrame({
+        "e/p": rng.uniform(0.02, 0.1, len(index)),
+        "unemp_rate": rng.uniform(3, 10, len(index)),
+        "nfci": rng.normal(0, 1, len(index)),
+        "real_gdp": np.exp(np.cumsum(rng.normal(0.007, 0.01, len(index)))),
+        "real_gdp_growth_calc": rng.normal(0.007, 0.01, len(index)),
+        "mkt_ret": rng.normal(0.02, 0.08, len(index)),
+        "mkt_vol": rng.uniform(0.005, 0.02, len(index)),
+    }, index=index)
+    return dataset, bd, macro
+
+
+def _pipeline_tables(dataset, bd, macro):
+    ratios = Table03.aggregate_ratios(Table03.prep_dataset(dataset.copy(), bd_financials=bd))
+    factors = Table03.convert_ratios_to_factors(ratios)
+    corr_a = Table03.calculate_correlation_panelA(Table03.create_panelA(ratios, macro))
+    corr_b = Table03.calculate_correlation_panelB(Table03.create_panelB(factors, macro))
+    return ratios, factors, corr_a, corr_b
+
+
+def test_variants_match_pipeline_reruns():
+    dataset, bd, macro = _inputs()
+    dealer = sorted(dataset["gvkey"].unique())[3]
+    subset = sorted(dataset["gvkey"].unique())[:2]
+    result = Table03Sensitivity.run_sensitivity(dataset, macro, bd_financials=bd, subsets=[subset])
+    assert len(result["variants"]) == 1 + dataset["gvkey"].nunique() + 1
+
+    for label, excluded in [("all", []), (f"-{dealer}", [dealer]), ("-" + "-".join(subset), subset)]:
+        ratios, factors, corr_a, corr_b = _pipeline_tables(dataset[~dataset["gvkey"].isin(excluded)], bd, macro)
+        np.testing.assert_allclose(result["market_cap_ratio"][label].reindex(ratios.index), ratios["market_cap_ratio"], rtol=1e-10)
+        np.testing.assert_allclose(result["book_capital_factor"][label].reindex(factors.index),
+                                   factors["book_capital_factor"], rtol=1e-8, atol=1e-12)
+        for ours, theirs in [(result["panelA"].xs(label), corr_a), (result["panelB"].xs(label), corr_b)]:
+            np.testing.assert_allclose(ours.loc[theirs.index, theirs.columns].to_numpy(dtype=float),
+                                       theirs.to_numpy(dtype=float), rtol=1e-8, atol=1e-10)
+
+    influence = Table03Sensitivity.dealer_influence(result)
+    assert "all" not in influence.index.get_level_values("variant")
+
+
+def test_variant_dropping_the_only_dealer_of_a_quarter_matches_rerun():
+    dataset, bd, macro = _inputs()
+    gvkeys = sorted(dataset["gvkey"].unique())
+    lone, other = gvkeys[0], gvkeys[1]
+    # In 1990 (Q1-Q4) the lone dealer is the only one reporting, so excluding it empties these quarters
+    alone = dataset["datafqtr"].str.startswith("1990") & (dataset["gvkey"] != lone)
+    dataset = dataset[~alone]
+    result = Table03Sensitivity.run_sensitivity(dataset, macro, bd_financials=bd, subsets=[[lone, other]])
+    variants = result["variants"].set_index("variant")
+    assert variants.loc[f"-{lone}", "dropped_quarters"] >= 4
+    assert variants.loc[f"-{other}", "dropped_quarters"] == 0
+
+    for label, excluded in [(f"-{lone}", [lone]), (f"-{lone}-{other}", [lone, other])]:
+        ratios, factors, corr_a, corr_b = _pipeline_tables(dataset[~dataset["gvkey"].isin(excluded)], bd, macro)
+        assert result["market_cap_ratio"][label].dropna().index.equals(ratios.index)
+        for column in ["market_capital_factor", "book_capital_factor"]:
+            np.testing.assert_allclose(result[column][label].reindex(factors.index), factors[column],
+                                       rtol=1e-8, atol=1e-12)
+        for ours, theirs in [(result["panelA"].xs(label), corr_a), (result["panelB"].xs(label), corr_b)]:
+            np.testing.assert_allclose(ours.loc[theirs.index, theirs.columns].to_numpy(dtype=float),
+                                       theirs.to_numpy(dtype=float), rtol=1e-8, atol=1e-10)
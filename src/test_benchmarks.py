@@ -0,0 +1,21 @@
+import pandas as pd
+import benchmarks
+
+
+def test_benchmark_cases_run_on_tiny_scale():
+    results = benchmarks.run_benchmarks(scale="tiny", repeat=1)
+    assert [r["case"] for r in results] == list(benchmarks.CASES)
+    assert all(r["best_s"] > 0 for r in results)
+
+
+def test_compare_to_previous_flags_regressions():
+    history = pd.DataFrame([
+        {"case": "Table03.prep_dataset", "scale": "tiny", "commit": "aaa", "best_s": 1.0},
+        {"case": "Table02Prep.prep_datasets", "scale": "tiny", "commit": "aaa", "best_s": 1.0},
+    ])
+    results = [
+        {"case": "Table03.prep_dataset", "scale": "tiny", "commit": "bbb", "best_s": 1.5},
+        {"case": "Table02Prep.prep_datasets", "scale": "tiny", "commit": "bbb", "best_s": 0.5},
+    ]
+    comparison = benchmarks.compare_to_previous(results, history, threshold=1.2)
+    assert comparison["regression"].tolist() == [True, False]
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+import dealer_membership
+
+
+def _dealers():
+    return pd.DataFrame({
+        "Primary Dealer": ["A", "B", "C", "D", "E"],
+        "gvkey": [2943, 2943, 3243, 3243, 0],
+        "Start Date": ["07/15/1970", "07/01/1987", "06/15/1961", "04/07/2003", "01/01/1990"],
+        "End Date": ["06/30/1987", "12/19/1988", "04/13/1989", "Current", "Current"],
+    })
+
+
+def test_matches_dataframe_filtering():
+    dealers = _dealers()
+    index = dealer_membership.build_membership_index(dealers)
+    rng = np.random.default_rng(0)
+    dates = pd.Timestamp("1955-01-01") + pd.to_timedelta(rng.integers(0, 26_000, 5_000), unit="D")
+    gvkeys = rng.choice([2943, 3243, 1], size=len(dates))
+
+    starts = pd.to_datetime(dealers["Start Date"])
+    ends = pd.to_datetime(dealers["End Date"].replace("Current", "01/01/2262"))
+    expected = np.zeros(len(dates), dtype=bool)
+    for gvkey, start, end in zip(dealers["gvkey"], starts, ends):
+        expected |= (gvkeys == gvkey) & (dates >= start) & (dates <= end)
+    np.testing.assert_array_equal(dealer_membership.is_member(index, gvkeys, dates), expected)
+
+    members = dealer_membership.members_at(index, ["1960-01-01", "1987-07-01", "1989-01-01", "2024-06-30"])
+    assert members.groupby("date")["gvkey"].apply(list).to_dict() == {
+        pd.Timestamp("1987-07-01"): [2943, 3243],
+        pd.Timestamp("1989-01-01"): [3243],
+        pd.Timestamp("2024-06-30"): [3243],
+    }
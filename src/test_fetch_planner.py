@@ -0,0 +1,67 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+import fetch_planner
+import Table03Load
+
+
+class FakeFundq:
+    """Answers the fundq queries of Table03Load from an in-memory table."""
+
+    def __init__(self, fundq):
+        self.fundq = fundq
+        self.queries = 0
+
+    def raw_sql(self, query):
+        self.queries += 1
+        masks = [
+            (self.fundq["gvkey"] == gvkey) & self.fundq["datafqtr"].between(start, end)
+            for gvkey, start, end in re.findall(r"gvkey = '(\d+)'\s+AND cst.datafqtr BETWEEN '(\w+)' AND '(\w+)'", query)
+        ]
+        return self.fundq[np.logical_or.reduce(masks)].reset_index(drop=True)
+
+
+def _ticks():
+    return pd.DataFrame({
+        "Primary Dealer": ["A", "B", "C", "D", "E", "F"],
+        "gvkey": [2943, 2943, 2943, 3243, 3243, 0],
+        "Start Date": ["07/15/1970", "06/01/1987", "04/01/1996", "06/15/1961", "04/07/2003", "01/01/1990"],
+        "End Date": ["06/30/1987", "12/19/1988", "04/30/2001", "04/13/1989", "12/31/2005", "Current"],
+    })
+
+
+def test_coalesce_intervals():
+    intervals, membership = fetch_planner.plan_fetches(_ticks())
+    assert intervals[["gvkey", "start_qtr", "end_qtr"]].values.tolist() == [
+        ["002943", "1970Q3", "1988Q4"],
+        ["002943", "1996Q2", "2001Q2"],
+        ["003243", "1961Q2", "1989Q2"],
+        ["003243", "2003Q2", "2005Q4"],
+    ]
+    assert membership["interval_id"].tolist() == [0, 0, 1, 2, 3]
+    summary = fetch_planner.plan_summary(intervals, membership)
+    assert summary["firm_quarters_planned"] == summary["firm_quarters_per_row"] - 1
+
+
+def test_coalesced_fetch_matches_row_by_row():
+    quarters = fetch_planner.ordinal_to_quarter(np.arange(1960 * 4, 2010 * 4))
+    fundq = pd.DataFrame([(g, q) for g in ["002943", "003243"] for q in quarters], columns=["gvkey", "datafqtr"])
+    fundq["total_assets"] = np.arange(len(fundq), dtype=float)
+
+    db = FakeFundq(fundq)
+    row_by_row, empty = Table03Load.fetch_data_for_tickers(_ticks(), db)
+    assert db.queries == 5
+
+    db = FakeFundq(fundq)
+    coalesced, coalesced_empty = Table03Load.fetch_data_for_tickers(_ticks(), db, coalesce=True)
+    assert db.queries == 1
+    assert not coalesced.duplicated().any()
+    expected = row_by_row.drop_duplicates().sort_values(["gvkey", "datafqtr"]).reset_index(drop=True)
+    pd.testing.assert_frame_equal(coalesced.sort_values(["gvkey", "datafqtr"]).reset_index(drop=True), expected)
+    assert coalesced_empty == empty == [{"0": 0}]
+
+    # Per-dealer attribution gives back the row-by-row result
+    attributed = fetch_planner.attribute_to_dealers(coalesced, fetch_planner.plan_fetches(_ticks())[1])
+    assert len(attributed) == len(row_by_row)
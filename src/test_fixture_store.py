@@ -0,0 +1,29 @@
+import pandas as pd
+import pytest
+
+import config
+import fixture_store
+
+
+def test_record_then_replay(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "FIXTURE_DIR", tmp_path)
+    calls = []
+
+    @fixture_store.recorded()
+    def loader(ticks, db, start="1960-01-01"):
+        calls.append(1)
+        return ticks.assign(x=1.0)
+
+    ticks = pd.DataFrame({"gvkey": ["001001", "001002"]})
+    monkeypatch.setattr(config, "DATA_MODE", "record")
+    recorded_df = loader(ticks, object())
+    assert len(calls) == 1
+
+    monkeypatch.setattr(config, "DATA_MODE", "replay")
+    pd.testing.assert_frame_equal(loader(ticks, None), recorded_df)
+    pd.testing.assert_frame_equal(loader(ticks, db=None, start="1960-01-01"), recorded_df)
+    assert len(calls) == 1
+
+    # Different inputs have no fixture
+    with pytest.raises(FileNotFoundError):
+        loader(ticks.iloc[:1], None)
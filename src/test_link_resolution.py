@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+import link_resolution
+
+
+def _links():
+    return pd.DataFrame({
+        "gvkey": ["001001", "001002", "001002", "001003", "001004", "001004"],
+        "permno": [10001, 10002, 10003, 10002, 10004, 10005],
+        "linktype": ["LU", "LC", "LU", "LU", "LC", "LC"],
+        "linkprim": ["P", "P", "C", "C", "P", "J"],
+        "linkdt": pd.to_datetime(["1980-01-01", "1985-01-01", "1990-01-01", "1984-06-01", "1970-01-01", "1995-01-01"]),
+        "linkenddt": pd.to_datetime(["1999-12-31", "1994-12-31", None, "1986-06-30", None, "2000-12-31"]),
+    })
+
+
+def _brute_force(links, keys, dates, key, target):
+    prim = {p: i for i, p in enumerate(link_resolution.LINKPRIM_PRIORITY)}
+    ltype = {t: i for i, t in enumerate(link_resolution.LINKTYPE_PRIORITY)}
+    ends = links["linkenddt"].fillna(pd.Timestamp.max)
+    out = []
+    for k, d in zip(keys, dates):
+        valid = links[(links[key] == k) & (links["linkdt"] <= d) & (ends >= d)]
+        if valid.empty:
+            out.append(None)
+            continue
+        valid = valid.assign(p=valid["linkprim"].map(prim), t=valid["linktype"].map(ltype).fillna(9),
+                             s=-valid["linkdt"].astype("int64"))
+        out.append(valid.sort_values(["p", "t", "s"]).iloc[0][target])
+    return out
+
+
+def test_resolution_matches_brute_force():
+    links = _links()
+    rng = np.random.default_rng(1)
+    dates = pd.Timestamp("1979-01-01") + pd.to_timedelta(rng.integers(0, 12_000, 500), unit="D")
+
+    crsp = pd.DataFrame({"permno": rng.choice([10001, 10002, 10003, 10004, 10005, 99999], len(dates)), "date": dates})
+    resolved = link_resolution.permno_to_gvkey(crsp, links)
+    expected = _brute_force(links, crsp["permno"], crsp["date"], "permno", "gvkey")
+    assert resolved["gvkey"].where(resolved["gvkey"].notna(), None).tolist() == expected
+
+    comp = pd.DataFrame({"gvkey": rng.choice([1001, 1002, 1003, 1004, 1005], len(dates)), "datadate": dates})
+    resolved = link_resolution.gvkey_to_permno(comp, links)
+    expected = _brute_force(links, comp["gvkey"].astype(str).str.zfill(6), comp["datadate"], "gvkey", "permno")
+    assert resolved["permno"].astype(object).where(resolved["permno"].notna(), None).tolist() == expected
+
+
+def test_timeline_is_disjoint():
+    timeline = link_resolution.link_timeline(_links(), key="gvkey", target="permno")
+    # gvkey 1002: P link until 1994, then the C link; 1004: the P link throughout
+    assert timeline[timeline["gvkey"] == 1002]["permno"].tolist() == [10002, 10003]
+    assert timeline[timeline["gvkey"] == 1004]["permno"].tolist() == [10004]
+    for _, group in timeline.groupby("gvkey"):
+        assert (group["start"].to_numpy()[1:] > group["end"].to_numpy()[:-1]).all()
@@ -1,12 +1,22 @@
 import warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
+import numpy as np
 import pandas as pd
 from misc_tools import (
     weighted_average,
     groupby_weighted_average,
     groupby_weighted_std,
+    groupby_weighted_quantiles,
+    weighted_quantile,
     get_most_recent_quarter_end,
     get_next_quarter_start,
+    with_lagged_columns,
+    leave_one_out_sums,
+    leave_one_out_means,
+    dataframe_set_difference,
+    calc_check_digit,
+    convert_cusips_from_8_to_9_digit,
+    write_text_if_changed,
 )
 
 
@@ -40,6 +50,38 @@ def test_groupby_weighted_average():
     pd.testing.assert_series_equal(result, expected)
 
 
+def test_groupby_weighted_average_columns_and_transform():
+    df = pd.DataFrame(
+        {
+            "trade_direction": ["RECEIVED", "RECEIVED", "DELIVERED", None],
+            "rate": [2, 3, 2, 5],
+            "haircut": [0.1, None, 0.3, 0.2],
+            "start_leg_amount": [100, 200, 100, 50],
+        },
+        index=[10, 11, 12, 13],
+    )
+    before = df.copy()
+    result = groupby_weighted_average(
+        data_col=["rate", "haircut"],
+        weight_col="start_leg_amount",
+        by_col="trade_direction",
+        data=df,
+    )
+    pd.testing.assert_frame_equal(df, before)
+    assert result.loc["RECEIVED", "haircut"] == 0.1
+    rows = groupby_weighted_average(
+        data_col="rate",
+        weight_col="start_leg_amount",
+        by_col="trade_direction",
+        data=df,
+        transform=True,
+        new_column_name="wavg_rate",
+    )
+    assert rows.name == "wavg_rate"
+    assert list(rows.index) == [10, 11, 12, 13]
+    np.testing.assert_allclose(rows.to_numpy(), [8 / 3, 8 / 3, 2.0, np.nan])
+
+
 def test_groupby_weighted_std():
     df_nccb = pd.DataFrame(
         {
@@ -70,6 +112,121 @@ def test_groupby_weighted_std():
     pd.testing.assert_series_equal(result, expected)
 
 
+def test_groupby_weighted_std_columns_and_transform():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "date": rng.integers(0, 10, 300),
+            "rate": rng.normal(100, 1, 300),
+            "spread": rng.normal(size=300),
+            "volume": rng.uniform(0, 5, 300),
+        }
+    )
+    kwargs = dict(weight_col="volume", by_col="date", data=df)
+    wide = groupby_weighted_std(data_col=["rate", "spread"], **kwargs)
+    for col in ["rate", "spread"]:
+        single = groupby_weighted_std(data_col=col, **kwargs)
+        one_pass = groupby_weighted_std(data_col=col, method="one_pass", **kwargs)
+        pd.testing.assert_series_equal(wide[col], single, check_names=False)
+        pd.testing.assert_series_equal(one_pass, single)
+    rows = groupby_weighted_std(data_col="rate", transform=True, **kwargs)
+    np.testing.assert_allclose(rows.to_numpy(), wide["rate"].loc[df["date"]].to_numpy())
+
+
+def test_groupby_weighted_quantiles():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "date": rng.integers(0, 20, 500),
+            "rate": rng.normal(size=500),
+            "volume": rng.uniform(0, 5, 500),
+        }
+    )
+    quantiles = [0.0, 0.25, 0.5, 0.75, 1.0]
+    result = groupby_weighted_quantiles(
+        data_col="rate", weight_col="volume", by_col="date", data=df, quantiles=quantiles
+    )
+    for date, group in df.groupby("date"):
+        expected = weighted_quantile(group["rate"], quantiles, sample_weight=group["volume"])
+        np.testing.assert_allclose(result.loc[date].to_numpy(), expected)
+
+
+def test_with_lagged_columns_respects_gaps():
+    df = pd.DataFrame(
+        {
+            "id": ["A", "A", "A", "B", "B", "B", "B"],
+            "date": pd.to_datetime(
+                ["1990-01-01", "1990-02-01", "1990-03-01",
+                 "1990-01-01", "1990-02-01", "1990-04-01", "1990-05-01"]
+            ),
+            "value": [1.0, 2.0, 3.0, 10.0, 20.0, 40.0, 50.0],
+        }
+    )
+    df["other"] = -df["value"]
+    result = with_lagged_columns(
+        df=df, column_to_lag=["value", "other"], id_column="id", lags=[1, 2], freq="MS"
+    )
+    b = result[result["id"] == "B"].set_index("date")
+    assert np.isnan(b.loc["1990-04-01", "L1_value"])
+    assert b.loc["1990-04-01", "L2_value"] == 20.0
+    assert b.loc["1990-05-01", "L1_other"] == -40.0
+    assert np.isnan(b.loc["1990-03-01", "value"]) and b.loc["1990-03-01", "L1_value"] == 20.0
+    single = with_lagged_columns(df=df, column_to_lag="value", id_column="id", lags=1, freq="MS")
+    pd.testing.assert_series_equal(
+        single.set_index(["id", "date"])["L1_value"],
+        result.set_index(["id", "date"])["L1_value"].loc[single.set_index(["id", "date"]).index],
+    )
+
+
+def test_convert_cusips_from_8_to_9_digit():
+    cusips = pd.Series(["03783310", "59491810", "38259P50"])
+    result = convert_cusips_from_8_to_9_digit(cusips)
+    expected = pd.Series(["037833100", "594918104", "38259P508"])
+    pd.testing.assert_series_equal(result, expected)
+    assert calc_check_digit("03783310") == "0"
+
+
+def test_dataframe_set_difference_hash_matches_merge():
+    old = pd.DataFrame(
+        {"gvkey": ["001", "002", "003", "004"], "atq": [1.0, None, 3.0, 4.0]},
+        index=[10, 11, 12, 13],
+    )
+    new = pd.DataFrame(
+        {"gvkey": ["001", "002", "003", "005"], "atq": [1.0, None, 3.5, 5.0]},
+        index=[20, 21, 22, 23],
+    )
+    expected_numbers, expected_rows = dataframe_set_difference(new, old)
+    for chunksize in [None, 1]:
+        numbers, rows = dataframe_set_difference(new, old, method="hash", chunksize=chunksize)
+        assert numbers == expected_numbers == [22, 23]
+        pd.testing.assert_frame_equal(rows, expected_rows)
+
+
+def test_leave_one_out_sums_and_means():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "quarter": rng.integers(0, 30, 400),
+            "assets": rng.lognormal(size=400),
+            "equity": rng.normal(size=400),
+            "weight": rng.uniform(size=400),
+        }
+    )
+    g = df.groupby("quarter")
+    sums = leave_one_out_sums(df, groupby=["quarter"], summed_col=["assets", "equity"])
+    pd.testing.assert_series_equal(
+        sums["assets"], g["assets"].transform(lambda x: x.sum() - x)
+    )
+    weighted = leave_one_out_sums(df, groupby="quarter", summed_col="equity", weight_col="weight")
+    expected = df.assign(wx=df["equity"] * df["weight"]).groupby("quarter")["wx"].transform(
+        lambda x: x.sum() - x
+    )
+    np.testing.assert_allclose(weighted.to_numpy(), expected.to_numpy())
+    means = leave_one_out_means(df, groupby=["quarter"], mean_col="assets")
+    counts = g["assets"].transform("count") - 1
+    np.testing.assert_allclose(means.to_numpy(), (sums["assets"] / counts.where(counts > 0)).to_numpy())
+
+
 def test_get_most_recent_quarter_end():
     d = pd.to_datetime("2019-10-21")
     result = get_most_recent_quarter_end(d)
@@ -82,3 +239,26 @@ def test_get_next_quarter_start():
     result = get_next_quarter_start(d)
     expected = pd.Timestamp("2020-01-01")
     assert result == expected
+
+
+def test_quarter_helpers_accept_arrays():
+    dates = pd.Series(pd.to_datetime(["2019-10-21 00:00", "2020-03-31 12:00", None, "1960-01-01 00:00"]))
+    ends = get_most_recent_quarter_end(dates)
+    starts = get_next_quarter_start(pd.DatetimeIndex(dates))
+    for d, end, start in zip(dates, ends, starts):
+        if pd.isna(d):
+            assert pd.isna(end) and pd.isna(start)
+        else:
+            assert end == get_most_recent_quarter_end(d)
+            assert start == get_next_quarter_start(d)
+
+
+def test_write_text_if_changed(tmp_path):
+    out = tmp_path / "table.tex"
+    assert write_text_if_changed(out, "a & b")
+    mtime = out.stat().st_mtime_ns
+    assert not write_text_if_changed(out, "a & b")
+    assert out.stat().st_mtime_ns == mtime
+    assert write_text_if_changed(out, "a & c")
+    assert out.read_text(encoding="utf-8") == "a & c"
+    assert list(tmp_path.iterdir()) == [out]
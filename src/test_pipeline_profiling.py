@@ -0,0 +1,93 @@
+import json
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import config
+import pipeline_profiling
+from pipeline_profiling import stage, stage_timer, profiled_run, record_bytes, set_rows
+
+
+@pytest.fixture
+def profiling(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PROFILE_PIPELINE", True)
+    monkeypatch.setattr(config, "PROFILE_DUMP", "")
+    monkeypatch.setattr(config, "OUTPUT_DIR", tmp_path)
+    pipeline_profiling.reset_run_report()
+    yield tmp_path
+    pipeline_profiling.reset_run_report()
+
+
+@stage()
+def _inner(df):
+    big = np.ones(2_000_000)
+    return df.assign(total=big[:len(df)].sum())
+
+
+@stage(name="outer")
+def _outer(df):
+    with stage_timer("manual") as record:
+        set_rows(rows_in=3, rows_out=2)
+        record_bytes(100)
+        record_bytes(28)
+    return _inner(df)
+
+
+@profiled_run("toy")
+def _main(UPDATED=False, n=5):
+    return _outer(pd.DataFrame({'x': range(n)}))
+
+
+def _load_report(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_nested_stages_and_report(profiling):
+    assert not tracemalloc.is_tracing()
+    _main()
+    assert not tracemalloc.is_tracing()
+
+    report = _load_report(profiling / "run_report_toy.json")
+    assert report["params"] == {"UPDATED": False, "n": 5}
+    stages = {rec["stage"]: rec for rec in report["stages"]}
+    inner, outer = stages[f"{__name__}._inner"], stages["outer"]
+    main = stages[f"{__name__}._main"]
+
+    assert (inner["depth"], outer["depth"], main["depth"]) == (2, 1, 0)
+    assert inner["rows_in"] == inner["rows_out"] == 5
+    assert stages["manual"]["rows_in"] == 3 and stages["manual"]["rows_out"] == 2
+    assert stages["manual"]["bytes_fetched"] == 128
+    # The parent's peak covers the child's 16 MB array and its time covers the child's
+    assert inner["peak_memory_bytes"] >= 16_000_000
+    assert main["peak_memory_bytes"] >= outer["peak_memory_bytes"] >= inner["peak_memory_bytes"]
+    assert main["wall_time_s"] >= outer["wall_time_s"] >= inner["wall_time_s"]
+
+
+def test_positional_updated_gets_its_own_report(profiling):
+    _main()
+    _main(True)
+    assert _load_report(profiling / "run_report_toy.json")["params"]["UPDATED"] is False
+    assert _load_report(profiling / "run_report_toy_updated.json")["params"]["UPDATED"] is True
+
+
+def test_cprofile_dump(profiling, monkeypatch):
+    monkeypatch.setattr(config, "PROFILE_DUMP", "cprofile")
+    _main()
+    stages = {rec["stage"]: rec for rec in _load_report(profiling / "run_report_toy.json")["stages"]}
+    # main() is never dumped, so its top-level child is, and the nested stages are not
+    assert stages[f"{__name__}._main"]["profile"] is None
+    assert stages["outer"]["profile"] == str(profiling / "profiles" / "outer.prof")
+    assert stages[f"{__name__}._inner"]["profile"] is None
+    assert (profiling / "profiles" / "outer.prof").stat().st_size > 0
+
+
+def test_disabled_records_nothing(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PROFILE_PIPELINE", False)
+    monkeypatch.setattr(config, "OUTPUT_DIR", tmp_path)
+    pipeline_profiling.reset_run_report()
+    assert len(_main(n=3)) == 3
+    assert pipeline_profiling._records == []
+    assert not list(tmp_path.iterdir())
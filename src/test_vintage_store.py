@@ -0,0 +1,27 @@
+import numpy as np
+
+import synthetic_data
+import vintage_store
+
+
+def test_diff_vintages_finds_revised_cells(tmp_path):
+    fundq = synthetic_data.make_fundq_panel(n_firms=20, n_years=5, missing_frac=0).drop(columns=["datadate"])
+    keys = dict(key_cols=["gvkey", "datafqtr"], partition_col="datafqtr", vintage_dir=tmp_path)
+    old = vintage_store.save_vintage(fundq, "fundq", vintage="v1", **keys)
+
+    revised = fundq.copy()
+    revised.loc[revised.index[3], "total_assets"] += 1.0
+    revised = revised.drop(index=revised.index[10])
+    new = vintage_store.save_vintage(revised, "fundq", vintage="v2", **keys)
+    # Saving identical data again does not create a new vintage
+    assert vintage_store.save_vintage(revised, "fundq", **keys) == "v2"
+    assert vintage_store.list_vintages("fundq", vintage_dir=tmp_path) == ["v1", "v2"]
+
+    changes = vintage_store.diff_vintages("fundq", old, new, vintage_dir=tmp_path)
+    assert sorted(changes["change"]) == ["modified", "removed"]
+    modified = changes[changes["change"] == "modified"].iloc[0]
+    assert modified["column"] == "total_assets"
+    assert np.isclose(modified["new_value"] - modified["old_value"], 1.0)
+    expected = sorted({fundq.loc[fundq.index[3], "datafqtr"], fundq.loc[fundq.index[10], "datafqtr"]})
+    assert vintage_store.affected_periods(changes, "datafqtr") == expected
+    assert len(vintage_store.changed_partitions("fundq", old, new, vintage_dir=tmp_path)) == len(expected)
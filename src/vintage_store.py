@@ -0,0 +1,210 @@
+"""
+vintage_store.py
+
+Keeps each pull of a dataset (Compustat fundq, FRED series, ...) as an immutable
+snapshot ("vintage"), so that revisions between pulls can be detected cheaply.
+
+Each vintage is stored as VINTAGE_DIR/<dataset>/<vintage>/data.parquet together with a
+manifest.json that records the key columns, the partition column and a hash for each
+partition (e.g. each quarter). The partition hash combines the 64-bit row hashes of the
+partition's rows, sorted by key.
+
+Comparing two vintages then only needs the manifests to find the partitions that
+changed. Only those partitions are read back from parquet, and within them the changed
+rows are found with the hash-based `dataframe_set_difference`.
+
+```
+save_vintage(fundq, "table03_fundq", key_cols=["gvkey", "datafqtr"], partition_col="datafqtr")
+old, new = list_vintages("table03_fundq")[-2:]
+changes = diff_vintages("table03_fundq", old, new)
+quarters_to_recompute = affected_periods(changes, "datafqtr")
+```
+
+The result of `diff_vintages` has one row per changed cell: the key columns, the column
+that changed (None for added/removed rows), the old and new values and the kind of change
+("added", "removed" or "modified").
+"""
+
+import hashlib
+import json
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+from misc_tools import dataframe_set_difference
+
+ROW_GROUP_SIZE = 100_000
+
+
+def _vintage_root(dataset, vintage_dir=None):
+    return Path(vintage_dir or config.VINTAGE_DIR) / dataset
+
+
+def partition_hashes(df, key_cols, partition_col):
+    """Hash of each partition of df: sha256 of the row hashes of its rows sorted by key."""
+    if len(df) == 0:
+        return {}
+    df = df.sort_values([partition_col, *key_cols], kind="stable")
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    partitions = df[partition_col].astype(str).to_numpy()
+    bounds = np.flatnonzero(partitions[1:] != partitions[:-1]) + 1
+    starts = np.concatenate([[0], bounds])
+    ends = np.concatenate([bounds, [len(df)]])
+    return {
+        partitions[start]: hashlib.sha256(row_hashes[start:end].tobytes()).hexdigest()
+        for start, end in zip(starts, ends)
+    }
+
+
+def list_vintages(dataset, vintage_dir=None):
+    """Names of the saved vintages of a dataset, oldest first."""
+    root = _vintage_root(dataset, vintage_dir)
+    if not root.exists():
+        return []
+    return sorted(p.name for p in root.iterdir() if (p / "manifest.json").exists())
+
+
+def load_manifest(dataset, vintage, vintage_dir=None):
+    path = _vintage_root(dataset, vintage_dir) / vintage / "manifest.json"
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_vintage(df, dataset, key_cols, partition_col, vintage=None, vintage_dir=None):
+    """
+    Save df as a new immutable vintage of `dataset` and return the vintage name.
+
+    If df is identical to the latest vintage (same partition hashes), nothing is written
+    and the latest vintage name is returned. Existing vintages are never overwritten.
+    """
+    key_cols = list(key_cols)
+    hashes = partition_hashes(df, key_cols, partition_col)
+    existing = list_vintages(dataset, vintage_dir)
+    if existing and load_manifest(dataset, existing[-1], vintage_dir)["partitions"] == hashes:
+        print(f"{dataset}: unchanged since vintage {existing[-1]}")
+        return existing[-1]
+
+    vintage = vintage or datetime.now().strftime("%Y%m%dT%H%M%S")
+    folder = _vintage_root(dataset, vintage_dir) / vintage
+    if folder.exists():
+        raise FileExistsError(f"Vintage {vintage} of {dataset} already exists at {folder}")
+    folder.mkdir(parents=True)
+    # Sorted by partition, so that row-group statistics let readers skip unchanged partitions
+    df.sort_values([partition_col, *key_cols], kind="stable").to_parquet(
+        folder / "data.parquet", index=False, row_group_size=ROW_GROUP_SIZE
+    )
+    manifest = {
+        "dataset": dataset,
+        "vintage": vintage,
+        "saved_at": datetime.now().isoformat(timespec="seconds"),
+        "key_cols": key_cols,
+        "partition_col": partition_col,
+        "n_rows": int(len(df)),
+        "partitions": hashes,
+    }
+    # Written last, so a vintage only counts as saved once its data is complete
+    (folder / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    print(f"{dataset}: saved vintage {vintage} ({len(df)} rows, {len(hashes)} partitions)")
+    return vintage
+
+
+def load_vintage(dataset, vintage=None, partitions=None, vintage_dir=None):
+    """Load a vintage (the latest by default), optionally only some partitions."""
+    if vintage is None:
+        vintages = list_vintages(dataset, vintage_dir)
+        if not vintages:
+            raise FileNotFoundError(f"No vintages saved for {dataset}")
+        vintage = vintages[-1]
+    manifest = load_manifest(dataset, vintage, vintage_dir)
+    path = _vintage_root(dataset, vintage_dir) / vintage / "data.parquet"
+    if partitions is None:
+        return pd.read_parquet(path)
+    partition_col = manifest["partition_col"]
+    # Partitions are stored as strings in the manifest; filter on the typed values
+    values = pd.read_parquet(path, columns=[partition_col])[partition_col].drop_duplicates()
+    values = values[values.astype(str).isin(list(partitions))].tolist()
+    if not values:
+        return pd.read_parquet(path).iloc[:0]
+    df = pd.read_parquet(path, filters=[(partition_col, "in", values)])
+    return df.reset_index(drop=True)
+
+
+def changed_partitions(dataset, old_vintage, new_vintage, vintage_dir=None):
+    """Partitions that were added, removed or whose contents differ between two vintages."""
+    old = load_manifest(dataset, old_vintage, vintage_dir)["partitions"]
+    new = load_manifest(dataset, new_vintage, vintage_dir)["partitions"]
+    return sorted(p for p in set(old) | set(new) if old.get(p) != new.get(p))
+
+
+def _changed_cells(old_rows, new_rows, key_cols):
+    """Long frame of cell-level changes between rows of two vintages with the same keys."""
+    value_cols = [c for c in new_rows.columns if c not in key_cols]
+    old_rows = old_rows.drop_duplicates(subset=key_cols)
+    new_rows = new_rows.drop_duplicates(subset=key_cols)
+    merged = old_rows.merge(new_rows, on=key_cols, how="outer", suffixes=("_old", "_new"), indicator=True)
+
+    changes = []
+    for kind, side in [("added", "right_only"), ("removed", "left_only")]:
+        rows = merged.loc[merged["_merge"] == side, key_cols].assign(
+            column=None, old_value=None, new_value=None, change=kind
+        )
+        changes.append(rows)
+
+    both = merged[merged["_merge"] == "both"]
+    for col in value_cols:
+        old_values, new_values = both[f"{col}_old"], both[f"{col}_new"]
+        differs = ~((old_values == new_values) | (old_values.isna() & new_values.isna()))
+        if differs.any():
+            changes.append(
+                both.loc[differs, key_cols].assign(
+                    column=col,
+                    old_value=old_values[differs].astype(object),
+                    new_value=new_values[differs].astype(object),
+                    change="modified",
+                )
+            )
+    changes = [c for c in changes if not c.empty]
+    if not changes:
+        return pd.DataFrame(columns=[*key_cols, "column", "old_value", "new_value", "change"])
+    return pd.concat(changes, ignore_index=True).sort_values(key_cols, kind="stable").reset_index(drop=True)
+
+
+def diff_vintages(dataset, old_vintage, new_vintage, vintage_dir=None):
+    """
+    Cell-level changes between two vintages of a dataset. Only partitions whose hashes
+    differ are loaded and compared.
+    """
+    manifest = load_manifest(dataset, new_vintage, vintage_dir)
+    key_cols = manifest["key_cols"]
+    partitions = changed_partitions(dataset, old_vintage, new_vintage, vintage_dir)
+    old = load_vintage(dataset, old_vintage, partitions=partitions, vintage_dir=vintage_dir)
+    new = load_vintage(dataset, new_vintage, partitions=partitions, vintage_dir=vintage_dir)
+    columns = [c for c in new.columns if c in old.columns]
+    old, new = old[columns], new[columns]
+
+    # Rows present in only one of the vintages (a modified row is in both lists)
+    new_only, _ = dataframe_set_difference(new, old, method="hash")
+    old_only, _ = dataframe_set_difference(old, new, method="hash")
+    return _changed_cells(old.loc[old_only], new.loc[new_only], key_cols)
+
+
+def affected_periods(changes, period_col):
+    """Sorted unique periods (e.g. quarters or dates) touched by the changes from diff_vintages."""
+    return sorted(changes[period_col].dropna().unique().tolist())
+
+
+def snapshot_and_report(df, dataset, key_cols, partition_col, vintage_dir=None):
+    """
+    Save df as a vintage and, if there is a previous vintage, print which periods were
+    revised. Returns the cell-level changes (empty for the first vintage).
+    """
+    previous = list_vintages(dataset, vintage_dir)
+    vintage = save_vintage(df, dataset, key_cols, partition_col, vintage_dir=vintage_dir)
+    if not previous or previous[-1] == vintage:
+        return pd.DataFrame(columns=[*key_cols, "column", "old_value", "new_value", "change"])
+    changes = diff_vintages(dataset, previous[-1], vintage, vintage_dir=vintage_dir)
+    periods = affected_periods(changes, partition_col)
+    print(f"{dataset}: {len(changes)} changed cells in {len(periods)} {partition_col} values since {previous[-1]}")
+    return changes